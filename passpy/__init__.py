@@ -16,10 +16,39 @@
 
 from .exceptions import (
     StoreNotInitialisedError,
-    RecursiveCopyMoveError
+    RecursiveCopyMoveError,
+    OperationTimeoutError,
+    OperationCancelledError
+)
+from .cancel import CancellationToken
+from .gpg import (
+    CryptoBackend,
+    GPGBackend,
+    GPGMEBackend
 )
 from .store import Store
-from .util import gen_password
+from .entry import Entry
+from .committer import (
+    DURABILITY_IMMEDIATE,
+    DURABILITY_BATCHED,
+    DURABILITY_MANUAL
+)
+from .bundle import BundleStore
+from .multistore import MultiStore
+from .snapshot import SnapshotStore
+from .watch import (
+    Watcher,
+    KeyAdded,
+    KeyChanged,
+    KeyRemoved,
+    KeyMoved,
+    GPGIdChanged
+)
+from .util import (
+    gen_password,
+    gen_passwords,
+    PasswordPolicy
+)
 
 __version__ = '1.0'
 VERSION = __version__
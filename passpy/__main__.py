@@ -17,21 +17,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import errno
+import glob
 import locale
 import os
+import time
 
 import click
 import pyperclip
 
-from git import (
-    GitCommandError
-)
-
 from passpy import (
+    Entry,
     Store,
+    MultiStore,
     StoreNotInitialisedError,
-    RecursiveCopyMoveError
+    RecursiveCopyMoveError,
+    PasswordPolicy,
+    KeyAdded,
+    KeyChanged,
+    KeyRemoved,
+    KeyMoved,
+    GPGIdChanged
 )
+from passpy.audit import DEFAULT_MIN_ENTROPY
+from passpy.git import GitCommandError
+from passpy.gpg import SCHEDULER
+from passpy.util import CHARACTER_CLASSES
 
 
 # Message constants
@@ -40,6 +51,17 @@ MSG_STORE_NOT_INITIALISED_ERROR = ('You need to call {0} init first.'
 MSG_PERMISSION_ERROR = 'Nah-ah!'
 MSG_FILE_NOT_FOUND = 'Error: {0} is not in the password store.'
 MSG_RECURSIVE_COPY_MOVE_ERROR = 'Error: Can\'t {0} a directory into itself.'
+MSG_NO_INDEX = ('Error: there is no metadata index. Try "{0} index".'
+                .format(__name__))
+MSG_NOT_A_GIT_REPOSITORY = ('Error: the password store is not a git '
+                            'repository. Try "{0} git init".'
+                            .format(__name__))
+
+# How `passpy sync` reports changed keys.
+SYNC_ACTIONS = {KeyAdded: 'Added', KeyChanged: 'Changed', KeyRemoved: 'Removed'}
+
+# The number of bytes copied at once when streaming keys.
+CHUNK_SIZE = 64 * 1024
 
 # Tree constants
 if locale.getdefaultlocale()[1].startswith('UTF'):
@@ -171,33 +193,111 @@ class PassGroup(click.Group):
               'you can set the PYPASS_GIT_BIN environment variable '
               'with the path.')
 @click.option('--store-dir', envvar=['PYPASS_STORE_DIR', 'PASSWORD_STORE_DIR'],
-              default='~/.password-store',
+              type=click.Path(), multiple=True,
+              default=['~/.password-store'],
               help='The path to the directory to use for the '
               'password store.  Alternatively you can set the '
-              'PYPASS_STORE_DIR environment variable with the path.')
+              'PYPASS_STORE_DIR environment variable with the path.  '
+              'Given several times, or as a list separated by `{0}` in '
+              'the environment variable, all stores are mounted under '
+              'their directory name, or under PREFIX if given as '
+              'PREFIX=PATH.'.format(os.pathsep))
 @click.option('--no-agent', envvar='PYPASS_NO_AGENT', is_flag=True,
               help='Pass this along if you don\'t have an ssh agent '
               'running.  Alternatively you can set the PYPASS_NO_AGENT '
               'environment variable.', default=False)
+@click.option('--backend', envvar='PYPASS_BACKEND', default='gpg',
+              type=click.Choice(['gpg', 'gpgme']),
+              help='The crypto backend to use.  `gpg` runs the gpg '
+              'binary for every operation, `gpgme` uses the GPGME '
+              'Python bindings in-process.  '
+              'Alternatively you can set the PYPASS_BACKEND '
+              'environment variable.')
+@click.option('--rekey', envvar='PYPASS_REKEY', is_flag=True,
+              default=False,
+              help='When keys need to be reencrypted for new gpg-ids, '
+              'only encrypt their session keys for the new ids instead '
+              'of reencrypting the whole key.  Needs PGPy to be '
+              'installed.  Alternatively you can set the PYPASS_REKEY '
+              'environment variable.')
+@click.option('--gpg-jobs', envvar='PYPASS_GPG_JOBS', type=int,
+              default=None,
+              help='The maximum number of gpg operations running at '
+              'once.  Defaults to the number of CPUs.  Alternatively '
+              'you can set the PYPASS_GPG_JOBS environment variable.')
+@click.option('--skip-unchanged', envvar='PYPASS_SKIP_UNCHANGED',
+              is_flag=True, default=False,
+              help='Don\'t encrypt, write or commit keys whose content '
+              'and gpg-ids did not change.  Alternatively you can set '
+              'the PYPASS_SKIP_UNCHANGED environment variable.')
+@click.option('--timeout', envvar='PYPASS_TIMEOUT', type=float,
+              default=None,
+              help='Give up on any command running gpg or git for more '
+              'than this many seconds.  Alternatively you can set the '
+              'PYPASS_TIMEOUT environment variable.')
+@click.option('--track-access', envvar='PYPASS_TRACK_ACCESS',
+              is_flag=True, default=False,
+              help='Count which passwords are shown, so `warm` knows '
+              'which ones to decrypt.  Alternatively you can set the '
+              'PYPASS_TRACK_ACCESS environment variable.')
 @click.pass_context
-def cli(ctx, gpg_bin, git_bin, store_dir, no_agent):
+def cli(ctx, gpg_bin, git_bin, store_dir, no_agent, backend, rekey,
+        gpg_jobs, skip_unchanged, timeout, track_access):
     """passpy is a password manager compatible with ZX2C4's pass written
     in Python.
 
     """
+    if gpg_jobs is not None:
+        SCHEDULER.set_max_jobs(gpg_jobs)
     if no_agent:
         use_agent = False
     else:
         use_agent = True
-    ctx.obj = Store(gpg_bin, git_bin, store_dir, use_agent, True, True)
+    stores = {}
+    for spec in store_dir:
+        prefix, sep, path = spec.partition('=')
+        if not sep:
+            path = spec
+            prefix = os.path.basename(os.path.normpath(
+                os.path.expanduser(spec))).lstrip('.')
+        if prefix in stores:
+            raise click.BadParameter('More than one store would be mounted '
+                                     'under {0}.'.format(prefix),
+                                     param_hint='--store-dir')
+        stores[prefix] = Store(gpg_bin, git_bin, path, use_agent, True,
+                               True, backend=backend, rekey=rekey,
+                               skip_unchanged=skip_unchanged,
+                               timeout=timeout,
+                               track_access=track_access)
+    if len(stores) == 1:
+        ctx.obj = list(stores.values())[0]
+    else:
+        ctx.obj = MultiStore(stores)
+    # Saves what later runs plan with, see Store.close.
+    ctx.call_on_close(ctx.obj.close)
+
+
+def _echo_plan(plan):
+    click.echo('Would reencrypt {0} keys, copy {1}, remove {2} and stage '
+               '{3} files ({4} bytes).'
+               .format(plan['reencrypt'], plan['copy'], plan['remove'],
+                       plan['stage'], plan['bytes']))
+    if plan['latency_measured']:
+        source = 'measured'
+    else:
+        source = 'assumed, nothing measured yet'
+    click.echo('Estimated duration: {0:.1f} s ({1:.3f} s per gpg call, {2}).'
+               .format(plan['seconds'], plan['latency'], source))
 
 
-@cli.command(options_metavar='[ --path,-p ]')
+@cli.command(options_metavar='[ --path,-p ] [ --dry-run ]')
 @click.option('-p', '--path', type=str,
               help='Only set the gpg-ids for the given subfolder.')
+@click.option('--dry-run', '--plan', 'dry_run', is_flag=True,
+              help='Only show what would be done.')
 @click.argument('gpg_ids', nargs=-1, metavar='gpg-id')
 @click.pass_context
-def init(ctx, gpg_ids, path):
+def init(ctx, gpg_ids, path, dry_run):
     """Initialize new password storage and use `gpg-id` for encryption.
     Mutliple gpg-ids may be specified, in order to encrypt each
     password with multiple ids.  This command must be run first before
@@ -210,15 +310,21 @@ def init(ctx, gpg_ids, path):
     assigned for that specific sub folder of the password store.  If
     only the gpg-id is given, and it is an empty string then the
     current `.gpg-id` file for the specfified `sub-folder` (or root if
-    unspecified) is removed.
+    unspecified) is removed.  If `--dry-run` or `--plan` is
+    specified, only show how many keys would be reencrypted and how
+    long that would take.
 
     """
     try:
-        ctx.obj.init_store(list(gpg_ids), path=path)
+        plan = ctx.obj.init_store(list(gpg_ids), path=path, dry_run=dry_run)
     except PermissionError:
         click.echo(MSG_PERMISSION_ERROR)
         return 1
 
+    if dry_run:
+        _echo_plan(plan)
+        return
+
     click.echo('Password store initialised for {0}.'
                .format(','.join(gpg_ids)))
 
@@ -252,20 +358,43 @@ def ls(ctx, subfolder, passthrough=False):
     _print_tree(tree)
 
 
-@cli.command()
+@cli.command(options_metavar='[ --path,-p ] [ --glob,-g ] '
+             '[ --name-regex,-r ] [ --max-size,-s ]')
+@click.option('-p', '--path', type=str, default='',
+              help='Only search the passwords below this subfolder.')
+@click.option('-g', '--glob', 'name_glob', type=str, default=None,
+              help='Only search passwords whose name matches this '
+              'shell-style pattern.')
+@click.option('-r', '--name-regex', type=str, default=None,
+              help='Only search passwords whose name matches this '
+              'regular expression.')
+@click.option('-s', '--max-size', type=int, default=None,
+              help='Only search password files of at most this many '
+              'bytes.')
 @click.argument('search_string', type=str, metavar='search-string')
 @click.pass_context
-def grep(ctx, search_string):
+def grep(ctx, search_string, path, name_glob, name_regex, max_size):
     """Searches inside each decrypted password file for `search-string`,
     and displays line containing matched string along with filename.
-    `search-string` can be a regular expression.
+    `search-string` can be a regular expression.  With `--path`,
+    `--glob`, `--name-regex` or `--max-size` only the passwords
+    passing these filters are decrypted, and the number of skipped
+    passwords is reported.
 
     """
+    stats = {}
     try:
-        results = ctx.obj.search(search_string)
+        results = ctx.obj.search(search_string, path, name_glob,
+                                 name_regex, max_size, stats)
     except StoreNotInitialisedError:
         click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
         return 1
+    except FileNotFoundError:
+        click.echo(MSG_FILE_NOT_FOUND.format(path))
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR)
+        return 1
 
     for key in results:
         if os.path.dirname(key) != '':
@@ -279,6 +408,59 @@ def grep(ctx, search_string):
             click.secho(line[start:end], nl=False, fg='red', bold=True)
             click.echo(line[end:])
 
+    if path or name_glob or name_regex or max_size is not None:
+        click.echo('Decrypted {0} passwords, skipped {1}.'
+                   .format(stats.get('decrypted', 0),
+                           stats.get('skipped', 0)), err=True)
+
+
+@cli.command(options_metavar='[ --field,-f ] [ --exact,-e ]')
+@click.option('-f', '--field', type=str, default=None,
+              help='Only look at this field, e.g. url.')
+@click.option('-e', '--exact', is_flag=True,
+              help='Only show keys with a value equal to `term`.')
+@click.argument('term', type=str)
+@click.pass_context
+def query(ctx, term, field, exact):
+    """Lists the keys with a `key: value` line whose value contains
+    `term`, using the metadata index instead of decrypting every key.
+
+    """
+    if exact:
+        kwargs = {'equals': term}
+    else:
+        kwargs = {'contains': term}
+    try:
+        keys = ctx.obj.query(field, **kwargs)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except FileNotFoundError:
+        click.echo(MSG_NO_INDEX)
+        return 1
+
+    for key in keys:
+        click.echo(key)
+
+
+@cli.command(options_metavar='[ --drop ]')
+@click.option('--drop', is_flag=True,
+              help='Remove the metadata index.')
+@click.pass_context
+def index(ctx, drop):
+    """Creates or updates the encrypted metadata index used by `query`.
+    Once created, passpy keeps it up to date.
+
+    """
+    try:
+        if drop:
+            ctx.obj.drop_index()
+        else:
+            ctx.obj.build_index()
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+
 
 @cli.command()
 @click.argument('pass_names', type=str, nargs=-1, metavar='pass-name')
@@ -300,19 +482,28 @@ def find(ctx, pass_names):
     _print_tree(tree)
 
 
-@cli.command(options_metavar='[ --clip,-c ]')
+@cli.command(options_metavar='[ --clip,-c | --raw ]')
 @click.option('-c', '--clip', is_flag=True,
               help='Copy the password to the clipboard instead of '
               'printing it to the command line.')
+@click.option('--raw', is_flag=True,
+              help='Write the decrypted key unchanged to standard out.  '
+              'Use this for binary keys.')
 @click.argument('pass_name', type=str, metavar='pass-name', default='.')
 @click.pass_context
-def show(ctx, pass_name, clip, passthrough=False):
+def show(ctx, pass_name, clip, raw=False, passthrough=False):
     """Decrypt and print a password named `pass-name`.  If `--clip` or
     `-c` is specified, do not print the password but instead copy the
     first line to the clipboard using pyperclip.  On Linux you will
-    need to have xclip/xsel and on OSX pbcopy/pbpaste installed.
+    need to have xclip/xsel and on OSX pbcopy/pbpaste installed.  If
+    `--raw` is specified, the key is streamed unchanged to standard
+    out, e.g. to restore a binary file with `passpy show --raw
+    pass-name > file`.
 
     """
+    if raw:
+        return _show_raw(ctx, pass_name)
+
     try:
         data = ctx.obj.get_key(pass_name)
     except StoreNotInitialisedError:
@@ -339,17 +530,114 @@ def show(ctx, pass_name, clip, passthrough=False):
         click.echo(data, nl=False)
 
 
-@cli.command(options_metavar='[ --echo,-e | --multiline,-m ] [ --force,-f ]')
+@cli.command('exec', options_metavar='[ --env,-e ]...',
+             context_settings={'ignore_unknown_options': True})
+@click.option('-e', '--env', 'env_specs', multiple=True,
+              metavar='NAME=pass-name[#field]',
+              help='Set the environment variable NAME to the password '
+              'of `pass-name`, or to the value of `field` if given.  '
+              'May be given several times.')
+@click.argument('command', nargs=-1, required=True, type=click.UNPROCESSED)
+@click.pass_context
+def exec_(ctx, env_specs, command):
+    """Runs `command` with passwords in its environment, e.g.
+    `passpy exec -e DB_PASS=prod/db -e DB_USER=prod/db#user -- server`.
+    All passwords are decrypted in parallel, each key only once,
+    before passpy replaces itself with `command`.  Nothing is written
+    to disk.
+
+    """
+    refs = {}
+    for spec in env_specs:
+        name, sep, ref = spec.partition('=')
+        if not sep or name == '' or ref == '':
+            click.echo('Error: {0} is not of the form '
+                       'NAME=pass-name[#field].'.format(spec))
+            return 1
+        pass_name, _, field = ref.partition('#')
+        refs[name] = (pass_name, field or None)
+
+    try:
+        keys = ctx.obj.get_keys([pass_name for pass_name, _
+                                 in refs.values()])
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except FileNotFoundError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR)
+        return 1
+
+    env = dict(os.environ)
+    for name, (pass_name, field) in refs.items():
+        entry = Entry(keys[pass_name], pass_name)
+        if field is None:
+            env[name] = entry.password
+        elif field in entry:
+            env[name] = entry[field]
+        else:
+            click.echo('Error: {0} has no field {1}.'
+                       .format(pass_name, field))
+            return 1
+
+    # Nothing registered with atexit runs after exec.
+    ctx.obj.close()
+    try:
+        os.execvpe(command[0], list(command), env)
+    except OSError as e:
+        click.echo('Error: could not run {0}: {1}'
+                   .format(command[0], e.strerror))
+        return 1
+
+
+def _show_raw(ctx, pass_name):
+    """Stream a decrypted key to standard out.
+
+    Helper for :func:`passpy.__main__.show`.
+
+    :param str pass_name: The key to show.
+
+    """
+    try:
+        key_file = ctx.obj.open_key(pass_name, 'rb')
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR, err=True)
+        return 1
+    except (FileNotFoundError, ValueError):
+        click.echo(MSG_FILE_NOT_FOUND.format(pass_name), err=True)
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR, err=True)
+        return 1
+
+    stdout = click.get_binary_stream('stdout')
+    try:
+        with key_file:
+            for chunk in iter(lambda: key_file.read(CHUNK_SIZE), b''):
+                stdout.write(chunk)
+    except OSError as e:
+        click.echo('Error: {0}'.format(e), err=True)
+        return 1
+    stdout.flush()
+
+
+@cli.command(options_metavar='[ --echo,-e | --multiline,-m | '
+             '--from-file ] [ --force,-f ]')
 @click.option('-e', '--echo', 'input_method', flag_value='echo',
               help='Don\'t ask to repeat the password.')
 @click.option('-m', '--multiline', 'input_method', flag_value='multiline',
               help='Allows entering multiple lines of text for the key.')
+@click.option('--from-file', type=click.File('rb'), default=None,
+              help='Read the key unchanged from the given file (`-` for '
+              'standard in).  Use this for binary keys.')
 @click.option('-f', '--force', is_flag=True,
               help='Any existing key at pass-name will be '
               'silently overwritten.')
 @click.argument('pass_name', type=str, metavar='pass-name')
 @click.pass_context
-def insert(ctx, pass_name, input_method, force):
+def insert(ctx, pass_name, input_method, force, from_file):
     """Insert a new password into the password store called `pass-name`.
     This will read the new password from standard in.  If `--echo` or
     `-e` are NOT specified, disable keyboard echo when the password is
@@ -358,9 +646,13 @@ def insert(ctx, pass_name, input_method, force):
     or Ctrl+D is reached.  Otherwise, only a single line from standard
     in read.  Prompt before overwriting an existing password, unless
     `--force` or `-f` is specified.  This command is alternatively
-    named `add`
+    named `add`.  With `--from-file` the key is streamed unchanged
+    from the given file.
 
     """
+    if from_file is not None:
+        return _insert_from_file(ctx, pass_name, from_file, force)
+
     if input_method is None:
         input_method = 'neither'
     if input_method == 'multiline':
@@ -390,6 +682,41 @@ def insert(ctx, pass_name, input_method, force):
         return 1
 
 
+def _insert_from_file(ctx, pass_name, from_file, force):
+    """Stream a file into a key.
+
+    Helper for :func:`passpy.__main__.insert`.
+
+    :param str pass_name: The key to write.
+
+    :param from_file: The file to read from.
+    :type from_file: file object
+
+    :param bool force: If ``True`` an existing key will be
+        overwritten.
+
+    """
+    try:
+        key_file = ctx.obj.open_key(pass_name, 'wb', force=force)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR)
+        return 1
+    except (FileExistsError, ValueError) as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    try:
+        with key_file:
+            for chunk in iter(lambda: from_file.read(CHUNK_SIZE), b''):
+                key_file.write(chunk)
+    except OSError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+
 @cli.command()
 @click.argument('pass_name', type=str, metavar='pass-name')
 @click.pass_context
@@ -423,7 +750,8 @@ def edit(ctx, pass_name):
 
 
 @cli.command(options_metavar='[ --no-symbols,-n ] [ --clip,-c ] '
-             '[ --in-place,-i ] [ --force,-f ]')
+             '[ --in-place,-i ] [ --force,-f ] [ --require,-r ] '
+             '[ --exclude,-x ] [ --batch,-b ]')
 @click.option('-n', '--no-symbols', is_flag=True,
               help='If specified the password will only consist '
               'of alphanumeric characters.')
@@ -436,10 +764,20 @@ def edit(ctx, pass_name):
 @click.option('-f', '--force', is_flag=True,
               help='Overwrite an existing key at pass-name without '
               'prompting the user first.')
+@click.option('-r', '--require', multiple=True,
+              type=click.Choice(sorted(CHARACTER_CLASSES)),
+              help='A character class every password has to contain.  '
+              'Can be given multiple times.')
+@click.option('-x', '--exclude', type=str, default='',
+              help='Characters that must not appear in the password.')
+@click.option('-b', '--batch', is_flag=True,
+              help='Read the names of the keys to generate passwords '
+              'for from the file pass-name, one per line.')
 @click.argument('pass_name', type=str, metavar='pass-name')
 @click.argument('pass_length', type=int, metavar='pass-length')
 @click.pass_context
-def generate(ctx, pass_name, pass_length, no_symbols, clip, in_place, force):
+def generate(ctx, pass_name, pass_length, no_symbols, clip, in_place, force,
+             require, exclude, batch):
     """Generate a new password of length `pass-length` and insert into
     `pass-name`.  If `--no-symbols` or `-n` is specified, do not use
     any non-alphanumeric characters in the generated password.  If
@@ -450,13 +788,29 @@ def generate(ctx, pass_name, pass_length, no_symbols, clip, in_place, force):
     specified.  If `--in-place` or `-i` is specified, do not
     interactively prompt, and only replace the first line of the
     password file with the new generated password, keeping the
-    remainder of the file intact.
+    remainder of the file intact.  `--require` or `-r` demands at
+    least one character of the given class and `--exclude` or `-x`
+    forbids the given characters.  If `--batch` or `-b` is specified,
+    `pass-name` is a file (or `-` for standard in) with one key per
+    line, optionally followed by its own password length, and all
+    passwords are generated and committed at once.
 
     """
     symbols = not no_symbols
+    try:
+        policy = PasswordPolicy(pass_length, symbols, list(require),
+                                exclude)
+    except ValueError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    if batch:
+        return _generate_batch(ctx, pass_name, policy, symbols, in_place,
+                               force, require, exclude)
+
     try:
         password = ctx.obj.gen_key(pass_name, pass_length, symbols,
-                                   force, in_place)
+                                   force, in_place, policy=policy)
     except StoreNotInitialisedError:
         click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
         return 1
@@ -478,24 +832,75 @@ def generate(ctx, pass_name, pass_length, no_symbols, clip, in_place, force):
         click.echo(password)
 
 
-@cli.command(options_metavar='[ --recursive,-r ] [ --force,-f ]')
+def _generate_batch(ctx, batch_file, policy, symbols, in_place, force,
+                    require, exclude):
+    """Generate passwords for all keys listed in a file.
+
+    Helper for :func:`passpy.__main__.generate`.
+
+    :param str batch_file: The file with one key name, optionally
+        followed by a password length, per line.  ``-`` reads from
+        standard in.
+
+    :param policy: The policy for keys without their own length.
+    :type policy: :class:`passpy.util.PasswordPolicy`
+
+    """
+    pass_names = []
+    policies = {}
+    with click.open_file(batch_file) as names_file:
+        for line in names_file:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            pass_names.append(fields[0])
+            try:
+                if len(fields) > 1:
+                    policies[glob.escape(fields[0])] = PasswordPolicy(
+                        int(fields[1]), symbols, list(require), exclude)
+            except ValueError as e:
+                click.echo('Error: {0}: {1}'.format(fields[0], e))
+                return 1
+    policies['*'] = policy
+
+    try:
+        ctx.obj.gen_keys(pass_names, policy.length, symbols, force,
+                         in_place, policies=policies)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR)
+        return 1
+    except FileExistsError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    click.echo('Generated passwords for {0} keys.'.format(len(pass_names)))
+
+
+@cli.command(options_metavar='[ --recursive,-r ] [ --force,-f ] '
+             '[ --dry-run ]')
 @click.option('-r', '--recursive', is_flag=True,
               help='If pass-name is a directory, also remove all '
               'it\'s contents.')
 @click.option('-f', '--force', is_flag=True, default=False,
               help='Don\'t prompt for confirmation when removing a key.')
+@click.option('--dry-run', '--plan', 'dry_run', is_flag=True,
+              help='Only show what would be done.')
 @click.argument('pass_name', type=str, metavar='pass-name')
 @click.pass_context
-def rm(ctx, pass_name, recursive, force):
+def rm(ctx, pass_name, recursive, force, dry_run):
     """Remove the password names `pass-name` from the password store.
     This command is alternatively named `remove` or `delete`.  If
     `--recursive` or `-r` is specified, delete pass-name recursively
     if it is a directory.  If `--force` or `-f` is specified, do not
-    interactively prompt before removal.
+    interactively prompt before removal.  If `--dry-run` or `--plan`
+    is specified, only show what would be removed.
 
     """
     try:
-        ctx.obj.remove_path(pass_name, recursive, force)
+        plan = ctx.obj.remove_path(pass_name, recursive, force, dry_run)
     except StoreNotInitialisedError:
         click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
         return 1
@@ -505,26 +910,39 @@ def rm(ctx, pass_name, recursive, force):
     except PermissionError:
         click.echo(MSG_PERMISSION_ERROR)
         return 1
+    except OSError as e:
+        if e.errno != errno.ENOTEMPTY:
+            raise
+        click.echo('Error: {0} is not empty, use --recursive to remove it.'
+                   .format(pass_name))
+        return 1
+
+    if dry_run:
+        _echo_plan(plan)
 
 
-@cli.command(options_metavar='[ --force,-f ]')
+@cli.command(options_metavar='[ --force,-f ] [ --dry-run ]')
 @click.option('-f', '--force', is_flag=True,
               help='If specified existing files at `new-path` '
               'will be silently overwritten.')
+@click.option('--dry-run', '--plan', 'dry_run', is_flag=True,
+              help='Only show what would be done.')
 @click.argument('old_path', type=str, metavar='old-path')
 @click.argument('new_path', type=str, metavar='old-path')
 @click.pass_context
-def mv(ctx, old_path, new_path, force):
+def mv(ctx, old_path, new_path, force, dry_run):
     """Renames the password or directory named `old-path` to `new-path`.
     This command is alternatively named `rename`.  If `--force` or
     `-f` is specified, silently overwrite `new-path` if it exists.  If
     `new-path` ends in a trailing '/', it is always treated as a
     directory.  Passwords are selectively reencrypted to the
-    corresponding keys of their new destination.
+    corresponding keys of their new destination.  If `--dry-run` or
+    `--plan` is specified, only show how many keys would be moved and
+    reencrypted.
 
     """
     try:
-        ctx.obj.move_path(old_path, new_path, force)
+        plan = ctx.obj.move_path(old_path, new_path, force, dry_run)
     except StoreNotInitialisedError:
         click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
         return 1
@@ -537,26 +955,36 @@ def mv(ctx, old_path, new_path, force):
     except RecursiveCopyMoveError:
         click.echo(MSG_RECURSIVE_COPY_MOVE_ERROR.format('move'))
         return 1
+    except (FileExistsError, ValueError) as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    if dry_run:
+        _echo_plan(plan)
 
 
-@cli.command(options_metavar='[ --force,-f ]')
+@cli.command(options_metavar='[ --force,-f ] [ --dry-run ]')
 @click.option('-f', '--force', is_flag=True,
               help='If specified existing files at `new-path` '
               'will be silently overwritten.')
+@click.option('--dry-run', '--plan', 'dry_run', is_flag=True,
+              help='Only show what would be done.')
 @click.argument('old_path', type=str, metavar='old-path')
 @click.argument('new_path', type=str, metavar='new-path')
 @click.pass_context
-def cp(ctx, old_path, new_path, force):
+def cp(ctx, old_path, new_path, force, dry_run):
     """Copies the password or directory names `old-path` to `new-path`.
     This command is alternatively named `copy`.  If `--force` is
     specified, silently overwrite `new_path` if it exists.  If
     `new-path` ends in a trailing `/`, it is always treated as a
     directory.  Passwords are selectively reencrypted to the
-    corresponding keys of their new destination.
+    corresponding keys of their new destination.  If `--dry-run` or
+    `--plan` is specified, only show how many keys would be copied and
+    reencrypted.
 
     """
     try:
-        ctx.obj.copy_path(old_path, new_path, force)
+        plan = ctx.obj.copy_path(old_path, new_path, force, dry_run)
     except StoreNotInitialisedError:
         click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
         return 1
@@ -569,6 +997,12 @@ def cp(ctx, old_path, new_path, force):
     except RecursiveCopyMoveError:
         click.echo(MSG_RECURSIVE_COPY_MOVE_ERROR.format('copy'))
         return 1
+    except (FileExistsError, ValueError) as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    if dry_run:
+        _echo_plan(plan)
 
 
 @cli.command()
@@ -587,3 +1021,225 @@ def git(ctx, git_args):
     except GitCommandError as e:
         click.echo(e)
         return 1
+
+
+@cli.command(options_metavar='[ --diff,-d ] [ --max-count,-n ]')
+@click.option('-d', '--diff', is_flag=True,
+              help='Only show which fields changed, not their values.')
+@click.option('-n', '--max-count', type=int, default=None,
+              help='Only show this many versions.')
+@click.argument('pass_name', type=str, metavar='pass-name')
+@click.pass_context
+def log(ctx, pass_name, diff, max_count):
+    """Lists the earlier versions of `pass-name`, the newest first.
+    Versions are decrypted in parallel and kept in an encrypted
+    cache, so they are only ever decrypted once.  If `--diff` or `-d`
+    is specified, only the password, fields and other lines that
+    changed are listed.
+
+    """
+    try:
+        history = ctx.obj.history(pass_name, max_count, diff)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except FileNotFoundError:
+        click.echo(MSG_FILE_NOT_FOUND.format(pass_name))
+        return 1
+    except PermissionError:
+        click.echo(MSG_PERMISSION_ERROR)
+        return 1
+    except ValueError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
+
+    for revision in history:
+        click.secho('{0} {1} {2}'.format(
+            revision['commit'][:8],
+            time.strftime('%Y-%m-%d %H:%M',
+                          time.localtime(revision['time'])),
+            revision['subject']), fg='yellow')
+        if diff and revision['changes'] is None:
+            click.echo('    (could not be decrypted)')
+        elif diff:
+            for name, change in revision['changes']:
+                click.echo('    {0} {1}'.format(name or 'other lines',
+                                                change))
+        elif revision['blob'] is None:
+            click.echo('    (removed)')
+        elif revision['key'] is None:
+            click.echo('    (could not be decrypted)')
+        else:
+            for line in revision['key'].rstrip('\n').split('\n'):
+                click.echo('    ' + line)
+
+
+@cli.command(options_metavar='[ --branch,-b ]')
+@click.option('-b', '--branch', type=str, default=None,
+              help=('The remote branch to merge, defaults to the current '
+                    'branch.'))
+@click.argument('remote', type=str, default='origin')
+@click.pass_context
+def sync(ctx, remote, branch):
+    """Fetch and merge changes from `remote`, reencrypting only
+    directories whose `.gpg-id` changed, and list the changed entries.
+
+    """
+    try:
+        events = ctx.obj.sync(remote, branch)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except ValueError:
+        click.echo(MSG_NOT_A_GIT_REPOSITORY)
+        return 1
+    except GitCommandError as e:
+        click.echo(e)
+        return 1
+
+    for event in events:
+        if isinstance(event, KeyMoved):
+            click.echo('Moved {0} to {1}'.format(event.old_path, event.path))
+        elif isinstance(event, GPGIdChanged):
+            click.echo('Changed GPG ids of {0}'.format(event.path or '/'))
+        else:
+            click.echo('{0} {1}'.format(SYNC_ACTIONS[type(event)],
+                                        event.path))
+
+
+def _echo_maintenance(report):
+    for when in ('before', 'after'):
+        counts = report[when]
+        click.echo('{0}: {1} loose objects ({2} bytes), {3} packed in {4} '
+                   'packs ({5} bytes), git overhead per write {6:.3f} s'
+                   .format(when.capitalize(), counts['count'],
+                           counts['size'], counts['in-pack'],
+                           counts['packs'], counts['size-pack'],
+                           report['latency_' + when]))
+    if report['squashed'] > 0:
+        click.echo('Squashed {0} commits.'.format(report['squashed']))
+    if not report['repacked']:
+        click.echo('Repacking not needed yet.')
+
+
+@cli.command(options_metavar='[ --squash-before,-s ] [ --force,-f ] '
+             '[ --yes,-y ]')
+@click.option('-s', '--squash-before', type=int, default=None,
+              help='Squash all commits older than this many days.')
+@click.option('-f', '--force', is_flag=True,
+              help='Repack even if the repository is below the '
+              'thresholds.')
+@click.option('-y', '--yes', is_flag=True,
+              help='Don\'t prompt before squashing history.')
+@click.pass_context
+def maintain(ctx, squash_before, force, yes):
+    """Repacks the git repository of the password store once it has
+    too many loose objects and reports the object counts and the git
+    overhead of every write before and after.  If `--squash-before`
+    or `-s` is given, all commits older than that many days are
+    squashed into one, which needs a force push afterwards.
+
+    """
+    if squash_before is not None:
+        if not yes:
+            click.confirm('This rewrites the history of the password '
+                          'store.  Continue?', abort=True)
+        squash_before = int(time.time()) - squash_before * 24 * 60 * 60
+    try:
+        reports = ctx.obj.maintain(squash_before, force)
+    except ValueError:
+        click.echo(MSG_NOT_A_GIT_REPOSITORY)
+        return 1
+    except GitCommandError as e:
+        click.echo(e)
+        return 1
+
+    if not isinstance(ctx.obj, MultiStore):
+        _echo_maintenance(reports)
+        return
+    for prefix in sorted(reports):
+        click.secho('{0}:'.format(prefix), bold=True)
+        _echo_maintenance(reports[prefix])
+
+
+@cli.command(options_metavar='[ --min-entropy,-e ] [ --max-age,-a ]')
+@click.option('-e', '--min-entropy', type=float,
+              default=DEFAULT_MIN_ENTROPY,
+              help='Report passwords with less bits of entropy as weak.')
+@click.option('-a', '--max-age', type=int, default=None,
+              help='Report passwords not changed for more days as stale.')
+@click.pass_context
+def audit(ctx, min_entropy, max_age):
+    """Reports passwords used by more than one key, weak passwords and,
+    if `--max-age` is given, passwords that were not changed for a
+    long time.
+
+    """
+    try:
+        report = ctx.obj.audit(min_entropy, max_age)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+
+    if len(report['reused']) > 0:
+        click.secho('Reused passwords:', bold=True)
+        for keys in report['reused']:
+            click.echo('    ' + ', '.join(keys))
+    if len(report['weak']) > 0:
+        click.secho('Weak passwords (less than {0:g} bits):'
+                    .format(min_entropy), bold=True)
+        for key in sorted(report['weak']):
+            click.echo('    {0} ({1:.0f} bits)'
+                       .format(key, report['weak'][key]))
+    if len(report['stale']) > 0:
+        click.secho('Stale passwords (older than {0} days):'
+                    .format(max_age), bold=True)
+        for key in sorted(report['stale']):
+            click.echo('    {0} ({1} days)'
+                       .format(key, report['stale'][key]))
+    if len(report['failed']) > 0:
+        click.secho('Not audited, could not be decrypted:', bold=True)
+        for key in report['failed']:
+            click.echo('    ' + key)
+
+
+@cli.command(options_metavar='[ --count,-n ]')
+@click.option('-n', '--count', type=int, default=100,
+              help='The maximum number of passwords to decrypt.')
+@click.pass_context
+def warm(ctx, count):
+    """Decrypts the most frequently shown passwords, as counted with
+    `--track-access`, e.g. when a service starts.  This lets the gpg
+    agent cache the passphrases they need, so the first reads don't
+    have to wait for them.
+
+    """
+    try:
+        names = ctx.obj.warm(count)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+
+    click.echo('Decrypted {0} passwords.'.format(len(names)))
+
+
+@cli.command()
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.argument('subfolder', type=str, default='.')
+@click.pass_context
+def bundle(ctx, output, subfolder):
+    """Packs the encrypted passwords inside the tree at `subfolder`
+    into the single file `output`, which can be read without git.
+
+    """
+    try:
+        ctx.obj.bundle(output, subfolder)
+    except StoreNotInitialisedError:
+        click.echo(MSG_STORE_NOT_INITIALISED_ERROR)
+        return 1
+    except FileNotFoundError:
+        click.echo(MSG_FILE_NOT_FOUND.format(subfolder))
+        return 1
+    except ValueError as e:
+        click.echo('Error: {0}'.format(e))
+        return 1
@@ -0,0 +1,530 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+#############
+access module
+#############
+
+Remembers which keys are read and which are read together, so that
+the keys most likely read next can be decrypted ahead of time.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+from collections import (
+    OrderedDict,
+    deque
+)
+from concurrent.futures import ThreadPoolExecutor
+
+from passpy.gpg import (
+    PRIORITY_BULK,
+    job_context
+)
+from passpy.index import _get_stamp
+from passpy.util import (
+    STATE_DIR,
+    get_state_dir,
+    wipe
+)
+
+
+_ACCESS_FILE = 'access.json'
+_ACCESS_VERSION = 1
+
+#: The default number of seconds after which access counts are halved.
+DEFAULT_HALF_LIFE = 7 * 24 * 60 * 60
+
+# Keys read within this many seconds of each other are read together.
+_CO_ACCESS_WINDOW = 30
+# The number of recent reads kept to find keys read together.
+_MAX_RECENT = 16
+# The number of keys read together kept for every key.
+_MAX_PAIRS = 32
+# Counts that decayed below this are forgotten.
+_MIN_SCORE = 0.01
+# The seconds between saves of a long running process.
+_SAVE_INTERVAL = 60
+
+
+def _decay(row, now, half_life):
+    """Get the current value of a decaying count.
+
+    :param list row: The count and the time it was last increased.
+
+    :param float now: The current time.
+
+    :param float half_life: The seconds after which a count is halved.
+
+    :rtype: float
+
+    """
+    return row[0] * 0.5 ** (max(0.0, now - row[1]) / half_life)
+
+
+def _bump(table, name, now, half_life):
+    """Increase a decaying count by one.
+    """
+    row = table.get(name)
+    if row is None:
+        table[name] = [1.0, now]
+    else:
+        row[0] = _decay(row, now, half_life) + 1.0
+        row[1] = now
+
+
+def _get_cache_stamp(path):
+    """Get what is needed to notice that a key changed.
+
+    Unlike :func:`passpy.index._get_stamp` this includes the inode,
+    since passpy replaces keys with a new file, so that even a key
+    rewritten with the same size in the same clock tick is noticed.
+
+    :rtype: tuple
+    :returns: The inode, modification time in nanoseconds and size of
+        the file, ``None`` if it does not exist.
+
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class AccessRecorder():
+    """Decaying counts of how often keys are read, alone and together.
+
+    Every read increases the count of the key by one, while all counts
+    are halved every `half_life` seconds, so keys read a lot recently
+    rank highest.  Keys read within a short window of each other are
+    counted as pairs the same way.
+
+    Recording only touches memory.  The counts are kept in
+    `.passpy/access.json`, which is written by :meth:`save`, at most
+    once a minute by long running processes and by :meth:`close`, or
+    when the interpreter exits if the recorder was never closed.  The file is not encrypted, it holds nothing but the names
+    of keys, which are not secret in a password store either.
+
+    """
+    def __init__(self, store_dir, half_life=DEFAULT_HALF_LIFE,
+                 window=_CO_ACCESS_WINDOW):
+        """Creates a new AccessRecorder object.
+
+        :param str store_dir: The path to the password store.
+
+        :param float half_life: (optional) The seconds after which a
+            count is halved.
+
+        :param float window: (optional) Keys read within this many
+            seconds of each other are counted as read together.
+
+        """
+        self.store_dir = store_dir
+        self.half_life = half_life
+        self.window = window
+        self.path = os.path.join(store_dir, STATE_DIR, _ACCESS_FILE)
+        # Maps every key to its count and when it was last increased.
+        self._counts = None
+        # Maps every key to the counts of the keys read together with
+        # it.
+        self._pairs = None
+        self._file_stamp = None
+        # The time and name of the most recent reads.
+        self._recent = deque(maxlen=_MAX_RECENT)
+        # Reads not yet saved, as (time, name, partners) tuples.
+        self._unsaved = []
+        self._registered = False
+        self._lock = threading.RLock()
+
+    def _read(self):
+        """Read the counts from disk, or start without any.
+        """
+        self._file_stamp = _get_stamp(self.path)
+        access = None
+        if self._file_stamp is not None:
+            try:
+                with open(self.path, 'r') as access_file:
+                    access = json.load(access_file)
+            except ValueError:
+                # A broken file only costs the counts.
+                access = None
+        if access is None or access.get('version') != _ACCESS_VERSION:
+            self._counts = {}
+            self._pairs = {}
+        else:
+            self._counts = access['counts']
+            self._pairs = access['pairs']
+
+    def _apply(self, event):
+        """Count a single read.
+        """
+        now, name, partners = event
+        _bump(self._counts, name, now, self.half_life)
+        for partner in partners:
+            for first, second in ((name, partner), (partner, name)):
+                pairs = self._pairs.setdefault(first, {})
+                _bump(pairs, second, now, self.half_life)
+                if len(pairs) > _MAX_PAIRS:
+                    weakest = min(pairs, key=lambda other: _decay(
+                        pairs[other], now, self.half_life))
+                    del pairs[weakest]
+
+    def record(self, name):
+        """Count a read of a key.
+
+        :param str name: The name of the key.
+
+        """
+        with self._lock:
+            if self._counts is None:
+                self._read()
+            now = time.time()
+            partners = []
+            for read_at, other in self._recent:
+                if (now - read_at <= self.window and other != name
+                        and other not in partners):
+                    partners.append(other)
+            event = (now, name, partners)
+            self._apply(event)
+            self._unsaved.append(event)
+            self._recent.append((now, name))
+            if not self._registered:
+                self._registered = True
+                atexit.register(self.save)
+            if now - self._unsaved[0][0] >= _SAVE_INTERVAL:
+                self.save()
+
+    def _prune(self, now):
+        """Forget counts that decayed to nothing and keys that were
+        removed.
+        """
+        def keep(name, row):
+            return (_decay(row, now, self.half_life) >= _MIN_SCORE
+                    and os.path.isfile(os.path.join(self.store_dir,
+                                                    name + '.gpg')))
+        self._counts = dict((name, row) for name, row in self._counts.items()
+                            if keep(name, row))
+        self._pairs = dict(
+            (name, dict((other, row) for other, row in pairs.items()
+                        if keep(other, row)))
+            for name, pairs in self._pairs.items() if name in self._counts)
+
+    def save(self):
+        """Write the counts, unless nothing was read since the last
+        save.
+
+        Reads counted by other processes in the meantime are kept.
+
+        """
+        with self._lock:
+            if len(self._unsaved) == 0:
+                return
+            if _get_stamp(self.path) != self._file_stamp:
+                # Another process saved in between, so count our reads
+                # on top of its counts.
+                self._read()
+                for event in self._unsaved:
+                    self._apply(event)
+            self._prune(time.time())
+            get_state_dir(self.store_dir)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as access_file:
+                json.dump({
+                    'version': _ACCESS_VERSION,
+                    'counts': self._counts,
+                    'pairs': self._pairs,
+                }, access_file, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self._file_stamp = _get_stamp(self.path)
+            self._unsaved = []
+
+    def close(self):
+        """Save the counts and drop the hook saving them at exit.
+
+        Reading keys after closing registers the hook again.
+
+        """
+        with self._lock:
+            self.save()
+            if self._registered:
+                self._registered = False
+                atexit.unregister(self.save)
+
+    def top(self, count):
+        """Get the most read keys.
+
+        :param int count: The maximum number of keys to return.
+
+        :rtype: list
+        :returns: The names of the keys, the most read first.
+
+        """
+        with self._lock:
+            if self._counts is None:
+                self._read()
+            now = time.time()
+            names = sorted(self._counts, key=lambda name: -_decay(
+                self._counts[name], now, self.half_life))
+            return names[:count]
+
+    def related(self, name, ratio=0.5, count=8):
+        """Get the keys usually read together with a key.
+
+        :param str name: The name of the key.
+
+        :param float ratio: (optional) The share of the reads of `name`
+            another key has to be read together with it.
+
+        :param int count: (optional) The maximum number of keys to
+            return.
+
+        :rtype: list
+        :returns: The names of the keys, the most read together first.
+
+        """
+        with self._lock:
+            if self._counts is None:
+                self._read()
+            row = self._counts.get(name)
+            pairs = self._pairs.get(name)
+            if row is None or pairs is None:
+                return []
+            now = time.time()
+            threshold = ratio * _decay(row, now, self.half_life)
+            scores = [(_decay(pair, now, self.half_life), other)
+                      for other, pair in pairs.items()]
+            return [other for score, other in sorted(scores, reverse=True)
+                    if score >= threshold][:count]
+
+
+class ValueCache():
+    """The decrypted data of recently read keys.
+
+    Keys are looked up together with the inode, modification time and
+    size of their file, so a key changed in any way is decrypted
+    again.  The least recently used keys are dropped first, and all
+    dropped data is wiped.  With a time to live, expired keys are
+    dropped by every call and by a timer, so their data is not kept
+    in memory for longer even if the cache is not used anymore.
+
+    """
+    def __init__(self, max_keys, ttl=None):
+        """Creates a new ValueCache object.
+
+        :param int max_keys: The maximum number of keys kept.
+
+        :param float ttl: (optional) The seconds a key is kept at most.
+            Kept until dropped for newer keys if not given.
+
+        """
+        self.max_keys = max_keys
+        self.ttl = ttl
+        # Maps every key to its stamp, data and when it expires.
+        self._entries = OrderedDict()
+        # The keys in the order they expire in, which is the order they
+        # were put in, as all keys live equally long.
+        self._expiring = OrderedDict()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._entries)
+
+    def _drop(self, name):
+        _, key_data, _ = self._entries.pop(name)
+        self._expiring.pop(name, None)
+        wipe(key_data)
+
+    def _purge(self):
+        """Drop all expired keys.
+        """
+        now = time.monotonic()
+        while self._expiring:
+            name, expires = next(iter(self._expiring.items()))
+            if expires > now:
+                break
+            self._drop(name)
+
+    def _schedule(self):
+        """Start the timer dropping the key expiring next, unless it
+        runs already.
+        """
+        if self._timer is not None or not self._expiring:
+            return
+        expires = next(iter(self._expiring.values()))
+        self._timer = threading.Timer(max(expires - time.monotonic(), 0),
+                                      self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            self._timer = None
+            self._purge()
+            self._schedule()
+
+    def _lookup(self, name, stamp):
+        self._purge()
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        if entry[0] != stamp:
+            self._drop(name)
+            return None
+        self._entries.move_to_end(name)
+        return entry[1]
+
+    def has(self, name, stamp):
+        """Check whether the current data of a key is cached.
+
+        :param str name: The name of the key.
+
+        :param tuple stamp: The current stamp of the key file.
+
+        :rtype: bool
+
+        """
+        with self._lock:
+            return self._lookup(name, stamp) is not None
+
+    def get(self, name, stamp):
+        """Get the data of a key.
+
+        :param str name: The name of the key.
+
+        :param tuple stamp: The current stamp of the key file.
+
+        :rtype: bytearray
+        :returns: A copy of the data, which the caller may wipe, or
+            ``None`` if the current data is not cached.
+
+        """
+        with self._lock:
+            key_data = self._lookup(name, stamp)
+            if key_data is None:
+                return None
+            return bytearray(key_data)
+
+    def put(self, name, stamp, key_data):
+        """Keep the data of a key.
+
+        :param str name: The name of the key.
+
+        :param tuple stamp: The stamp of the key file taken before it
+            was decrypted.
+
+        :param key_data: The data, which is copied.
+        :type key_data: bytes or bytearray
+
+        """
+        if stamp is None or self.max_keys <= 0:
+            return
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._purge()
+            if name in self._entries:
+                self._drop(name)
+            self._entries[name] = (stamp, bytearray(key_data), expires)
+            if expires is not None:
+                self._expiring[name] = expires
+            while len(self._entries) > self.max_keys:
+                self._drop(next(iter(self._entries)))
+            self._schedule()
+
+    def discard(self, name):
+        """Drop a key, if cached.
+
+        :param str name: The name of the key.
+
+        """
+        with self._lock:
+            if name in self._entries:
+                self._drop(name)
+
+    def clear(self):
+        """Drop all keys.
+        """
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+class Prefetcher():
+    """Decrypts keys in the background.
+
+    The gpg jobs are bulk jobs of a flow of their own, see
+    :func:`passpy.gpg.job_context`, so they never hold up keys someone
+    is waiting for.
+
+    """
+    def __init__(self, load, workers=2):
+        """Creates a new Prefetcher object.
+
+        :param load: Called with the name of every key to prefetch.
+        :type load: function
+
+        :param int workers: (optional) The maximum number of keys
+            decrypted at once.
+
+        """
+        self._load = load
+        self._flow = object()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, names):
+        """Decrypt keys, unless they are already being decrypted.
+
+        :param list names: The names of the keys.
+
+        """
+        with self._lock:
+            for name in names:
+                if name in self._pending:
+                    continue
+                self._pending.add(name)
+                self._executor.submit(self._run, name)
+
+    def _run(self, name):
+        try:
+            with job_context(PRIORITY_BULK, self._flow):
+                self._load(name)
+        except Exception:
+            # Prefetching is only a guess, an actual read of the key
+            # reports any error itself.
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def close(self):
+        """Wait for running jobs and stop.
+        """
+        self._executor.shutdown(wait=True)
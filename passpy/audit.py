@@ -0,0 +1,140 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+############
+audit module
+############
+
+Finds reused, weak and stale passwords.  Passwords are only compared
+by keyed hashes, so no plaintext is kept around while auditing.
+"""
+
+import hashlib
+import hmac
+import math
+import time
+
+from passpy.util import CHARACTER_CLASSES
+
+
+#: Passwords with less bits of entropy are reported as weak.
+DEFAULT_MIN_ENTROPY = 60
+
+_CLASS_BYTES = [frozenset(chars.encode('ascii'))
+                for chars in CHARACTER_CLASSES.values()]
+
+# The number of characters assumed for any byte outside of the
+# character classes, e.g. from non ASCII characters.
+_OTHER_POOL_SIZE = 128
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def password_entropy(password):
+    """Estimate the entropy of a password.
+
+    The estimate assumes that every character was drawn at random
+    from all character classes the password uses, so it is an upper
+    bound for passwords chosen by humans.
+
+    :param password: The password.
+    :type password: bytes, bytearray or memoryview
+
+    :rtype: float
+    :returns: The estimated entropy in bits.
+
+    """
+    password = memoryview(password).cast('B')
+    if len(password) == 0:
+        return 0.0
+    used = set(password)
+    pool = 0
+    for class_bytes in _CLASS_BYTES:
+        if used & class_bytes:
+            pool += len(class_bytes)
+            used -= class_bytes
+    if used:
+        pool += _OTHER_POOL_SIZE
+    return len(password) * math.log2(pool)
+
+
+def hash_password(password, hash_key):
+    """Hash a password with a secret key.
+
+    :param password: The password.
+    :type password: bytes, bytearray or memoryview
+
+    :param bytes hash_key: The key, which should be random and only
+        be used for a single audit.
+
+    :rtype: bytes
+    :returns: The HMAC-SHA256 of the password.
+
+    """
+    return hmac.new(hash_key, password, hashlib.sha256).digest()
+
+
+def build_report(entries, min_entropy=DEFAULT_MIN_ENTROPY, max_age=None):
+    """Build the audit report from the results for single keys.
+
+    :param entries: The ``(name, digest, entropy, changed)`` tuples for
+        every key, where `digest` is the result of
+        :func:`hash_password` or ``None`` for an empty password,
+        `entropy` the one of :func:`password_entropy` or ``None`` if
+        the key could not be decrypted, and `changed` the unix time of
+        the last change or ``None`` if unknown.
+    :type entries: iterable
+
+    :param float min_entropy: (optional) Passwords with less bits of
+        entropy are reported as weak.
+
+    :param int max_age: (optional) Passwords not changed for more
+        days are reported as stale.  No passwords are reported as
+        stale if not given.
+
+    :rtype: dict
+    :returns: A dictionary with the entries 'reused', a list of sorted
+        lists of keys sharing a password other than the empty one,
+        'weak', mapping keys to the entropy of their password,
+        'stale', mapping keys to the number of days since their last
+        change, and 'failed', the sorted list of keys that could not be
+        decrypted and so were not audited.
+
+    """
+    now = time.time()
+    by_digest = {}
+    weak = {}
+    stale = {}
+    failed = []
+    for name, digest, entropy, changed in entries:
+        if entropy is None:
+            failed.append(name)
+            continue
+        # Keys without a password, e.g. ones only holding a note,
+        # don't share one.
+        if digest is not None:
+            by_digest.setdefault(digest, []).append(name)
+        if entropy < min_entropy:
+            weak[name] = entropy
+        if max_age is not None and changed is not None:
+            age = int((now - changed) // _SECONDS_PER_DAY)
+            if age > max_age:
+                stale[name] = age
+    reused = sorted(sorted(names) for names in by_digest.values()
+                    if len(names) > 1)
+    return {'reused': reused, 'weak': weak, 'stale': stale,
+            'failed': sorted(failed)}
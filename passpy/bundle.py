@@ -0,0 +1,281 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+#############
+bundle module
+#############
+
+A single read-only file holding the encrypted keys of a password
+store, for hosts that only need to read a few keys.
+
+A bundle starts with a header, followed by one index entry per key,
+sorted by name, and then the names and the encrypted keys themselves.
+Keys are found with a binary search over the memory mapped index.
+"""
+
+import mmap
+import os
+import re
+import struct
+
+from passpy.entry import Entry
+from passpy.gpg import get_backend
+from passpy.util import wipe
+
+
+_MAGIC = b'PASSPYB\0'
+_VERSION = 1
+
+# Magic, version and number of keys.
+_HEADER = struct.Struct('<8sII')
+# Offset and length of the name, offset and length of the key.
+_ENTRY = struct.Struct('<QQQQ')
+
+
+def write_bundle(path, keys):
+    """Write a bundle.
+
+    :param str path: The path of the bundle to write.  An existing
+        bundle is replaced atomically.
+
+    :param keys: ``(name, key_path)`` tuples for every key, where
+        `key_path` is the path to the encrypted key file.
+    :type keys: iterable
+
+    """
+    keys = sorted((name.encode('utf-8'), key_path)
+                  for name, key_path in keys)
+    names_offset = _HEADER.size + len(keys) * _ENTRY.size
+    data_offset = names_offset + sum(len(name) for name, _ in keys)
+
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as bundle_file:
+            bundle_file.write(_HEADER.pack(_MAGIC, _VERSION, len(keys)))
+            sizes = [os.path.getsize(key_path) for _, key_path in keys]
+            for (name, _), size in zip(keys, sizes):
+                bundle_file.write(_ENTRY.pack(names_offset, len(name),
+                                              data_offset, size))
+                names_offset += len(name)
+                data_offset += size
+            for name, _ in keys:
+                bundle_file.write(name)
+            for _, key_path in keys:
+                with open(key_path, 'rb') as key_file:
+                    bundle_file.write(key_file.read())
+    except BaseException:
+        # Don't leave a partial bundle behind.  If even opening failed
+        # there is nothing to remove.
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+class BundleStore():
+    """Read-only access to the keys in a bundle.
+
+    Offers the reading part of the API of
+    :class:`passpy.store.Store`, without needing git or opening a file
+    per key.
+
+    """
+    def __init__(self, path, gpg_bin='gpg2', use_agent=True, backend=None):
+        """Creates a new BundleStore object.
+
+        :param str path: The path to a bundle written by
+            :func:`passpy.bundle.write_bundle`.
+
+        :param str gpg_bin: (optional) The path to the gpg binary.
+
+        :param bool use_agent: (optional) Set to ``True`` if you are
+            using a gpg agent.
+
+        :param backend: (optional) The crypto backend to use.  See
+            :class:`passpy.store.Store`.
+        :type backend: str or :class:`passpy.gpg.CryptoBackend`
+
+        :raises ValueError: if `path` is not a bundle.
+
+        """
+        self.path = path
+        gpg_opts = ['--quiet', '--yes']
+        if use_agent:
+            gpg_opts += ['--batch', '--use-agent']
+        self.backend = get_backend(backend, gpg_bin, gpg_opts)
+
+        with open(path, 'rb') as bundle_file:
+            self._map = mmap.mmap(bundle_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError('{0} is not a bundle.'.format(path))
+        magic, version, self._count = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError('{0} is not a bundle.'.format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_dir('')
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        """Unmap the bundle.
+        """
+        self._map.close()
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._map,
+                                  _HEADER.size + index * _ENTRY.size)
+
+    def _name(self, index):
+        name_offset, name_length, _, _ = self._entry(index)
+        return self._map[name_offset:name_offset + name_length]
+
+    def _bisect(self, name):
+        """Find the first entry whose name is not less than `name`.
+
+        :param bytes name: The encoded name.
+
+        :rtype: int
+
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _get_data(self, path):
+        """Get the encrypted data of a key.
+
+        :raises FileNotFoundError: if there is no key `path`.
+
+        :rtype: bytes
+
+        """
+        if path is not None and path != '':
+            name = os.path.normpath(path).encode('utf-8')
+            index = self._bisect(name)
+            if index < self._count and self._name(index) == name:
+                _, _, data_offset, data_length = self._entry(index)
+                return self._map[data_offset:data_offset + data_length]
+        raise FileNotFoundError('{0} is not in the password store.'
+                                .format(path))
+
+    def get_key(self, path):
+        """See :meth:`passpy.store.Store.get_key`.
+        """
+        key_data = self.get_key_bytes(path)
+        try:
+            return key_data.decode(self.backend.encoding)
+        finally:
+            wipe(key_data)
+
+    def get_key_bytes(self, path):
+        """See :meth:`passpy.store.Store.get_key_bytes`.
+        """
+        key_data = self.backend.decrypt(self._get_data(path))
+        if isinstance(key_data, bytearray):
+            return key_data
+        return bytearray(key_data)
+
+    def get_entry(self, path):
+        """See :meth:`passpy.store.Store.get_entry`.
+        """
+        return Entry(self.get_key(path), path)
+
+    def iter_dir(self, path, after=None):
+        """Iterate over the names of all keys in a directory.
+
+        :param str path: The directory, ``''`` for all keys.
+
+        :param str after: (optional) Continue after this key, e.g. the
+            last key of an earlier iteration.
+
+        :raises FileNotFoundError: if there are no keys in `path`.
+
+        :rtype: generator
+        :returns: The names of the keys, sorted by their UTF-8
+            encoding.
+
+        """
+        path = os.path.normpath(path)
+        if path == '.':
+            prefix = b''
+        else:
+            prefix = path.encode('utf-8') + b'/'
+        index = self._bisect(prefix)
+        if prefix != b'' and (index == self._count
+                              or not self._name(index).startswith(prefix)):
+            raise FileNotFoundError('{0} is not a directory in the '
+                                    'password store.'.format(path))
+        if after is not None:
+            name = os.path.normpath(after).encode('utf-8')
+            index = max(index, self._bisect(name))
+            if index < self._count and self._name(index) == name:
+                index += 1
+        return self._iter_from(index, prefix)
+
+    def _iter_from(self, index, prefix):
+        while index < self._count:
+            name = self._name(index)
+            if not name.startswith(prefix):
+                break
+            yield name.decode('utf-8')
+            index += 1
+
+    def find(self, names):
+        """See :meth:`passpy.store.Store.find`.
+        """
+        if names is None:
+            return []
+        if not isinstance(names, list):
+            names = [names]
+        return [key for key in self
+                if any(key.find(name) != -1 for name in names)]
+
+    def iter_search(self, term):
+        """See :meth:`passpy.store.Store.iter_search`.
+        """
+        regex = re.compile(term)
+        for key in self:
+            matches = []
+            for line in self.get_key(key).split('\n'):
+                match = regex.search(line)
+                if match is not None:
+                    matches.append((line, match))
+            if len(matches) > 0:
+                yield key, matches
+
+    def search(self, term):
+        """See :meth:`passpy.store.Store.search`.
+        """
+        if term is None:
+            return {}
+        return dict(self.iter_search(term))
@@ -0,0 +1,233 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+#############
+cancel module
+#############
+
+Deadlines and cancellation for the gpg and git processes started by
+passpy.  Like :func:`passpy.gpg.job_context` they apply to everything
+the current thread does within a `with` block.
+"""
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+from passpy.exceptions import (
+    OperationCancelledError,
+    OperationTimeoutError
+)
+
+
+class CancellationToken():
+    """Lets another thread cancel running operations.
+
+    Pass the token to the methods of :class:`passpy.store.Store` with
+    the `cancel` argument, or to :func:`operation_context`.  Once
+    :meth:`cancel` is called all gpg processes of these operations are
+    killed and they raise
+    :exc:`passpy.exceptions.OperationCancelledError`.
+
+    """
+    def __init__(self):
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._watches = set()
+
+    @property
+    def cancelled(self):
+        """``True`` once :meth:`cancel` was called.
+        """
+        return self._cancelled
+
+    def cancel(self):
+        """Cancel all operations using this token.
+        """
+        with self._lock:
+            self._cancelled = True
+            watches = list(self._watches)
+        for watch in watches:
+            watch.kill(OperationCancelledError)
+
+    def _watch(self, watch):
+        with self._lock:
+            if not self._cancelled:
+                self._watches.add(watch)
+                return
+        watch.kill(OperationCancelledError)
+
+    def _unwatch(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+
+
+_context = threading.local()
+
+
+def get_operation_context():
+    """Get the deadline and cancellation token of the current thread.
+
+    :rtype: (float, :class:`CancellationToken`)
+    :returns: The deadline in terms of :func:`time.monotonic` and the
+        token.  Either is ``None`` if not set.
+
+    """
+    return (getattr(_context, 'deadline', None),
+            getattr(_context, 'token', None))
+
+
+@contextmanager
+def use_operation_context(context):
+    """Use the deadline and token of another thread within a `with`
+    block.
+
+    :param tuple context: The result of :func:`get_operation_context`.
+
+    """
+    old_context = get_operation_context()
+    _context.deadline, _context.token = context
+    try:
+        yield
+    finally:
+        _context.deadline, _context.token = old_context
+
+
+@contextmanager
+def operation_context(timeout=None, token=None):
+    """Set a deadline and a cancellation token for all gpg and git
+    processes of the current thread within a `with` block.
+
+    Nested blocks can only shorten the deadline.
+
+    :param float timeout: (optional) The seconds until the deadline.
+
+    :param token: (optional) The cancellation token.  The one of an
+        outer block is kept if not given.
+    :type token: :class:`CancellationToken`
+
+    """
+    deadline, old_token = get_operation_context()
+    if timeout is not None:
+        new_deadline = time.monotonic() + timeout
+        if deadline is None or new_deadline < deadline:
+            deadline = new_deadline
+    with use_operation_context((deadline, token or old_token)):
+        yield
+
+
+def get_remaining_time():
+    """Get the seconds left until the deadline of the current thread.
+
+    :rtype: float
+    :returns: The seconds left, at least ``0``, or ``None`` if there
+        is no deadline.
+
+    """
+    deadline, _ = get_operation_context()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def check_operation():
+    """Stop if the current operation was cancelled or timed out.
+
+    Called before every gpg or git process is started and between the
+    items of bulk operations.
+
+    :raises passpy.exceptions.OperationCancelledError: if the token of
+        the current thread was cancelled.
+
+    :raises passpy.exceptions.OperationTimeoutError: if the deadline of
+        the current thread has passed.
+
+    """
+    deadline, token = get_operation_context()
+    if token is not None and token.cancelled:
+        raise OperationCancelledError('The operation was cancelled.')
+    if deadline is not None and time.monotonic() >= deadline:
+        raise OperationTimeoutError('The operation timed out.')
+
+
+class ProcessWatch():
+    """Kills a process once the deadline of the current thread passes
+    or its token is cancelled.
+
+    """
+    def __init__(self, proc):
+        """Creates a new ProcessWatch object and starts watching.
+
+        :param proc: The process to watch.
+        :type proc: :class:`subprocess.Popen`
+
+        """
+        self.proc = proc
+        self.reason = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._token = None
+        remaining = get_remaining_time()
+        if remaining is not None:
+            self._timer = threading.Timer(remaining, self.kill,
+                                          [OperationTimeoutError])
+            self._timer.daemon = True
+            self._timer.start()
+        _, self._token = get_operation_context()
+        if self._token is not None:
+            self._token._watch(self)
+
+    def kill(self, reason):
+        """Kill the process, unless it was already killed.
+
+        :param reason: The exception class :meth:`stop` raises.
+        :type reason: type
+
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        try:
+            self.proc.kill()
+        except OSError:
+            # The process already exited.
+            pass
+
+    def stop(self):
+        """Stop watching the process.
+
+        :raises passpy.exceptions.OperationCancelledError: if the
+            process was killed because the token was cancelled.
+
+        :raises passpy.exceptions.OperationTimeoutError: if the process
+            was killed because the deadline passed.
+
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._token is not None:
+            self._token._unwatch(self)
+        with self._lock:
+            reason = self.reason
+            # Anything happening from now on is too late.
+            self.reason = self.reason or False
+        if reason:
+            if reason is OperationTimeoutError:
+                raise OperationTimeoutError('gpg did not finish in time.')
+            raise OperationCancelledError('The operation was cancelled.')
@@ -0,0 +1,251 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+################
+committer module
+################
+
+Write-behind git commits, so that writing a key does not have to wait
+for git.
+"""
+
+import atexit
+import threading
+import time
+
+from collections import OrderedDict
+
+from passpy.git import git_stage_paths
+
+
+#: Every change is committed before the write returns.
+DURABILITY_IMMEDIATE = 'immediate'
+#: Changes are committed in the background, see :class:`GitCommitter`.
+DURABILITY_BATCHED = 'batched'
+#: Changes are only committed by :meth:`GitCommitter.flush`.
+DURABILITY_MANUAL = 'manual'
+
+DURABILITY_MODES = (DURABILITY_IMMEDIATE, DURABILITY_BATCHED,
+                    DURABILITY_MANUAL)
+
+
+class GitCommitter():
+    """Collects the paths changed by writes and commits them together.
+
+    In the batched mode a background thread commits once `interval`
+    seconds passed since the first pending change or once
+    `max_changes` changes are pending, whatever happens first.  In
+    the manual mode nothing is committed until :meth:`flush` is
+    called.  Pending changes are flushed by :meth:`close` and when
+    the interpreter exits.
+
+    """
+    def __init__(self, repo, durability=DURABILITY_BATCHED, interval=0.5,
+                 max_changes=100, verbose=False):
+        """Creates a new GitCommitter object.
+
+        :param repo: The git repository to commit to.  If ``None``
+            changes are silently dropped.
+        :type repo: :class:`git.repo.base.Repo`
+
+        :param str durability: (optional) Either
+            :data:`DURABILITY_BATCHED` or :data:`DURABILITY_MANUAL`.
+
+        :param float interval: (optional) The seconds a change waits
+            at most before it is committed in the batched mode.
+
+        :param int max_changes: (optional) The number of pending
+            changes that are committed right away in the batched mode.
+
+        :param bool verbose: (optional) If ``True`` git's standard
+            output will be printed.
+
+        :raises ValueError: if `durability` is not one of the above.
+
+        """
+        if durability not in (DURABILITY_BATCHED, DURABILITY_MANUAL):
+            raise ValueError('Invalid durability mode {0}.'
+                             .format(durability))
+        self.repo = repo
+        self.durability = durability
+        self.interval = interval
+        self.max_changes = max_changes
+        self.verbose = verbose
+
+        # Pending (paths, msg, commit) tuples and when the first one
+        # was added.
+        self._pending = []
+        self._first = None
+        # Messages of changes already staged, but not yet committed.
+        self._messages = []
+        self._error = None
+        self._closed = False
+        self._started = False
+        self._thread = None
+        self._cond = threading.Condition()
+        # Serialises staging and committing, so batches are committed
+        # in order.
+        self._git_lock = threading.Lock()
+
+    def _start(self):
+        """Flush at exit and start the background thread, once.
+        """
+        if self._started:
+            return
+        self._started = True
+        atexit.register(self.close)
+        if self.durability == DURABILITY_BATCHED:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _raise_error(self):
+        """Raise the error of the last failed background commit once.
+        """
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def add(self, paths, msg, commit=True):
+        """Queue changed files or directories.
+
+        :param paths: The changed paths, see
+            :func:`passpy.git.git_stage_paths`.
+        :type paths: str or list
+
+        :param str msg: The commit message for the change.
+
+        :param bool commit: (optional) If ``False`` the change is not
+            committed before a later change is, e.g. to commit removing
+            and adding keys together.
+
+        :raises Exception: the error of the last failed background
+            commit.
+
+        :raises ValueError: if the committer was closed.
+
+        """
+        if not isinstance(paths, list):
+            paths = [paths]
+        with self._cond:
+            if self._closed:
+                raise ValueError('The committer was closed.')
+            self._raise_error()
+            if len(self._pending) == 0:
+                self._first = time.monotonic()
+            self._pending.append((paths, msg, commit))
+            self._start()
+            self._cond.notify()
+
+    def _commit_pending(self):
+        """Stage and commit all pending changes.
+
+        Should staging or committing fail, the changes stay pending and
+        are tried again with the next commit.
+
+        """
+        with self._git_lock:
+            with self._cond:
+                pending, self._pending = self._pending, []
+            if len(pending) == 0:
+                return
+            try:
+                self._stage(pending)
+            except BaseException:
+                with self._cond:
+                    self._pending = pending + self._pending
+                    # Wait a whole interval before trying again.
+                    self._first = time.monotonic()
+                raise
+
+    def _stage(self, pending):
+        """Stage the paths of changes and commit them, unless the last
+        change waits for the next one.
+
+        :param list pending: The (paths, msg, commit) tuples of the
+            changes.
+
+        """
+        # An ordered set, as the same key is often changed repeatedly.
+        paths = OrderedDict()
+        messages = list(self._messages)
+        for change_paths, msg, commit in pending:
+            for path in change_paths:
+                paths[path] = None
+            if msg:
+                messages.append(msg)
+        paths = list(paths)
+        # A change that is not committed on its own waits for the one
+        # that follows it.
+        if not pending[-1][2] or len(messages) == 0:
+            git_stage_paths(self.repo, paths, verbose=self.verbose)
+            self._messages = messages
+            return
+        if len(messages) == 1:
+            msg = messages[0]
+        else:
+            msg = 'Commit {0} changes.\n\n{1}'.format(
+                len(messages), '\n'.join(messages))
+        git_stage_paths(self.repo, paths, msg, self.verbose)
+        self._messages = []
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if len(self._pending) == 0:
+                    self._cond.wait()
+                    continue
+                deadline = self._first + self.interval
+                while (len(self._pending) < self.max_changes
+                       and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    break
+                self._cond.release()
+                try:
+                    self._commit_pending()
+                except Exception as e:
+                    self._error = e
+                finally:
+                    self._cond.acquire()
+
+    def flush(self):
+        """Commit all pending changes now.
+
+        :raises Exception: the error of the last failed background
+            commit or of committing now.
+
+        """
+        with self._cond:
+            self._raise_error()
+        self._commit_pending()
+
+    def close(self):
+        """Commit all pending changes and stop the background thread.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._started:
+            atexit.unregister(self.close)
+        self.flush()
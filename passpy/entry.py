@@ -0,0 +1,220 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+############
+entry module
+############
+
+The password and ``key: value`` fields of a decrypted key.
+"""
+
+import re
+
+from passpy.util import (
+    parse_field_line,
+    parse_fields
+)
+
+
+_FIELD_NAME_RE = re.compile(r'^[^\s:]+$')
+
+
+class Entry():
+    """A decrypted key in the layout used by pass.
+
+    The first line holds the password, following lines of the form
+    ``key: value`` are fields and all other lines are kept as they
+    are.  Only the text is stored, the fields are parsed on first
+    access and changing them rewrites the affected lines in place.
+    Field names are case insensitive.
+
+    """
+    __slots__ = ('name', '_text', '_fields')
+
+    def __init__(self, text, name=None):
+        """Creates a new Entry object.
+
+        :param str text: The decrypted key.
+
+        :param str name: (optional) The name of the key in the store.
+
+        """
+        self.name = name
+        self._text = text
+        self._fields = None
+
+    def __repr__(self):
+        # Never show the password.
+        return '<Entry {0}>'.format(self.name)
+
+    def __str__(self):
+        return self._text
+
+    @property
+    def text(self):
+        """The whole key in the layout used by pass.
+        """
+        return self._text
+
+    @property
+    def password(self):
+        """The first line of the key.
+        """
+        return self._text.split('\n', 1)[0]
+
+    @password.setter
+    def password(self, password):
+        if '\n' in password:
+            raise ValueError('The password must be a single line.')
+        lines = self._text.split('\n', 1)
+        lines[0] = password
+        self._text = '\n'.join(lines)
+
+    @property
+    def fields(self):
+        """The values of all fields, see
+        :func:`passpy.util.parse_fields`.
+
+        The dictionary must not be changed, use item assignment on the
+        entry instead.
+
+        """
+        if self._fields is None:
+            self._fields = parse_fields(self._text)
+        return self._fields
+
+    def __contains__(self, field):
+        return field.lower() in self.fields
+
+    def __getitem__(self, field):
+        """Get the first value of a field.
+
+        :raises KeyError: if the entry has no field `field`.
+
+        """
+        return self.fields[field.lower()][0]
+
+    def get(self, field, default=None):
+        """Get the first value of a field.
+
+        :param str field: The name of the field.
+
+        :param default: (optional) Returned if there is no such field.
+
+        """
+        values = self.fields.get(field.lower())
+        if values is None:
+            return default
+        return values[0]
+
+    def get_all(self, field):
+        """Get all values of a field.
+
+        :param str field: The name of the field.
+
+        :rtype: list
+        :returns: The values in the order they appear.
+
+        """
+        return list(self.fields.get(field.lower(), []))
+
+    def _field_lines(self, lines, field):
+        """Find the lines holding a field.
+
+        :rtype: list
+        :returns: The indices of the lines.
+
+        """
+        field = field.lower()
+        indices = []
+        for i in range(1, len(lines)):
+            line_field = parse_field_line(lines[i])
+            if line_field is not None and line_field[0].lower() == field:
+                indices.append(i)
+        return indices
+
+    def _set_lines(self, lines):
+        self._text = '\n'.join(lines)
+        self._fields = None
+
+    def _check_field(self, field, value):
+        if _FIELD_NAME_RE.match(field) is None:
+            raise ValueError('Invalid field name {0}.'.format(field))
+        if '\n' in value:
+            raise ValueError('The value of {0} must be a single line.'
+                             .format(field))
+
+    def _append_line(self, lines, line):
+        # Keep the trailing newline pass writes at the end.
+        if len(lines) > 1 and lines[-1] == '':
+            lines.insert(len(lines) - 1, line)
+        else:
+            lines.append(line)
+
+    def __setitem__(self, field, value):
+        """Set a field to a single value.
+
+        The first line of the field is changed in place and any further
+        lines are removed.  The field is appended if the entry does not
+        have it yet.
+
+        :raises ValueError: if `field` is not a valid field name or
+            `value` spans more than one line.
+
+        """
+        self._check_field(field, value)
+        lines = self._text.split('\n')
+        indices = self._field_lines(lines, field)
+        if len(indices) == 0:
+            self._append_line(lines, '{0}: {1}'.format(field, value))
+        else:
+            # Keep the spelling of the existing field name.
+            name, _ = parse_field_line(lines[indices[0]])
+            lines[indices[0]] = '{0}: {1}'.format(name, value)
+            for i in reversed(indices[1:]):
+                del lines[i]
+        self._set_lines(lines)
+
+    def __delitem__(self, field):
+        """Remove all lines of a field.
+
+        :raises KeyError: if the entry has no field `field`.
+
+        """
+        lines = self._text.split('\n')
+        indices = self._field_lines(lines, field)
+        if len(indices) == 0:
+            raise KeyError(field)
+        for i in reversed(indices):
+            del lines[i]
+        self._set_lines(lines)
+
+    def add(self, field, value):
+        """Append another value for a field.
+
+        :param str field: The name of the field.
+
+        :param str value: The value.
+
+        :raises ValueError: if `field` is not a valid field name or
+            `value` spans more than one line.
+
+        """
+        self._check_field(field, value)
+        lines = self._text.split('\n')
+        self._append_line(lines, '{0}: {1}'.format(field, value))
+        self._set_lines(lines)
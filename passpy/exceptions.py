@@ -33,3 +33,20 @@ class RecursiveCopyMoveError(OSError):
        subdirectory of itself.
 
     """
+
+
+class OperationTimeoutError(TimeoutError):
+    """Raised when an operation did not finish before its deadline.
+
+    Any gpg or git process still running at the deadline is killed.
+
+    """
+    pass
+
+
+class OperationCancelledError(Exception):
+    """Raised when an operation was cancelled through a
+    :class:`passpy.cancel.CancellationToken`.
+
+    """
+    pass
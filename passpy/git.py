@@ -14,11 +14,76 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from git import (
-    Repo,
-    InvalidGitRepositoryError,
-    NoSuchPathError
+import os
+import re
+
+from passpy.cancel import (
+    check_operation,
+    get_remaining_time
 )
+from passpy.exceptions import OperationTimeoutError
+
+try:
+    from git import (
+        Repo,
+        GitCommandError,
+        InvalidGitRepositoryError,
+        NoSuchPathError
+    )
+except ImportError:
+    # GitPython refuses to import without a git binary, which is not
+    # needed to only read keys, e.g. from a bundle.  Stand-ins for its
+    # exceptions keep the ``except`` clauses working; they are never
+    # raised.
+    Repo = None
+
+    class GitCommandError(Exception):
+        pass
+
+    class InvalidGitRepositoryError(Exception):
+        pass
+
+    class NoSuchPathError(Exception):
+        pass
+
+
+#: The git commands that take the lock of the index or of a ref.
+#: Killing them would leave the lock file behind and make every later
+#: git command fail, so they are never killed.
+_LOCKING_COMMANDS = frozenset(['add', 'commit', 'merge', 'reflog', 'rm',
+                               'update_index', 'update_ref'])
+
+
+def _run_git(repo, method, *args, **kwargs):
+    """Run a git command, honouring the deadline of the current thread.
+
+    git is killed once the deadline passes, unless it is one of
+    :data:`_LOCKING_COMMANDS`.  Cancellation is only checked before
+    git is started, see :func:`passpy.cancel.check_operation`.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str method: The git command, e.g. 'add'.
+
+    :raises passpy.exceptions.OperationTimeoutError: if git was killed
+        because the deadline passed.
+
+    :returns: The output of git.
+
+    """
+    check_operation()
+    remaining = None
+    if method not in _LOCKING_COMMANDS:
+        remaining = get_remaining_time()
+    if remaining is not None:
+        kwargs['kill_after_timeout'] = remaining
+    try:
+        return repo.git._call_process(method, *args, **kwargs)
+    except Exception as e:
+        if remaining is not None and get_remaining_time() == 0:
+            raise OperationTimeoutError('git did not finish in time.') from e
+        raise
 
 
 def get_git_repository(path):
@@ -31,6 +96,8 @@ def get_git_repository(path):
         exists.
 
     """
+    if Repo is None:
+        return None
     try:
         repo = Repo(path)
     except InvalidGitRepositoryError:
@@ -54,7 +121,11 @@ def _git_commit(repo, msg, verbose=False):
     """
     if repo is None:
         return
-    res = repo.git.commit(m=msg)
+    # Nothing to commit, e.g. if reencrypting did not change any key.
+    if not repo.is_dirty(index=True, working_tree=False,
+                         untracked_files=False):
+        return
+    res = _run_git(repo, 'commit', m=msg)
     if verbose:
         print(res)
 
@@ -85,7 +156,7 @@ def git_add_path(repo, path, msg, commit=True, verbose=False):
         return
     if not isinstance(path, list):
         path = [path]
-    repo.git.add(*path)
+    _run_git(repo, 'add', *path)
     if commit:
         _git_commit(repo, msg, verbose)
 
@@ -114,21 +185,62 @@ def git_remove_path(repo, path, msg, recursive=False, commit=True,
         return
     if not isinstance(path, list):
         path = [path]
-    repo.git.rm(*path, r=recursive)
+    _run_git(repo, 'rm', *path, r=recursive)
     if commit:
         _git_commit(repo, msg, verbose)
 
 
+def git_stage_paths(repo, paths, msg=None, verbose=False):
+    """Stage the current state of files or directories and commit.
+
+    Unlike :func:`git_add_path` and :func:`git_remove_path` this does
+    not care whether a path was added, changed or removed since it
+    was last staged, so changes to the same path can be coalesced.
+
+    :param repo: The git repository.  If ``None`` the function will
+        silently fail.
+    :type repo: :class:`git.repo.base.Repo`
+
+    :param list paths: The paths of the files or directories.
+
+    :param str msg: (optional) The commit message.  Nothing is
+        committed if not given.
+
+    :param bool verbose: (optional) If ``True`` git's standard output
+        will be printed.
+
+    """
+    if repo is None:
+        return
+    existing = [path for path in paths if os.path.exists(path)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if len(existing) > 0:
+        _run_git(repo, 'add', '-A', '--', *existing)
+    if len(missing) > 0:
+        # Never touches the working tree, in case a path was created
+        # again in the meantime.
+        _run_git(repo, 'rm', '-r', '-q', '--cached', '--ignore-unmatch',
+                 '--', *missing)
+    if msg is not None:
+        _git_commit(repo, msg, verbose)
+
+
 def git_init(path):
     """Create a new git repository.
 
     :param str path: The absolute path directory to create a git
         repository in.
 
+    :raises ImportError: if GitPython could not be imported, e.g.
+        because there is no git binary.
+
     :rtype: :class:`git.Repo`
     :returns: The newly initialised git repository.
 
     """
+    if Repo is None:
+        raise ImportError('GitPython and a git binary are needed to '
+                          'create a git repository.')
     return Repo.init(path)
 
 
@@ -139,4 +251,439 @@ def git_config(repo, *args):
     :type repo: :class:`git.Repo`
 
     """
-    repo.git.config(args)
+    _run_git(repo, 'config', args)
+
+
+# The hash of git's empty tree, used to diff against if a repository
+# has no commits yet.
+_EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+def git_head(repo):
+    """Get the commit HEAD currently points to.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :rtype: str
+    :returns: The hash of the commit or ``None`` if the repository
+        has no commits yet.
+
+    """
+    try:
+        return repo.head.commit.hexsha
+    except ValueError:
+        return None
+
+
+def git_fetch(repo, remote, verbose=False):
+    """Fetch from a remote repository.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str remote: The name or URL of the remote.
+
+    :param bool verbose: (optional) If ``True`` git's standard output
+        will be printed.
+
+    """
+    res = _run_git(repo, 'fetch', remote)
+    if verbose and res:
+        print(res)
+
+
+def git_merge(repo, ref, verbose=False):
+    """Merge a ref into the current branch.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str ref: The ref to merge, e.g. 'origin/master'.
+
+    :param bool verbose: (optional) If ``True`` git's standard output
+        will be printed.
+
+    """
+    res = _run_git(repo, 'merge', ref, '--no-edit')
+    if verbose:
+        print(res)
+
+
+def git_changed_paths(repo, old, new):
+    """Get the files that changed between two commits.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str old: The old commit.  ``None`` for an empty
+        repository.
+
+    :param str new: The new commit.
+
+    :rtype: list
+    :returns: A list of ``(status, old_path, new_path)`` tuples, where
+        status is one of git's status letters 'A', 'M', 'D' or 'R'.
+        `old_path` is ``None`` for added files and `new_path` for
+        removed ones.
+
+    """
+    if old is None:
+        old = _EMPTY_TREE
+    out = _run_git(repo, 'diff', old, new, '--name-status', '-z', '-M')
+    fields = out.split('\0')
+    changes = []
+    i = 0
+    while i < len(fields) and fields[i] != '':
+        status = fields[i][0]
+        if status in ('R', 'C'):
+            old_path, new_path = fields[i + 1], fields[i + 2]
+            i += 3
+            if status == 'C':
+                changes.append(('A', None, new_path))
+                continue
+        else:
+            old_path = new_path = fields[i + 1]
+            i += 2
+            if status == 'A':
+                old_path = None
+            elif status == 'D':
+                new_path = None
+            else:
+                status = 'M'
+        changes.append((status, old_path, new_path))
+    return changes
+
+
+def git_last_changes(repo):
+    """Get the time every file was last changed, in a single `git log`.
+
+    Commits that only reencrypted keys, whose subject starts with
+    'Reencrypt' like the ones made by pass and passpy, are ignored.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :rtype: dict
+    :returns: The commit time as a unix timestamp for every file,
+        relative to the repository.
+
+    """
+    if git_head(repo) is None:
+        return {}
+    out = _run_git(repo, 'log', '--format=%x01%ct', '--name-only', '-z',
+                   '--no-renames', '--invert-grep', '--grep=^Reencrypt')
+    changes = {}
+    commit_time = None
+    for field in out.split('\0'):
+        field = field.lstrip('\n')
+        if field.startswith('\x01'):
+            commit_time = int(field[1:])
+        elif field != '':
+            # The log starts with the newest commit.
+            changes.setdefault(field, commit_time)
+    return changes
+
+
+#: The subject of the commits of :meth:`passpy.store.Store.move_path`.
+_RENAME_RE = re.compile(r'^Rename (.+) to (.+)\.$')
+
+
+def _find_renamed_from(repo, commit, subject, path):
+    """Find the path a file had before passpy moved it.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str commit: The hash of the commit that added the file.
+
+    :param str subject: The subject of the commit.
+
+    :param str path: The path of the file after the commit.
+
+    :rtype: str
+    :returns: The path of the file before the commit, ``None`` if the
+        commit did not move it.
+
+    """
+    match = _RENAME_RE.match(subject)
+    if match is None or not path.endswith('.gpg'):
+        return None
+    # pass keeps the arguments as they were given.
+    old, new = [os.path.normpath(part) for part in match.groups()]
+    name = path[:-4]
+    candidates = []
+    if name == new:
+        candidates.append(old + '.gpg')
+    prefix = '' if new == '.' else new + '/'
+    if name.startswith(prefix):
+        rest = name[len(prefix):]
+        # A directory was moved, or a key into a directory.
+        candidates.append(old + '/' + rest + '.gpg')
+        if rest == os.path.basename(old):
+            candidates.append(old + '.gpg')
+    out = _run_git(repo, 'diff_tree', '-r', '--no-commit-id', '--name-only',
+                   '--diff-filter=D', '-z', commit)
+    removed = set(out.split('\0'))
+    for candidate in candidates:
+        if candidate in removed:
+            return candidate
+    return None
+
+
+def git_file_history(repo, path, limit=None):
+    """Get the commits that changed a file, following renames.
+
+    git only detects a rename while the content stays the same, which
+    is not the case for a key moved to a directory with other gpg ids,
+    as it is encrypted again.  Such renames are still followed if they
+    were committed by passpy or pass, from the subject of the commit.
+    Renames committed together with other changes, e.g. by
+    :class:`passpy.committer.GitCommitter`, are not.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str path: The path of the file, relative to the
+        repository.  It does not need to exist anymore.
+
+    :param int limit: (optional) The maximum number of commits.
+
+    :rtype: list
+    :returns: A dictionary for every commit, the newest first, with
+        the hash of the ``commit``, its ``time`` as a unix timestamp,
+        its ``author`` and ``subject``, the ``status`` letter of the
+        file, its ``path`` after the commit and the hash of its
+        ``blob``, which is ``None`` if the commit removed the file.
+
+    """
+    if git_head(repo) is None:
+        return []
+    history = []
+    rev = []
+    while limit is None or len(history) < limit:
+        args = ['--follow', '--format=%x01%H%x02%ct%x02%an%x02%s', '--raw',
+                '--no-abbrev', '-z']
+        if limit is not None:
+            args.append('-n{0}'.format(limit - len(history)))
+        out = _run_git(repo, 'log', *(args + rev + ['--', path]))
+        for chunk in out.split('\x01')[1:]:
+            header, _, raw = chunk.partition('\0')
+            commit, commit_time, author, subject = header.split('\x02', 3)
+            fields = raw.lstrip('\n').split('\0')
+            if len(fields) < 2 or not fields[0].startswith(':'):
+                continue
+            _, _, _, new_sha, status = fields[0][1:].split(' ')
+            status = status[0]
+            new_path = fields[2] if status in ('R', 'C') else fields[1]
+            history.append({
+                'commit': commit,
+                'time': int(commit_time),
+                'author': author,
+                'subject': subject,
+                'status': status,
+                'path': new_path,
+                'blob': None if status == 'D' else new_sha,
+            })
+        if len(history) == 0 or history[-1]['status'] != 'A':
+            break
+        oldest = history[-1]
+        path = _find_renamed_from(repo, oldest['commit'], oldest['subject'],
+                                  oldest['path'])
+        if path is None:
+            break
+        oldest['status'] = 'R'
+        rev = [oldest['commit'] + '^']
+    return history
+
+
+def git_resolve_commit(repo, rev):
+    """Find the commit a revision points to.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str rev: Any revision git understands, e.g. ``HEAD~3`` or
+        ``master@{yesterday}``.
+
+    :raises ValueError: if `rev` is not a commit.
+
+    :rtype: str
+    :returns: The hash of the commit.
+
+    """
+    try:
+        return _run_git(repo, 'rev_parse', '--verify', '--quiet',
+                        rev + '^{commit}')
+    except GitCommandError:
+        raise ValueError('{0} is not a commit.'.format(rev))
+
+
+def git_list_tree(repo, commit):
+    """List all files of a commit.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str commit: The hash of the commit.
+
+    :rtype: dict
+    :returns: The hash of the blob of every file, relative to the
+        repository.
+
+    """
+    out = _run_git(repo, 'ls_tree', '-r', '-z', '--full-tree', commit)
+    blobs = {}
+    for line in out.split('\0'):
+        if line == '':
+            continue
+        info, path = line.split('\t', 1)
+        _, obj_type, sha = info.split(' ')
+        if obj_type == 'blob':
+            blobs[path] = sha
+    return blobs
+
+
+def git_read_blob(repo, sha):
+    """Read a blob through the long-lived `git cat-file --batch`
+    process of the repository.
+
+    The process is not thread-safe, so callers need to serialise
+    reads from the same :class:`git.Repo`.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str sha: The hash of the blob.
+
+    :rtype: bytes
+
+    """
+    check_operation()
+    return repo.git.get_object_data(sha)[3]
+
+
+# Repack once there are more loose objects or packs than this.  Every
+# write adds a few loose objects, mostly incompressible keys.
+_LOOSE_OBJECTS_LIMIT = 1000
+_PACKS_LIMIT = 20
+
+
+def git_count_objects(repo):
+    """Count the objects in a repository.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :rtype: dict
+    :returns: The output of `git count-objects -v`, e.g. 'count' and
+        'size' for the loose objects and 'in-pack', 'packs' and
+        'size-pack' for the packed ones.  Sizes are in bytes.
+
+    """
+    counts = {}
+    for line in _run_git(repo, 'count_objects', '-v').splitlines():
+        name, value = line.split(':', 1)
+        value = int(value)
+        if name.startswith('size'):
+            # git reports sizes in KiB.
+            value *= 1024
+        counts[name] = value
+    return counts
+
+
+def git_needs_repack(counts):
+    """Check whether a repository should be repacked.
+
+    :param dict counts: The result of :func:`git_count_objects`.
+
+    :rtype: bool
+
+    """
+    return (counts['count'] >= _LOOSE_OBJECTS_LIMIT
+            or counts['packs'] >= _PACKS_LIMIT)
+
+
+def git_repack(repo, prune='2.weeks.ago', verbose=False):
+    """Pack all objects into a single pack and drop unreachable ones.
+
+    Keys are encrypted, so searching for deltas between them is
+    skipped, which makes repacking much faster without making the pack
+    any larger.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param str prune: (optional) Unreachable loose objects older than
+        this are removed, e.g. 'now'.
+
+    :param bool verbose: (optional) If ``True`` git's standard output
+        will be printed.
+
+    """
+    commands = [['repack', '-a', '-d', '-q', '--window=0'],
+                ['prune', '--expire={0}'.format(prune)],
+                ['pack-refs', '--all']]
+    # The commit-graph only exists since git 2.18.
+    if repo.git.version_info >= (2, 18):
+        commands.append(['commit-graph', 'write', '--reachable'])
+    for args in commands:
+        res = _run_git(repo, *args)
+        if verbose and res:
+            print(res)
+
+
+def git_squash_history(repo, before):
+    """Replace all commits older than a point in time with a single one.
+
+    The newer commits are recreated on top of it with their trees,
+    authors, dates and messages, following only the first parent of
+    merges.  This rewrites the current branch, so it has to be force
+    pushed afterwards.
+
+    :param repo: The git repository.
+    :type repo: :class:`git.Repo`
+
+    :param int before: A unix timestamp.  All commits made before
+        it are squashed.
+
+    :rtype: int
+    :returns: The number of commits squashed, ``0`` if there was
+        nothing to squash.
+
+    """
+    head = git_head(repo)
+    if head is None:
+        return 0
+    base = _run_git(repo, 'rev_list', '-1', '--first-parent',
+                    '--before={0}'.format(before), head)
+    if base == '':
+        return 0
+    squashed = int(_run_git(repo, 'rev_list', '--count', '--first-parent',
+                            base))
+    if squashed < 2:
+        return 0
+
+    new = _run_git(
+        repo, 'commit_tree', '{0}^{{tree}}'.format(base), '-m',
+        'Squash history before {0}.'.format(
+            _run_git(repo, 'log', '-1', '--format=%cI', base)))
+    newer = _run_git(repo, 'rev_list', '--reverse', '--first-parent',
+                     '{0}..{1}'.format(base, head))
+    for commit in newer.split():
+        # The message is terminated, as GitPython strips the last
+        # newline of the output.
+        fields = _run_git(repo, 'log', '-1', '--format=%an%x00%ae%x00%aD'
+                          '%x00%cn%x00%ce%x00%cD%x00%B%x00',
+                          commit).split('\0')
+        env = dict(zip(('GIT_AUTHOR_NAME', 'GIT_AUTHOR_EMAIL',
+                        'GIT_AUTHOR_DATE', 'GIT_COMMITTER_NAME',
+                        'GIT_COMMITTER_EMAIL', 'GIT_COMMITTER_DATE'),
+                       fields))
+        new = _run_git(repo, 'commit_tree', '{0}^{{tree}}'.format(commit),
+                       '-p', new, '-m', fields[6].rstrip('\n'), env=env)
+    _run_git(repo, 'update_ref', '-m', 'passpy: squash history', 'HEAD', new,
+             head)
+    # Let go of the old commits, so they can be pruned.
+    _run_git(repo, 'reflog', 'expire', '--expire-unreachable=now', '--all')
+    return squashed
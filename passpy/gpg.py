@@ -14,10 +14,323 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import collections
+import hashlib
+import io
+import json
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
 
 from gnupg import GPG
 
+from passpy.cancel import (
+    ProcessWatch,
+    check_operation,
+    get_operation_context,
+    get_remaining_time
+)
+from passpy.util import wipe
+
+try:
+    import gpg as gpgme
+except ImportError:
+    gpgme = None
+
+try:
+    import pgpy
+    from pgpy.constants import SymmetricKeyAlgorithm
+except ImportError:
+    pgpy = None
+
+
+# OpenPGP packet tags, see RFC 4880 section 4.3.
+_PKESK_TAG = 1
+_ENCRYPTED_DATA_TAGS = (9, 18)
+
+# The maximum number of bytes of the encrypted data packet handed to
+# gpg when extracting the session key.  gpg reports the session key
+# before it starts decrypting the data, so it never needs the whole
+# packet.
+_SESSION_KEY_PROBE_SIZE = 4096
+
+# The number of seconds the key IDs of recipients are cached.
+_KEY_CACHE_TIME = 60
+
+_ARMOR_BEGIN = '-----BEGIN PGP MESSAGE-----'
+_ARMOR_END = '-----END PGP MESSAGE-----'
+
+#: Priority of gpg jobs someone is waiting for, like reading a single
+#: key.  The default.
+PRIORITY_INTERACTIVE = 0
+#: Priority of gpg jobs of bulk operations, like reencrypting a
+#: directory.
+PRIORITY_BULK = 1
+
+_PRIORITY_NAMES = ('interactive', 'bulk')
+
+# The seconds between checks for cancellation while waiting for a job
+# slot, as cancelling does not wake up waiting jobs.
+_CANCEL_POLL_TIME = 0.1
+
+# The weight of the latest job in the moving average of the duration of
+# gpg jobs.
+_LATENCY_WEIGHT = 0.2
+
+_job_context = threading.local()
+
+
+def get_job_context():
+    """Get the priority and flow of the gpg jobs of the current thread.
+
+    :rtype: (int, object)
+    :returns: The priority and the flow, which is ``None`` unless set
+        by :func:`job_context`.
+
+    """
+    return (getattr(_job_context, 'priority', PRIORITY_INTERACTIVE),
+            getattr(_job_context, 'flow', None))
+
+
+@contextmanager
+def job_context(priority, flow=None):
+    """Set the priority of all gpg jobs of the current thread within
+    a `with` block.
+
+    Jobs of the same flow wait behind each other, while the flows of
+    the same priority take turns.
+
+    :param int priority: :data:`PRIORITY_INTERACTIVE` or
+        :data:`PRIORITY_BULK`.
+
+    :param flow: (optional) The flow the jobs belong to.  A new flow
+        is started if not given.
+    :type flow: object
+
+    """
+    old_context = get_job_context()
+    _job_context.priority = priority
+    _job_context.flow = flow if flow is not None else object()
+    try:
+        yield
+    finally:
+        _job_context.priority, _job_context.flow = old_context
+
+
+class GPGScheduler():
+    """Limits how many gpg jobs run at once.
+
+    Waiting jobs start in order of their priority.  Within a priority
+    the flows take turns, so a single bulk operation can't hold up all
+    others.  Jobs are run by the thread that submits them.
+
+    """
+    def __init__(self, max_jobs=None):
+        """Creates a new GPGScheduler object.
+
+        :param int max_jobs: (optional) The maximum number of gpg jobs
+            running at once.  Defaults to the number of CPUs.
+
+        """
+        if max_jobs is None:
+            max_jobs = os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self._cond = threading.Condition()
+        self._running = 0
+        # For every priority the waiting tickets of every flow, the
+        # flow whose turn it is first.
+        self._queues = [collections.OrderedDict() for _ in _PRIORITY_NAMES]
+        self._local = threading.local()
+        self._submitted = [0] * len(_PRIORITY_NAMES)
+        self._max_queued = [0] * len(_PRIORITY_NAMES)
+        self._wait_time = [0.0] * len(_PRIORITY_NAMES)
+        # The moving average of the seconds a job took, once measured.
+        self._latency = None
+
+    def set_max_jobs(self, max_jobs):
+        """Change the maximum number of gpg jobs running at once.
+
+        :param int max_jobs: The new maximum.
+
+        """
+        with self._cond:
+            self.max_jobs = max_jobs
+            self._cond.notify_all()
+
+    def _next_ticket(self):
+        for queue in self._queues:
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _get_wait_time(self):
+        """Get the seconds to wait for a job slot before checking the
+        current operation again.
+
+        :rtype: float
+        :returns: The seconds, ``None`` to wait until woken up.
+
+        """
+        timeout = get_remaining_time()
+        _, token = get_operation_context()
+        if token is not None:
+            if timeout is None or timeout > _CANCEL_POLL_TIME:
+                timeout = _CANCEL_POLL_TIME
+        return timeout
+
+    def acquire(self):
+        """Wait until a new gpg job may start.
+
+        Every successful call has to be followed by a call to
+        :meth:`release`.
+
+        :raises passpy.exceptions.OperationCancelledError: if the
+            current operation is cancelled while waiting.
+
+        :raises passpy.exceptions.OperationTimeoutError: if the deadline
+            of the current operation passes while waiting.
+
+        """
+        priority, flow = get_job_context()
+        if flow is None:
+            flow = threading.get_ident()
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            queue = self._queues[priority]
+            queue.setdefault(flow, collections.deque()).append(ticket)
+            self._submitted[priority] += 1
+            self._max_queued[priority] = max(
+                self._max_queued[priority],
+                sum(len(tickets) for tickets in queue.values()))
+            try:
+                while (self._running >= self.max_jobs
+                       or self._next_ticket() is not ticket):
+                    check_operation()
+                    self._cond.wait(self._get_wait_time())
+            except BaseException:
+                # A ticket left behind would block everyone else.
+                tickets = queue[flow]
+                tickets.remove(ticket)
+                if not tickets:
+                    del queue[flow]
+                self._cond.notify_all()
+                raise
+            tickets = queue.pop(flow)
+            tickets.popleft()
+            if tickets:
+                # Other flows go first next time.
+                queue[flow] = tickets
+            self._running += 1
+            self._wait_time[priority] += time.monotonic() - start
+            self._cond.notify_all()
+
+    def release(self):
+        """Mark a gpg job started with :meth:`acquire` as done.
+        """
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def _run(self, timed, func, args, kwargs):
+        if getattr(self._local, 'running', False):
+            return func(*args, **kwargs)
+        self.acquire()
+        self._local.running = True
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            self._local.running = False
+            self.release()
+        if timed:
+            self._record_latency(time.monotonic() - start)
+        return result
+
+    def _record_latency(self, seconds):
+        with self._cond:
+            if self._latency is None:
+                self._latency = seconds
+            else:
+                self._latency += _LATENCY_WEIGHT * (seconds - self._latency)
+
+    def run(self, func, *args, **kwargs):
+        """Run a gpg job once it may start.
+
+        Jobs started from within another job run right away.  The
+        duration of jobs that finish is added to the moving average
+        reported by :meth:`metrics`.
+
+        :param func: The job.
+        :type func: function
+
+        :returns: The result of `func`.
+
+        """
+        return self._run(True, func, args, kwargs)
+
+    def run_untimed(self, func, *args, **kwargs):
+        """Like :meth:`run`, for jobs whose duration says nothing about
+        how long encrypting or decrypting takes, e.g. starting a gpg
+        process without waiting for it or listing keys.
+        """
+        return self._run(False, func, args, kwargs)
+
+    def metrics(self):
+        """Get the state of the scheduler.
+
+        :rtype: dict
+        :returns: The maximum and current number of running jobs under
+            'max_jobs' and 'running', and for every priority name the
+            current and highest number of waiting jobs, the number of
+            submitted jobs and the seconds spent waiting in total under
+            'queued', 'max_queued', 'submitted' and 'wait_time'.  The
+            moving average of the seconds a job took is under
+            'latency', ``None`` until a job finished.
+
+        """
+        with self._cond:
+            return {
+                'max_jobs': self.max_jobs,
+                'running': self._running,
+                'latency': self._latency,
+                'queued': dict(
+                    (name, sum(len(tickets) for tickets in queue.values()))
+                    for name, queue in zip(_PRIORITY_NAMES, self._queues)),
+                'max_queued': dict(zip(_PRIORITY_NAMES, self._max_queued)),
+                'submitted': dict(zip(_PRIORITY_NAMES, self._submitted)),
+                'wait_time': dict(zip(_PRIORITY_NAMES, self._wait_time)),
+            }
+
+
+#: The scheduler shared by all crypto backends.
+SCHEDULER = GPGScheduler()
+
+
+def _get_gpg_id_dir(path):
+    """Find the directory whose .gpg-id file applies to the given path.
+
+    :param str path: The directory to look for the .gpg-id file from.
+
+    :rtype: str
+    :returns: `path` or the first of its parents containing a .gpg-id
+        file, ``None`` if there is none.
+
+    """
+    while True:
+        if os.path.isfile(os.path.join(path, '.gpg-id')):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
 
 def _get_gpg_recipients(path):
     """Get the GPG recipients for the given path.
@@ -32,21 +345,1402 @@ def _get_gpg_recipients(path):
         path.
 
     """
-    while True:
-        gpg_id_path = os.path.join(path, '.gpg-id')
-        if os.path.isfile(gpg_id_path):
-            break;
-        path = os.path.dirname(path)
-
-    if path is None or path == '':
+    path = _get_gpg_id_dir(path)
+    if path is None:
         raise FileNotFoundError(
                 'You must initialise the password store first!')
 
+    gpg_id_path = os.path.join(path, '.gpg-id')
     with open(gpg_id_path) as gpg_id_file:
         gpg_recipients = [line.rstrip('\n') for line in gpg_id_file]
     return gpg_recipients
 
 
+def _crc24(data):
+    """Calculate the CRC-24 checksum used by OpenPGP's ASCII armor.
+
+    :param bytes data: The data to calculate the checksum for.
+
+    :rtype: int
+    :returns: The checksum.
+
+    """
+    crc = 0xb704ce
+    for byte in data:
+        crc ^= byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864cfb
+    return crc & 0xffffff
+
+
+def _dearmor(data):
+    """Remove the ASCII armor from an OpenPGP message.
+
+    :param bytes data: The ASCII armored message.
+
+    :raises ValueError: if `data` is not an armored message.
+
+    :rtype: bytes
+    :returns: The binary message.
+
+    """
+    lines = data.decode('ascii').splitlines()
+    try:
+        body = lines[lines.index(_ARMOR_BEGIN) + 1:lines.index(_ARMOR_END)]
+    except ValueError:
+        raise ValueError('Not an ASCII armored OpenPGP message.')
+    # Skip the armor headers, which end with an empty line.
+    if '' in body:
+        body = body[body.index('') + 1:]
+    if len(body) > 0 and body[-1].startswith('='):
+        body = body[:-1]
+    return base64.b64decode(''.join(body))
+
+
+def _armor(data):
+    """ASCII armor an OpenPGP message.
+
+    :param bytes data: The binary message.
+
+    :rtype: bytes
+    :returns: The ASCII armored message.
+
+    """
+    encoded = base64.b64encode(data).decode('ascii')
+    lines = [_ARMOR_BEGIN, '']
+    lines += [encoded[i:i + 64] for i in range(0, len(encoded), 64)]
+    lines.append('=' + base64.b64encode(_crc24(data).to_bytes(3, 'big'))
+                 .decode('ascii'))
+    lines.append(_ARMOR_END)
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def _read_packet_header(data, offset):
+    """Parse the header of the OpenPGP packet starting at `offset`.
+
+    :param bytes data: The OpenPGP message.
+
+    :param int offset: The offset of the packet in `data`.
+
+    :raises ValueError: if there is no packet at `offset`.
+
+    :rtype: (int, int, int)
+    :returns: The packet tag, the offset of the packet body and the
+        length of the body.  The length is ``None`` for packets with
+        partial or indeterminate length.
+
+    """
+    ctb = data[offset]
+    if not ctb & 0x80:
+        raise ValueError('No OpenPGP packet at offset {0}.'.format(offset))
+    # New format packet header.
+    if ctb & 0x40:
+        tag = ctb & 0x3f
+        first = data[offset + 1]
+        if first < 192:
+            return tag, offset + 2, first
+        if first < 224:
+            length = ((first - 192) << 8) + data[offset + 2] + 192
+            return tag, offset + 3, length
+        if first == 255:
+            return (tag, offset + 6,
+                    int.from_bytes(data[offset + 2:offset + 6], 'big'))
+        return tag, offset + 2, None
+    # Old format packet header.
+    tag = (ctb >> 2) & 0x0f
+    length_type = ctb & 0x03
+    if length_type == 3:
+        return tag, offset + 1, None
+    size = 1 << length_type
+    return (tag, offset + 1 + size,
+            int.from_bytes(data[offset + 1:offset + 1 + size], 'big'))
+
+
+def _split_session_key_packets(data):
+    """Split an encrypted message into its session key packets and
+    the encrypted data.
+
+    :param bytes data: The encrypted OpenPGP message.
+
+    :raises ValueError: if `data` is not a list of public-key
+        encrypted session key packets followed by an encrypted data
+        packet.
+
+    :rtype: (list, int)
+    :returns: The list of session key packets and the offset of the
+        encrypted data packet in `data`.
+
+    """
+    packets = []
+    offset = 0
+    try:
+        while offset < len(data):
+            tag, body, length = _read_packet_header(data, offset)
+            if tag in _ENCRYPTED_DATA_TAGS and len(packets) > 0:
+                return packets, offset
+            if tag != _PKESK_TAG or length is None:
+                raise ValueError('Unsupported OpenPGP packet with tag {0}.'
+                                 .format(tag))
+            packets.append(data[offset:body + length])
+            offset = body + length
+    except IndexError:
+        raise ValueError('Truncated OpenPGP message.')
+    raise ValueError('No encrypted data packet found.')
+
+
+def _read_encrypted_key(path):
+    """Read a key and split it into its session key packets and the
+    encrypted data.
+
+    :param str path: The path to a gpg encrypted file.
+
+    :raises ValueError: if the key is not a message as written by
+        gpg for public key encryption.
+
+    :rtype: (bytes, bool, list, int)
+    :returns: The binary message, whether the key is ASCII armored, the
+        session key packets and the offset of the encrypted data
+        packet.
+
+    """
+    with open(path, 'rb') as key_file:
+        key_data_enc = key_file.read()
+    armored = key_data_enc.startswith(_ARMOR_BEGIN.encode('ascii'))
+    if armored:
+        key_data_enc = _dearmor(key_data_enc)
+    packets, offset = _split_session_key_packets(key_data_enc)
+    return key_data_enc, armored, packets, offset
+
+
+def _get_session_key_packet_key_id(packet):
+    """Get the ID of the key a session key packet is encrypted for.
+
+    :param bytes packet: A public-key encrypted session key packet.
+
+    :rtype: str
+    :returns: The long key ID in upper case hex.
+
+    """
+    _, body, _ = _read_packet_header(packet, 0)
+    # The first byte of the body is the packet version.
+    return packet[body + 1:body + 9].hex().upper()
+
+
+def _write_file(path, data):
+    """Replace a file atomically, so it is never left half-written.
+
+    :param str path: The path of the file.
+
+    :param bytes data: The new content.
+
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class _GPG(GPG):
+    """python-gnupg, killing gpg once the current operation times out
+    or is cancelled.
+    """
+    def __init__(self, *args, **kwargs):
+        # python-gnupg already starts gpg to find out its version.
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def _open_subprocess(self, args, passphrase=False):
+        proc = super()._open_subprocess(args, passphrase)
+        if not hasattr(self._local, 'watches'):
+            self._local.watches = []
+        self._local.watches.append(ProcessWatch(proc))
+        return proc
+
+    def call(self, func, *args, **kwargs):
+        """Call a method of python-gnupg.
+
+        :param func: The method.
+        :type func: function
+
+        :raises passpy.exceptions.OperationTimeoutError: if gpg was
+            killed because the deadline passed.
+
+        :raises passpy.exceptions.OperationCancelledError: if gpg was
+            killed because the operation was cancelled.
+
+        :returns: The result of `func`.
+
+        """
+        check_operation()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            watches, self._local.watches = getattr(
+                self._local, 'watches', []), []
+            errors = []
+            for watch in watches:
+                try:
+                    watch.stop()
+                except Exception as e:
+                    errors.append(e)
+            if len(errors) > 0:
+                raise errors[0]
+
+
+class _BufferReader():
+    """Minimal read-only file object on top of a buffer.
+
+    Unlike :class:`io.BytesIO` the buffer is not copied.
+
+    """
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.offset
+        chunk = self.data[self.offset:self.offset + size].tobytes()
+        self.offset += len(chunk)
+        return chunk
+
+
+class _KeyWriter(io.BytesIO):
+    """Collects key data in memory and writes the key when closed.
+
+    Used by :meth:`passpy.gpg.CryptoBackend.open_key` for backends
+    that can't stream.
+
+    """
+    def __init__(self, backend, path, on_close=None):
+        super().__init__()
+        self.backend = backend
+        self.path = path
+        self.on_close = on_close
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.backend.write_key_bytes(self.path, self.getbuffer())
+        finally:
+            wipe(self.getbuffer())
+            super().close()
+        if self.on_close is not None:
+            self.on_close()
+
+    def abort(self):
+        """Throw away the data written so far, leaving the key as it
+        was.
+        """
+        if self.closed:
+            return
+        wipe(self.getbuffer())
+        super().close()
+
+
+class _GPGReader(io.RawIOBase):
+    """Reads the standard output of a decrypting gpg process.
+    """
+    def __init__(self, proc, errors, watch):
+        self.proc = proc
+        self.errors = errors
+        self.watch = watch
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.proc.stdout.readinto(buffer)
+        if count == 0:
+            self._eof = True
+        return count
+
+    def close(self):
+        if self.closed:
+            return
+        self.proc.stdout.close()
+        returncode = self.proc.wait()
+        super().close()
+        try:
+            self.watch.stop()
+        except Exception:
+            self.errors.close()
+            raise
+        # gpg only reports manipulated data once it reaches the end of
+        # the message, so an error may only show up now.
+        if self._eof and returncode != 0:
+            self.errors.seek(0)
+            raise OSError('gpg failed to decrypt: {0}'.format(
+                self.errors.read().decode(errors='replace').strip()))
+        self.errors.close()
+
+
+class _GPGWriter(io.RawIOBase):
+    """Writes to the standard input of an encrypting gpg process.
+
+    gpg writes to a temporary file, which only replaces the key once
+    gpg finished successfully.
+
+    """
+    def __init__(self, proc, errors, watch, tmp_path, path, on_close=None):
+        self.proc = proc
+        self.errors = errors
+        self.watch = watch
+        self.tmp_path = tmp_path
+        self.path = path
+        self.on_close = on_close
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            # gpg was killed.
+            pass
+        returncode = self.proc.wait()
+        super().close()
+        try:
+            self.watch.stop()
+        except Exception:
+            os.remove(self.tmp_path)
+            self.errors.close()
+            raise
+        if returncode != 0:
+            os.remove(self.tmp_path)
+            self.errors.seek(0)
+            raise OSError('gpg failed to encrypt: {0}'.format(
+                self.errors.read().decode(errors='replace').strip()))
+        self.errors.close()
+        os.replace(self.tmp_path, self.path)
+        if self.on_close is not None:
+            self.on_close()
+
+    def abort(self):
+        """Kill gpg and throw away its output, leaving the key as it
+        was.
+        """
+        if self.closed:
+            return
+        try:
+            self.proc.kill()
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.proc.wait()
+            super().close()
+        finally:
+            try:
+                self.watch.stop()
+            except Exception:
+                # Killed by us, not by the watch.
+                pass
+            self.errors.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+class _BufferedKeyWriter(io.BufferedWriter):
+    """Buffers the writes to a :class:`_GPGWriter`.
+
+    Leaving a ``with`` block with an exception aborts the write
+    instead of encrypting what was written so far.
+
+    """
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def abort(self):
+        """See :meth:`_GPGWriter.abort`.
+        """
+        # With the raw file closed, closing drops the buffered data
+        # instead of flushing it.
+        self.raw.abort()
+        super().close()
+
+
+class CryptoBackend():
+    """Base class for the crypto backends used by
+    :class:`passpy.store.Store`.
+
+    A backend only has to implement :meth:`encrypt` and
+    :meth:`decrypt`.  Reading, writing and reencrypting keys are
+    built on top of these two methods, but may be overwritten if a
+    backend can do better.
+
+    """
+    #: The encoding used to convert key data to and from bytes.
+    #: python-gnupg defaults to latin-1, so every backend does the
+    #: same to keep existing stores readable.
+    encoding = 'latin-1'
+
+    #: The :class:`GPGScheduler` all gpg jobs of the backend go
+    #: through.
+    scheduler = SCHEDULER
+
+    def decrypt(self, data):
+        """Decrypt data.
+
+        :param bytes data: The encrypted data.
+
+        :raises OSError: if the data could not be decrypted.
+
+        :rtype: bytes or bytearray
+        :returns: The decrypted data.
+
+        """
+        raise NotImplementedError
+
+    def encrypt(self, data, gpg_recipients):
+        """Encrypt data for the given recipients.
+
+        :param data: The data to encrypt.
+        :type data: bytes, bytearray or memoryview
+
+        :param list gpg_recipients: The list of GPG Ids to encrypt the
+            data with.
+
+        :raises OSError: if the data could not be encrypted.
+
+        :rtype: bytes
+        :returns: The encrypted data.
+
+        """
+        raise NotImplementedError
+
+    def get_recipients(self, data):
+        """Find out whom data is encrypted for, without decrypting it.
+
+        Only the key IDs in the session key packets are read.
+
+        :param bytes data: The encrypted data.
+
+        :rtype: list
+        :returns: The sorted GPG Ids that encrypt for exactly the same
+            keys when passed to :meth:`encrypt`, ``None`` if they
+            can't be told.
+
+        """
+        try:
+            if data.startswith(_ARMOR_BEGIN.encode('ascii')):
+                data = _dearmor(data)
+            packets, _ = _split_session_key_packets(data)
+        except ValueError:
+            return None
+        # The exclamation mark makes gpg use exactly this (sub)key.
+        return sorted('{0}!'.format(_get_session_key_packet_key_id(packet))
+                      for packet in packets)
+
+    def read_key(self, path):
+        """Read and decrypt a single key file.
+
+        :param str path: The path to the key to decrypt.
+
+        :rtype: str
+        :returns: The unencrypted content of the file at `path`.
+
+        """
+        key_data = self.read_key_bytes(path)
+        try:
+            return key_data.decode(self.encoding)
+        finally:
+            wipe(key_data)
+
+    def read_key_bytes(self, path):
+        """Read and decrypt a single key file into a mutable buffer.
+
+        The caller can wipe the returned buffer with
+        :func:`passpy.util.wipe` once it is done with the key.
+
+        :param str path: The path to the key to decrypt.
+
+        :rtype: bytearray
+        :returns: The unencrypted content of the file at `path`.
+
+        """
+        with open(path, 'rb') as key_file:
+            key_data_enc = key_file.read()
+        key_data = self.decrypt(key_data_enc)
+        if isinstance(key_data, bytearray):
+            return key_data
+        return bytearray(key_data)
+
+    def write_key(self, path, key_data):
+        """Encrypt and write a single key file.
+
+        :param str path: The path to the key to encrypt.
+
+        :param str key_data: The data to write.  A newline is added
+            if it does not end with one.
+
+        """
+        # pass always ends it's files with an endline
+        if not key_data.endswith('\n'):
+            key_data += '\n'
+        key_data = bytearray(key_data.encode(self.encoding))
+        try:
+            self.write_key_bytes(path, key_data)
+        finally:
+            wipe(key_data)
+
+    def write_key_bytes(self, path, key_data):
+        """Encrypt and write a single key file from a buffer.
+
+        `key_data` is neither copied nor changed, so binary data is
+        stored as it is.
+
+        :param str path: The path to the key to encrypt.
+
+        :param key_data: The data to write.
+        :type key_data: bytes, bytearray or memoryview
+
+        """
+        gpg_recipients = _get_gpg_recipients(path)
+        key_data_enc = self.encrypt(memoryview(key_data).cast('B'),
+                                    gpg_recipients)
+        _write_file(path, key_data_enc)
+
+    def open_key(self, path, mode='rb', on_close=None):
+        """Open a key as a binary file object.
+
+        Backends that can't stream hold the whole key in memory.
+
+        :param str path: The path to the key.
+
+        :param str mode: (optional) ``'rb'`` to decrypt the key,
+            ``'wb'`` to encrypt new data to it.
+
+        :param on_close: (optional) Called without arguments once a
+            key opened for writing has been written.  Not called if the
+            write is aborted.
+        :type on_close: function
+
+        :raises ValueError: if `mode` is neither ``'rb'`` nor ``'wb'``.
+
+        :rtype: file object
+        :returns: A readable or writable binary file object.
+
+        """
+        if mode == 'rb':
+            return io.BytesIO(self.read_key_bytes(path))
+        elif mode == 'wb':
+            return _KeyWriter(self, path, on_close)
+        raise ValueError('Invalid mode {0}.'.format(mode))
+
+    def clear_cache(self):
+        """Forget everything cached about the recipients of keys.
+
+        Called by :class:`passpy.store.Store` when `.gpg-id` files
+        changed.  Does nothing by default.
+
+        """
+        pass
+
+    def is_encrypted_for(self, path, gpg_recipients):
+        """Check if a key is encrypted for exactly the given recipients.
+
+        Backends that can't tell always return ``False``.
+
+        :param str path: The path to a gpg encrypted file.
+
+        :param list gpg_recipients: The list of GPG Ids.
+
+        :rtype: bool
+        :returns: ``True`` if the key is encrypted for the keys of
+            `gpg_recipients` and no one else, ``False`` otherwise.
+
+        """
+        return False
+
+    def rewrap_key(self, path, gpg_recipients):
+        """Encrypt the session key of a single key for new recipients.
+
+        Only the session key packets of the key are replaced, the
+        encrypted data stays untouched.  Backends that can't do this
+        return ``False``, in which case the key has to be reencrypted
+        with :meth:`reencrypt_key` instead.
+
+        :param str path: The path to a gpg encrypted file.
+
+        :param list gpg_recipients: The list of GPG Ids to encrypt the
+            session key for.
+
+        :rtype: bool
+        :returns: ``True`` if the key is now encrypted for
+            `gpg_recipients`, ``False`` otherwise.
+
+        """
+        return False
+
+    def reencrypt_key(self, path, gpg_recipients):
+        """Reencrypt a single key.
+
+        :param str path: The path to a gpg encrypted file.
+
+        :param list gpg_recipients: The list of GPG Ids to encrypt the
+            key with.
+
+        """
+        with open(path, 'rb') as key_file:
+            key_data = self.decrypt(key_file.read())
+        key_data_enc = self.encrypt(key_data, gpg_recipients)
+        _write_file(path, key_data_enc)
+
+
+class GPGBackend(CryptoBackend):
+    """Crypto backend calling the gpg binary through `python-gnupg`_.
+
+    Every operation forks a new gpg process.  This is the default
+    backend.
+
+    .. _python-gnupg: https://bitbucket.org/vinay.sajip/python-gnupg
+
+    """
+    def __init__(self, gpg_bin='gpg2', gpg_opts=None):
+        """Creates a new GPGBackend object.
+
+        :param str gpg_bin: (optional) The path to the gpg binary.
+
+        :param list gpg_opts: (optional) The options for gpg.
+
+        """
+        self.gpg_bin = gpg_bin
+        self.gpg_opts = gpg_opts
+        self.gpg = _GPG(gpgbinary=gpg_bin, options=gpg_opts)
+        self._public_keys = {}
+        self._recipient_keys = {}
+
+    def _run(self, args, data):
+        """Run gpg directly, bypassing python-gnupg.
+
+        :param list args: The arguments for gpg.  They will be added
+            after :attr:`gpg_opts`.
+
+        :param bytes data: The data to pass to gpg's standard input.
+
+        :rtype: :class:`subprocess.CompletedProcess`
+        :returns: The finished gpg process.
+
+        """
+        cmd = [self.gpg_bin, '--no-tty'] + list(self.gpg_opts or []) + args
+
+        def run():
+            check_operation()
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            watch = ProcessWatch(proc)
+            try:
+                stdout, stderr = proc.communicate(data)
+            finally:
+                watch.stop()
+            return subprocess.CompletedProcess(cmd, proc.returncode,
+                                               stdout, stderr)
+        return self.scheduler.run(run)
+
+    def _popen(self, args, **kwargs):
+        """Start gpg directly, bypassing python-gnupg.
+
+        :param list args: The arguments for gpg.  They will be added
+            after :attr:`gpg_opts`.
+
+        Only starting gpg goes through :attr:`scheduler`.  The process
+        may be read from or written to for as long as the caller
+        likes, so it does not keep a job slot, which would block all
+        other gpg jobs meanwhile.
+
+        :rtype: (:class:`subprocess.Popen`, file object,
+            :class:`passpy.cancel.ProcessWatch`)
+        :returns: The gpg process, a temporary file receiving gpg's
+            standard error and the watch that kills gpg once the
+            current operation times out or is cancelled.
+
+        """
+        check_operation()
+        errors = tempfile.TemporaryFile()
+        cmd = [self.gpg_bin, '--no-tty'] + list(self.gpg_opts or []) + args
+        try:
+            proc = self.scheduler.run_untimed(subprocess.Popen, cmd,
+                                              stderr=errors, **kwargs)
+        except Exception:
+            errors.close()
+            raise
+        return proc, errors, ProcessWatch(proc)
+
+    def open_key(self, path, mode='rb', on_close=None):
+        """Open a key as a binary file object.
+
+        The data is piped through gpg in chunks, so memory usage does
+        not depend on the size of the key.  Keys written this way are
+        not ASCII armored, just like the ones pass writes.
+
+        :param str path: The path to the key.
+
+        :param str mode: (optional) ``'rb'`` to decrypt the key,
+            ``'wb'`` to encrypt new data to it.
+
+        :param on_close: (optional) Called without arguments once a
+            key opened for writing has been written.  Not called if the
+            write is aborted.
+        :type on_close: function
+
+        :raises ValueError: if `mode` is neither ``'rb'`` nor ``'wb'``.
+
+        :rtype: file object
+        :returns: A readable or writable binary file object.
+
+        """
+        if mode == 'rb':
+            proc, errors, watch = self._popen(['--decrypt', path],
+                                              stdout=subprocess.PIPE)
+            return io.BufferedReader(_GPGReader(proc, errors, watch))
+        elif mode == 'wb':
+            args = ['--encrypt']
+            for gpg_id in _get_gpg_recipients(path):
+                args += ['--recipient', gpg_id]
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            prefix='.', suffix='.tmp')
+            os.close(fd)
+            try:
+                proc, errors, watch = self._popen(
+                    args + ['--output', tmp_path], stdin=subprocess.PIPE)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            return _BufferedKeyWriter(_GPGWriter(proc, errors, watch,
+                                                 tmp_path, path, on_close))
+        raise ValueError('Invalid mode {0}.'.format(mode))
+
+    def _get_recipient_keys(self, gpg_recipients):
+        """Look up the public keys for the given recipients.
+
+        Results are cached for :data:`passpy.gpg._KEY_CACHE_TIME`
+        seconds.
+
+        :param list gpg_recipients: The list of GPG Ids to look up.
+
+        :rtype: dict
+        :returns: A dictionary mapping the fingerprint of each key to
+            the set of IDs of its encryption capable (sub)keys.  ``None``
+            if no key could be found for some recipient.
+
+        """
+        cache_key = tuple(gpg_recipients)
+        cached = self._recipient_keys.get(cache_key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        keys = self._list_recipient_keys(gpg_recipients)
+        self._recipient_keys[cache_key] = (time.monotonic()
+                                           + _KEY_CACHE_TIME, keys)
+        return keys
+
+    def _list_recipient_keys(self, gpg_recipients):
+        """Uncached version of :meth:`_get_recipient_keys`.
+        """
+        keys = {}
+        for gpg_id in gpg_recipients:
+            found = self.scheduler.run_untimed(
+                self.gpg.call, self.gpg.list_keys, keys=[gpg_id])
+            if len(found) == 0:
+                return None
+            for key in found:
+                key_ids = set()
+                if 'e' in key['cap']:
+                    key_ids.add(key['keyid'])
+                for subkey in key['subkeys']:
+                    if 'e' in subkey[1]:
+                        key_ids.add(subkey[0])
+                keys[key['fingerprint']] = key_ids
+        return keys
+
+    def _get_session_key(self, key_data_enc, offset):
+        """Decrypt the session key of an encrypted message.
+
+        :param bytes key_data_enc: The encrypted message.
+
+        :param int offset: The offset of the encrypted data packet in
+            `key_data_enc`.
+
+        :rtype: (int, bytes)
+        :returns: The symmetric cipher algorithm and the session key.
+            ``None`` if gpg could not decrypt the session key.
+
+        """
+        _, body, length = _read_packet_header(key_data_enc, offset)
+        if length is not None:
+            length = min(length, _SESSION_KEY_PROBE_SIZE)
+        elif key_data_enc[offset] & 0x40:
+            # gpg needs the whole first chunk of a partial length
+            # packet.
+            length = 1 << (key_data_enc[offset + 1] & 0x1f)
+        else:
+            length = _SESSION_KEY_PROBE_SIZE
+        # Should gpg not be able to work with the truncated packet, we
+        # fall back to passing along the whole message.
+        for data in (key_data_enc[:body + length], key_data_enc):
+            proc = self._run(['--status-fd', '1', '--show-session-key',
+                              '--output', os.devnull, '--decrypt'], data)
+            for line in proc.stdout.splitlines():
+                if line.startswith(b'[GNUPG:] SESSION_KEY '):
+                    algo, session_key = line.split()[2].decode().split(':')
+                    return int(algo), bytes.fromhex(session_key)
+        return None
+
+    def _get_public_key(self, fingerprint):
+        """Get the public key for `fingerprint` as a PGPy key.
+
+        :param str fingerprint: The fingerprint of the key.
+
+        :rtype: :class:`pgpy.PGPKey`
+        :returns: The public key.
+
+        """
+        if fingerprint not in self._public_keys:
+            key, _ = pgpy.PGPKey.from_blob(
+                self.scheduler.run_untimed(self.gpg.call,
+                                           self.gpg.export_keys,
+                                           fingerprint))
+            self._public_keys[fingerprint] = key
+        return self._public_keys[fingerprint]
+
+    def decrypt(self, data):
+        """Decrypt data into a buffer that can be wiped.
+
+        gpg is run directly, as python-gnupg only returns immutable
+        bytes.  Its output is read unbuffered, and whenever the buffer
+        has to grow the old one is wiped, so no copy of the plaintext
+        is left behind.
+
+        :param bytes data: The encrypted data.
+
+        :raises OSError: if the data could not be decrypted.
+
+        :rtype: bytearray
+        :returns: The decrypted data.
+
+        """
+        def feed(stdin):
+            try:
+                with memoryview(data) as view, view.cast('B') as chunk:
+                    offset = 0
+                    while offset < len(chunk):
+                        offset += stdin.write(chunk[offset:])
+            except BrokenPipeError:
+                # gpg stops reading once it fails, which it reports
+                # through its return code.
+                pass
+            finally:
+                try:
+                    stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        def run():
+            proc, errors, watch = self._popen(
+                ['--decrypt'], bufsize=0, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+            # The plaintext is rarely larger than the message, unless
+            # it was compressed.
+            key_data = bytearray(len(data) + io.DEFAULT_BUFFER_SIZE)
+            size = 0
+            try:
+                writer = threading.Thread(target=feed, args=(proc.stdin,),
+                                          daemon=True)
+                writer.start()
+                while True:
+                    if size == len(key_data):
+                        grown = bytearray(2 * len(key_data))
+                        grown[:size] = key_data
+                        wipe(key_data)
+                        key_data = grown
+                    with memoryview(key_data) as view:
+                        with view[size:] as chunk:
+                            count = proc.stdout.readinto(chunk)
+                    if not count:
+                        break
+                    size += count
+                writer.join()
+                proc.stdout.close()
+                returncode = proc.wait()
+                watch.stop()
+                if returncode != 0:
+                    errors.seek(0)
+                    raise OSError('gpg failed to decrypt: {0}'.format(
+                        errors.read().decode(errors='replace').strip()))
+            except BaseException:
+                proc.kill()
+                proc.wait()
+                wipe(key_data)
+                raise
+            finally:
+                errors.close()
+            if 2 * size >= len(key_data):
+                # CPython shrinks a bytearray in place as long as at
+                # least half of it is kept, so no copy is made.
+                key_data[size:] = bytes(len(key_data) - size)
+                del key_data[size:]
+                return key_data
+            result = key_data[:size]
+            wipe(key_data)
+            return result
+        return self.scheduler.run(run)
+
+    def encrypt(self, data, gpg_recipients):
+        # python-gnupg would copy data into a BytesIO object first.
+        result = self.scheduler.run(self.gpg.call, self.gpg.encrypt_file,
+                                    _BufferReader(data), gpg_recipients)
+        if not result.ok:
+            raise OSError('gpg failed to encrypt: {0}'.format(result.status))
+        return result.data
+
+    def clear_cache(self):
+        self._recipient_keys.clear()
+
+    def is_encrypted_for(self, path, gpg_recipients):
+        """Check if a key is encrypted for exactly the given recipients.
+
+        Only the key IDs in the session key packets are compared to
+        the encryption keys of `gpg_recipients`, nothing is decrypted.
+
+        :param str path: The path to a gpg encrypted file.
+
+        :param list gpg_recipients: The list of GPG Ids.
+
+        :rtype: bool
+        :returns: ``True`` if the key is encrypted for the keys of
+            `gpg_recipients` and no one else, ``False`` otherwise.
+
+        """
+        try:
+            _, _, packets, _ = _read_encrypted_key(path)
+        except ValueError:
+            return False
+        keys = self._get_recipient_keys(gpg_recipients)
+        if keys is None:
+            return False
+        current_ids = set(_get_session_key_packet_key_id(packet)
+                          for packet in packets)
+        wanted_ids = set()
+        for key_ids in keys.values():
+            wanted_ids |= key_ids
+        return (current_ids <= wanted_ids
+                and all(key_ids & current_ids for key_ids in keys.values()))
+
+    def rewrap_key(self, path, gpg_recipients):
+        """Encrypt the session key of a single key for new recipients.
+
+        gpg only decrypts the session key, the new session key packets
+        are then built with `PGPy`_ and put in front of the untouched
+        encrypted data packet.  If the key is already encrypted for
+        exactly `gpg_recipients` nothing is done at all, just like
+        pass does.
+
+        .. _PGPy: https://github.com/SecurityInnovation/PGPy
+
+        :param str path: The path to a gpg encrypted file.
+
+        :param list gpg_recipients: The list of GPG Ids to encrypt the
+            session key for.
+
+        :rtype: bool
+        :returns: ``True`` if the key is now encrypted for
+            `gpg_recipients`, ``False`` if PGPy is not installed or
+            the key can't be rewrapped.
+
+        """
+        if pgpy is None:
+            return False
+        if self.is_encrypted_for(path, gpg_recipients):
+            return True
+        try:
+            key_data_enc, armored, _, offset = _read_encrypted_key(path)
+        except ValueError:
+            return False
+        keys = self._get_recipient_keys(gpg_recipients)
+        if keys is None:
+            return False
+
+        session_key = self._get_session_key(key_data_enc, offset)
+        if session_key is None:
+            return False
+        cipher, session_key = session_key
+        message = pgpy.PGPMessage.new(b'')
+        try:
+            for fingerprint in keys:
+                public_key = self._get_public_key(fingerprint)
+                message = public_key.encrypt(
+                    message, cipher=SymmetricKeyAlgorithm(cipher),
+                    sessionkey=session_key)
+            new_packets, _ = _split_session_key_packets(bytes(message))
+        except (pgpy.errors.PGPError, NotImplementedError, TypeError,
+                ValueError):
+            # PGPy does not support every public key algorithm gpg
+            # does.
+            return False
+
+        key_data_enc = b''.join(new_packets) + key_data_enc[offset:]
+        if armored:
+            key_data_enc = _armor(key_data_enc)
+        _write_file(path, key_data_enc)
+        return True
+
+
+#: The gpg options :class:`GPGMEBackend` accepts, those passed by
+#: :class:`passpy.store.Store`.
+_GPGME_OPTS = frozenset(['--quiet', '--yes', '--compress-algo=none',
+                         '--no-encrypt-to', '--batch', '--use-agent'])
+
+
+def _gpgme_key_matches(key, gpg_id):
+    """Check if a GPGME key is the one a gpg id names exactly.
+
+    GPGME's key listing matches substrings, so ``bob@example.com``
+    would also find ``jim-bob@example.com``.
+
+    :param key: The key.
+    :type key: :class:`gpg.gpgme._gpgme_key`
+
+    :param str gpg_id: A line of a .gpg-id file: a key ID or
+        fingerprint, an email address with or without angle brackets,
+        or a full user ID.
+
+    :rtype: bool
+
+    """
+    gpg_id = gpg_id.strip()
+    key_id = gpg_id.rstrip('!').upper()
+    if key_id.startswith('0X'):
+        key_id = key_id[2:]
+    if len(key_id) >= 8 and all(c in '0123456789ABCDEF' for c in key_id):
+        return any(subkey.fpr.upper().endswith(key_id)
+                   for subkey in key.subkeys)
+    email = gpg_id.lower()
+    if email.startswith('<') and email.endswith('>'):
+        email = email[1:-1]
+    return any(uid.uid == gpg_id or (uid.email or '').lower() == email
+               for uid in key.uids if not (uid.revoked or uid.invalid))
+
+
+class GPGMEBackend(CryptoBackend):
+    """Crypto backend using the `GPGME`_ Python bindings.
+
+    All operations run in-process and share a single GPGME context,
+    so no new process has to be started for every key.  Recipient
+    key lookups are cached for :data:`passpy.gpg._KEY_CACHE_TIME`
+    seconds, and until the .gpg-id files change.
+
+    .. _GPGME: https://gnupg.org/software/gpgme/
+
+    """
+    def __init__(self, gpg_bin=None, gpg_opts=None):
+        """Creates a new GPGMEBackend object.
+
+        :param str gpg_bin: (optional) The path to the gpg binary
+            GPGME should use as its engine.  GPGME's default is used
+            if the binary can't be found.
+
+        :param list gpg_opts: (optional) GPGME does not accept command
+            line options, so only those in
+            :data:`passpy.gpg._GPGME_OPTS` are supported.
+            ``--compress-algo=none`` turns off compression, the others
+            have no effect in-process.
+
+        :raises ImportError: if the `gpg` Python module is not
+            installed.
+
+        :raises ValueError: if `gpg_opts` contains another option.
+
+        """
+        if gpgme is None:
+            raise ImportError('The GPGME backend needs the gpg Python '
+                              'module to be installed.')
+        for gpg_opt in gpg_opts or []:
+            if gpg_opt not in _GPGME_OPTS:
+                raise ValueError('The GPGME backend does not support the '
+                                 'gpg option {0}.'.format(gpg_opt))
+        self.compress = '--compress-algo=none' not in (gpg_opts or [])
+        self.context = gpgme.Context(armor=False)
+        if gpg_bin is not None and shutil.which(gpg_bin) is not None:
+            self.context.set_engine_info(gpgme.constants.PROTOCOL_OpenPGP,
+                                         file_name=shutil.which(gpg_bin))
+        # A GPGME context must not be used by several threads at once.
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def _get_keys(self, gpg_recipients):
+        """Look up the public keys for the given recipients.
+
+        Only keys the gpg ids name exactly and that can still encrypt
+        are used, so a revoked or expired key is dropped once it was
+        replaced.
+
+        :param list gpg_recipients: The list of GPG Ids to look up.
+
+        :raises OSError: if there is no key for one of the recipients.
+
+        :rtype: list
+        :returns: A list of :class:`gpg.gpgme._gpgme_key` objects.
+
+        """
+        keys = []
+        now = time.monotonic()
+        for gpg_id in gpg_recipients:
+            cached = self._keys.get(gpg_id)
+            if cached is None or cached[0] <= now:
+                found = [key for key in self.context.keylist(gpg_id)
+                         if key.can_encrypt
+                         and not (key.revoked or key.expired
+                                  or key.disabled or key.invalid)
+                         and _gpgme_key_matches(key, gpg_id)]
+                if len(found) == 0:
+                    raise OSError('No public key found for {0}.'
+                                  .format(gpg_id))
+                cached = (now + _KEY_CACHE_TIME, found)
+                self._keys[gpg_id] = cached
+            keys += cached[1]
+        return keys
+
+    # GPGME runs in-process and can't be killed, so the deadline and
+    # cancellation are only checked before every operation.
+    def _decrypt(self, data):
+        check_operation()
+        with self._lock:
+            try:
+                key_data, _, _ = self.context.decrypt(data, verify=False)
+            except gpgme.errors.GpgError as e:
+                raise OSError('gpg failed to decrypt: {0}'.format(e)) from e
+        return key_data
+
+    def _encrypt(self, data, gpg_recipients):
+        check_operation()
+        with self._lock:
+            keys = self._get_keys(gpg_recipients)
+            # Keys are never encrypted for gpg's encrypt-to keys, like
+            # with --no-encrypt-to.
+            try:
+                key_data_enc, _, _ = self.context.encrypt(
+                    data, recipients=keys, sign=False, always_trust=True,
+                    add_encrypt_to=False, compress=self.compress)
+            except gpgme.errors.GpgError as e:
+                raise OSError('gpg failed to encrypt: {0}'.format(e)) from e
+        return key_data_enc
+
+    def clear_cache(self):
+        with self._lock:
+            self._keys.clear()
+
+    def decrypt(self, data):
+        return self.scheduler.run(self._decrypt, data)
+
+    def encrypt(self, data, gpg_recipients):
+        return self.scheduler.run(self._encrypt, data, gpg_recipients)
+
+
+_FAKE_MAGIC = b'PASSPY-FAKE-GPG 1\n'
+
+
+def _fake_cipher(data):
+    """XOR data with a fixed key stream.
+
+    Applying it twice returns the original data.
+
+    :param data: The data.
+    :type data: bytes, bytearray or memoryview
+
+    :rtype: bytearray
+
+    """
+    data = memoryview(data).cast('B')
+    stream = bytearray()
+    counter = 0
+    while len(stream) < len(data):
+        stream += hashlib.sha256(_FAKE_MAGIC
+                                 + counter.to_bytes(8, 'big')).digest()
+        counter += 1
+    size = len(data)
+    result = (int.from_bytes(data, 'big')
+              ^ int.from_bytes(stream[:size], 'big'))
+    wipe(stream)
+    return bytearray(result.to_bytes(size, 'big'))
+
+
+class FakeBackend(CryptoBackend):
+    """A deterministic stand-in for gpg, for tests and benchmarks.
+
+    It offers **no security at all**: the data is only XORed with a
+    fixed key stream, behind a header naming the recipients.  No gpg
+    binary, keyring or agent is needed, and the same data always
+    encrypts to the same bytes, so everything that is measured is
+    passpy itself.  Each operation can be slowed down by `latency`
+    seconds to model gpg, and still goes through the scheduler, so
+    concurrency scales as it would with gpg.
+
+    Like :class:`GPGBackend` it knows who a key is encrypted for and
+    can rewrap keys by only replacing that header.
+
+    """
+    def __init__(self, gpg_bin=None, gpg_opts=None, latency=0):
+        """Creates a new FakeBackend object.
+
+        It is deliberately not offered by the command line, so it can
+        only be chosen from Python.
+
+        :param str gpg_bin: (optional) Ignored.  Only there to have the
+            same signature as :class:`passpy.gpg.GPGBackend`.
+
+        :param list gpg_opts: (optional) Ignored.
+
+        :param float latency: (optional) The seconds every encryption
+            and decryption takes.  No delay by default.
+
+        """
+        self.latency = latency
+        #: The number of ``'encrypt'`` and ``'decrypt'`` operations.
+        self.counts = {'encrypt': 0, 'decrypt': 0}
+        self._lock = threading.Lock()
+
+    def _wait(self, operation):
+        check_operation()
+        with self._lock:
+            self.counts[operation] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+            # Like a gpg process that would have been killed by now.
+            check_operation()
+
+    def _split(self, data):
+        """Split fake encrypted data into recipients and payload.
+
+        :raises ValueError: if `data` was not encrypted by this
+            backend.
+
+        :rtype: (list, memoryview)
+
+        """
+        data = memoryview(data).cast('B')
+        if bytes(data[:len(_FAKE_MAGIC)]) != _FAKE_MAGIC:
+            raise ValueError('The data was not encrypted by the fake '
+                             'backend.')
+        header_end = bytes(data).index(b'\n', len(_FAKE_MAGIC))
+        gpg_recipients = json.loads(
+            bytes(data[len(_FAKE_MAGIC):header_end]).decode('utf-8'))
+        return gpg_recipients, data[header_end + 1:]
+
+    def _header(self, gpg_recipients):
+        return _FAKE_MAGIC + json.dumps(
+            list(gpg_recipients)).encode('utf-8') + b'\n'
+
+    def decrypt(self, data):
+        return self.scheduler.run(self._decrypt, data)
+
+    def _decrypt(self, data):
+        self._wait('decrypt')
+        try:
+            _, payload = self._split(data)
+        except ValueError as e:
+            raise OSError('Failed to decrypt: {0}'.format(e))
+        return _fake_cipher(payload)
+
+    def encrypt(self, data, gpg_recipients):
+        return self.scheduler.run(self._encrypt, data, gpg_recipients)
+
+    def _encrypt(self, data, gpg_recipients):
+        self._wait('encrypt')
+        payload = _fake_cipher(data)
+        try:
+            return self._header(gpg_recipients) + bytes(payload)
+        finally:
+            wipe(payload)
+
+    def get_recipients(self, data):
+        try:
+            key_recipients, _ = self._split(data)
+        except ValueError:
+            return None
+        return sorted(key_recipients)
+
+    def is_encrypted_for(self, path, gpg_recipients):
+        with open(path, 'rb') as key_file:
+            data = key_file.read()
+        try:
+            key_recipients, _ = self._split(data)
+        except ValueError:
+            return False
+        return sorted(key_recipients) == sorted(gpg_recipients)
+
+    def rewrap_key(self, path, gpg_recipients):
+        with open(path, 'rb') as key_file:
+            data = key_file.read()
+        try:
+            _, payload = self._split(data)
+        except ValueError:
+            return False
+        _write_file(path, self._header(gpg_recipients) + bytes(payload))
+        return True
+
+
+#: The available crypto backends by name.
+BACKENDS = {
+    'gpg': GPGBackend,
+    'gpgme': GPGMEBackend,
+    'fake': FakeBackend,
+}
+
+
+def get_backend(backend, gpg_bin, gpg_opts):
+    """Get a crypto backend.
+
+    :param backend: The backend to use.  Either an instance of
+        :class:`passpy.gpg.CryptoBackend`, the name of a backend in
+        :data:`passpy.gpg.BACKENDS` or ``None`` for the default
+        backend.
+    :type backend: str or :class:`passpy.gpg.CryptoBackend`
+
+    :param str gpg_bin: The path to the gpg binary.
+
+    :param list gpg_opts: The options for gpg.
+
+    :raises ValueError: if there is no backend called `backend`.
+
+    :rtype: :class:`passpy.gpg.CryptoBackend`
+    :returns: The crypto backend.
+
+    """
+    if backend is None:
+        backend = 'gpg'
+    if isinstance(backend, CryptoBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError('Unknown crypto backend {0}.'.format(backend))
+    return BACKENDS[backend](gpg_bin, gpg_opts)
+
+
 def read_key(path, gpg_bin, gpg_opts):
     """Read and decrypt a single key file.
 
@@ -60,9 +1754,7 @@ def read_key(path, gpg_bin, gpg_opts):
     :returns: The unencrypted content of the file at `path`.
 
     """
-    gpg = GPG(gpgbinary=gpg_bin, options=gpg_opts)
-    with open(path, 'rb') as key_file:
-        return str(gpg.decrypt_file(key_file))
+    return GPGBackend(gpg_bin, gpg_opts).read_key(path)
 
 
 def write_key(path, key_data, gpg_bin, gpg_opts):
@@ -75,38 +1767,37 @@ def write_key(path, key_data, gpg_bin, gpg_opts):
     :param list gpg_opts: The options for gpg.
 
     """
-    gpg = GPG(gpgbinary=gpg_bin, options=gpg_opts)
-    gpg_recipients = _get_gpg_recipients(path)
-    # pass always ends it's files with an endline
-    if not key_data.endswith('\n'):
-        key_data += '\n'
-    key_data_enc = gpg.encrypt(key_data, gpg_recipients).data
-    with open(path, 'wb') as key_file:
-        key_file.write(key_data_enc)
+    GPGBackend(gpg_bin, gpg_opts).write_key(path, key_data)
 
 
-def _reencrypt_key(path, gpg, gpg_recipients):
+def _reencrypt_key(path, backend, gpg_recipients, rekey=False):
     """Reencrypt a single key.
 
     Gets called from :func:`passpy.gpg._reencrypt_path`.
 
     :param str path: The path to a gpg encrypted file.
 
-    :param gpg: The gpg object.
-    :type gpg: :class:`gnupg.GPG`
+    :param backend: The crypto backend.
+    :type backend: :class:`passpy.gpg.CryptoBackend`
 
     :param list gpg_recipients: The list of GPG Ids to encrypt the key
         with.
 
+    :param bool rekey: (optional) If ``True`` only the session key
+        will be encrypted for `gpg_recipients` if the backend supports
+        it.
+
     """
-    with open(path, 'rb') as key_file:
-        key_data = gpg.decrypt_file(key_file).data
-    key_data_enc = gpg.encrypt(key_data, gpg_recipients).data
-    with open(path, 'wb') as key_file:
-        key_file.write(key_data_enc)
+    # Just like pass, keys already encrypted for the right recipients
+    # are left alone.
+    if backend.is_encrypted_for(path, gpg_recipients):
+        return
+    if rekey and backend.rewrap_key(path, gpg_recipients):
+        return
+    backend.reencrypt_key(path, gpg_recipients)
 
 
-def reencrypt_path(path, gpg_bin, gpg_opts):
+def reencrypt_path(path, gpg_bin, gpg_opts, backend=None, rekey=False):
     """Reencrypt a single or multiple keys.
 
     If path is a directory all keys inside that directory and it's
@@ -119,15 +1810,33 @@ def reencrypt_path(path, gpg_bin, gpg_opts):
 
     :param list gpg_opts: The gpg options.
 
+    :param backend: (optional) The crypto backend to use.  A
+        :class:`passpy.gpg.GPGBackend` will be created if not given.
+    :type backend: :class:`passpy.gpg.CryptoBackend`
+
+    :param bool rekey: (optional) If ``True`` only the session keys
+        will be encrypted for the new recipients, where possible.  See
+        :meth:`passpy.gpg.CryptoBackend.rewrap_key`.
+
     :raises FileNotFoundError: if path does not exist.
 
     """
     if path is None:
         return
-    gpg = GPG(gpgbinary=gpg_bin, options=gpg_opts)
+    backend = get_backend(backend, gpg_bin, gpg_opts)
+    with job_context(PRIORITY_BULK):
+        _reencrypt_path(path, backend, rekey)
+
+
+def _reencrypt_path(path, backend, rekey):
+    """Reencrypt a single or multiple keys with the given backend.
+
+    See :func:`passpy.gpg.reencrypt_path`.
+
+    """
     if os.path.isfile(path):
         gpg_recipients = _get_gpg_recipients(path)
-        _reencrypt_key(path, gpg, gpg_recipients)
+        _reencrypt_key(path, backend, gpg_recipients, rekey)
     elif os.path.isdir(path):
         for root, dirs, keys in os.walk(path):
             gpg_recipients = _get_gpg_recipients(root)
@@ -135,6 +1844,8 @@ def reencrypt_path(path, gpg_bin, gpg_opts):
                 if not key.endswith('.gpg'):
                     continue
                 key_path = os.path.join(root, key)
-                _reencrypt_key(key_path, gpg, gpg_recipients)
+                # Stop between keys, so no key is left half-written.
+                check_operation()
+                _reencrypt_key(key_path, backend, gpg_recipients, rekey)
     else:
         raise FileNotFoundError('{0} does not exist.'.format(path))
@@ -0,0 +1,242 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+##############
+history module
+##############
+
+Earlier versions of keys, decrypted once and kept in an encrypted
+cache, and the fields that changed between them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from passpy.exceptions import (
+    OperationCancelledError,
+    OperationTimeoutError
+)
+from passpy.gpg import _write_file
+from passpy.index import _get_stamp
+from passpy.util import (
+    STATE_DIR,
+    get_state_dir,
+    parse_field_line,
+    parse_fields,
+    wipe
+)
+
+
+_HISTORY_DIR = 'history'
+_HISTORY_VERSION = 1
+
+
+class HistoryCache():
+    """The decrypted content of git blobs, by their hash.
+
+    Blobs never change, so every blob only has to be decrypted once.
+    Like git's textconv cache, but encrypted: the content of a blob is
+    kept in a file in `.passpy/history` encrypted for exactly the keys
+    the blob itself is encrypted for, so it is never cached for anyone
+    who could not decrypt the blob.  The blobs of the same keys are
+    spread over 16 files by the first digit of their hash, so adding
+    blobs only rewrites some of them.
+
+    Blobs whose keys the crypto backend can't tell, see
+    :meth:`passpy.gpg.CryptoBackend.get_recipients`, are not cached.
+
+    """
+    def __init__(self, store_dir, backend):
+        """Creates a new HistoryCache object.
+
+        :param str store_dir: The path to the password store.
+
+        :param backend: The crypto backend to encrypt the cache with.
+        :type backend: :class:`passpy.gpg.CryptoBackend`
+
+        """
+        self.store_dir = store_dir
+        self.backend = backend
+        self.path = os.path.join(store_dir, STATE_DIR, _HISTORY_DIR)
+        # Maps the name of every file read to its stamp and blobs.  The
+        # blobs are None if the file can't be read.
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _get_shard(self, sha, data):
+        """Find the file a blob is cached in.
+
+        :param str sha: The hash of the blob.
+
+        :param bytes data: The encrypted content of the blob.
+
+        :rtype: (str, list)
+        :returns: The name of the file and the gpg ids to encrypt it
+            for, ``(None, None)`` if the blob can't be cached.
+
+        """
+        gpg_ids = self.backend.get_recipients(data)
+        if gpg_ids is None or len(gpg_ids) == 0:
+            return None, None
+        digest = hashlib.sha256('\n'.join(gpg_ids).encode('utf-8'))
+        return ('{0}-{1}.enc'.format(digest.hexdigest()[:16], sha[0]),
+                gpg_ids)
+
+    def _load(self, shard):
+        """Read a file, unless the copy in memory is up to date.
+
+        :param str shard: The name of the file.
+
+        :rtype: dict
+        :returns: The content of the blobs in the file, by hash.
+            ``None`` if the file can't be read.
+
+        """
+        path = os.path.join(self.path, shard)
+        stamp = _get_stamp(path)
+        cached = self._shards.get(shard)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        blobs = {}
+        if stamp is not None:
+            try:
+                data = self.backend.read_key_bytes(path)
+                try:
+                    cache = json.loads(data.decode('utf-8'))
+                finally:
+                    wipe(data)
+            except (OperationTimeoutError, OperationCancelledError):
+                raise
+            except (OSError, ValueError):
+                blobs = None
+            else:
+                if cache.get('version') == _HISTORY_VERSION:
+                    blobs = cache['blobs']
+        self._shards[shard] = [stamp, blobs]
+        return blobs
+
+    def get(self, blobs):
+        """Get the cached content of blobs.
+
+        :param dict blobs: The encrypted content of the blobs, by hash.
+
+        :rtype: dict
+        :returns: The content of every blob that is cached, by hash.
+
+        """
+        found = {}
+        with self._lock:
+            for sha, data in blobs.items():
+                shard, _ = self._get_shard(sha, data)
+                if shard is None:
+                    continue
+                cached = self._load(shard)
+                if cached is not None and sha in cached:
+                    found[sha] = cached[sha]
+        return found
+
+    def update(self, texts, blobs):
+        """Add the content of blobs and write the changed files.
+
+        Files that can't be read or written are left alone.
+
+        :param dict texts: The decrypted content of the blobs, by hash.
+
+        :param dict blobs: The encrypted content of the blobs, by hash.
+
+        """
+        with self._lock:
+            changed = {}
+            for sha, text in texts.items():
+                shard, gpg_ids = self._get_shard(sha, blobs[sha])
+                if shard is None:
+                    continue
+                cached = self._load(shard)
+                if cached is None:
+                    continue
+                cached[sha] = text
+                changed[shard] = gpg_ids
+            if len(changed) == 0:
+                return
+            get_state_dir(self.store_dir)
+            os.makedirs(self.path, exist_ok=True)
+            for shard, gpg_ids in sorted(changed.items()):
+                path = os.path.join(self.path, shard)
+                data = bytearray(json.dumps({
+                    'version': _HISTORY_VERSION,
+                    'blobs': self._shards[shard][1],
+                }, separators=(',', ':')).encode('utf-8'))
+                try:
+                    data_enc = self.backend.encrypt(data, gpg_ids)
+                except (OperationTimeoutError, OperationCancelledError):
+                    raise
+                except OSError:
+                    # E.g. a key that is no longer in the keyring.
+                    del self._shards[shard]
+                    continue
+                finally:
+                    wipe(data)
+                _write_file(path, data_enc)
+                self._shards[shard][0] = _get_stamp(path)
+
+
+def diff_fields(old, new):
+    """Find the parts of a key that changed, without their values.
+
+    :param str old: The older content, ``None`` if the key did not
+        exist.
+
+    :param str new: The newer content, ``None`` if the key was
+        removed.
+
+    :rtype: list
+    :returns: ``(name, change)`` tuples, where `name` is
+        ``'password'`` for the first line, the lower case name of a
+        field or ``None`` for all other lines together, and `change`
+        is one of ``'added'``, ``'removed'`` or ``'changed'``.
+
+    """
+    def split(key_data):
+        if key_data is None:
+            return None, {}, None
+        lines = key_data.split('\n')
+        other = [line for line in lines[1:]
+                 if line != '' and parse_field_line(line) is None]
+        return lines[0], parse_fields(key_data), other or None
+
+    def change(old_value, new_value):
+        if old_value is None:
+            return 'added'
+        if new_value is None:
+            return 'removed'
+        return 'changed'
+
+    old_password, old_fields, old_other = split(old)
+    new_password, new_fields, new_other = split(new)
+    changes = []
+    if old_password != new_password:
+        changes.append(('password', change(old_password, new_password)))
+    for name in sorted(set(old_fields) | set(new_fields)):
+        old_value = old_fields.get(name)
+        new_value = new_fields.get(name)
+        if old_value != new_value:
+            changes.append((name, change(old_value, new_value)))
+    if old_other != new_other:
+        changes.append((None, change(old_other, new_other)))
+    return changes
@@ -0,0 +1,574 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+############
+index module
+############
+
+An encrypted index of the ``key: value`` fields of all keys, so that
+they can be queried without decrypting every key.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zlib
+
+from contextlib import contextmanager
+
+from passpy.exceptions import (
+    OperationCancelledError,
+    OperationTimeoutError
+)
+from passpy.gpg import (
+    _get_gpg_recipients,
+    _write_file
+)
+from passpy.util import (
+    STATE_DIR,
+    get_state_dir,
+    wipe
+)
+
+
+_INDEX_DIR = 'index'
+_INDEX_VERSION = 2
+
+#: The keys encrypted for the same gpg ids are spread over this many
+#: files, so that changing a key only rewrites a part of them.
+_SHARD_BUCKETS = 16
+
+
+def _get_stamp(path):
+    """Get what is needed to notice that a file changed.
+
+    :param str path: The path of the file.
+
+    :rtype: list
+    :returns: The modification time in nanoseconds and the size of the
+        file, ``None`` if it does not exist.
+
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _is_below(name, prefix):
+    """Check if a key is `prefix` or lies in the directory `prefix`.
+
+    :param str name: The name of the key.
+
+    :param str prefix: The name of a key or directory.  ``''`` for the
+        whole store.
+
+    :rtype: bool
+
+    """
+    return prefix == '' or name == prefix or name.startswith(prefix + '/')
+
+
+class _ShardedRows():
+    """Rows of state about keys, kept in encrypted files in a directory
+    of `.passpy`.
+
+    The row of a key is kept in a file encrypted for the same gpg ids
+    as the key itself, so no one can read anything about keys they
+    can't decrypt.  The keys of every set of gpg ids are spread over
+    :data:`_SHARD_BUCKETS` files by their name, and only the files
+    with changed rows are written again.
+
+    Files that can't be read, e.g. because they are not encrypted for
+    the current user, are never written and their rows are unknown.
+
+    Subclasses set :attr:`version` and implement :meth:`_read_shard`
+    and :meth:`_write_shard`.
+
+    """
+    #: The version of the file format, files of other versions are
+    #: ignored.
+    version = None
+
+    def __init__(self, store_dir, backend, dirname):
+        """Creates a new _ShardedRows object.
+
+        :param str store_dir: The path to the password store.
+
+        :param backend: The crypto backend to encrypt the files with.
+        :type backend: :class:`passpy.gpg.CryptoBackend`
+
+        :param str dirname: The name of the directory in `.passpy`.
+
+        """
+        self.store_dir = store_dir
+        self.backend = backend
+        self.path = os.path.join(store_dir, STATE_DIR, dirname)
+        # Maps the name of every key to its row.
+        self._rows = None
+        # Maps the name of every key to the file its row is kept in.
+        self._shards = {}
+        # Maps the name of every file read or written to its stamp at
+        # that time and the sorted gpg ids it is encrypted for.
+        self._files = {}
+        self._unreadable = set()
+        # The names of keys whose row changed, moved or was removed.
+        self._dirty = set()
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    def exists(self):
+        """Check whether the files were created.
+
+        :rtype: bool
+
+        """
+        return os.path.isdir(self.path)
+
+    def _key_path(self, name):
+        return os.path.join(self.store_dir, name + '.gpg')
+
+    def _get_shard(self, name, gpg_ids_cache=None):
+        """Find the file the row of a key belongs in.
+
+        :param str name: The name of the key.
+
+        :param dict gpg_ids_cache: (optional) The sorted gpg ids of
+            already seen directories, by their path.
+
+        :rtype: (str, list)
+        :returns: The name of the file and the sorted gpg ids of the
+            key.
+
+        """
+        if gpg_ids_cache is None:
+            gpg_ids_cache = {}
+        key_dir = os.path.dirname(self._key_path(name))
+        gpg_ids = gpg_ids_cache.get(key_dir)
+        if gpg_ids is None:
+            gpg_ids = sorted(_get_gpg_recipients(key_dir))
+            gpg_ids_cache[key_dir] = gpg_ids
+        digest = hashlib.sha256('\n'.join(gpg_ids).encode('utf-8'))
+        bucket = zlib.crc32(name.encode('utf-8')) % _SHARD_BUCKETS
+        return ('{0}-{1:02x}.enc'.format(digest.hexdigest()[:16], bucket),
+                gpg_ids)
+
+    def _forget_shard(self, shard):
+        """Drop the rows of a file from memory.
+        """
+        for name in [name for name, name_shard in self._shards.items()
+                     if name_shard == shard]:
+            del self._shards[name]
+            self._rows.pop(name, None)
+        self._files.pop(shard, None)
+        self._unreadable.discard(shard)
+
+    def _load(self):
+        """Read the files changed since they were last read or written.
+        """
+        if self._rows is None:
+            self._rows = {}
+        try:
+            shards = [filename for filename in os.listdir(self.path)
+                      if filename.endswith('.enc')]
+        except FileNotFoundError:
+            shards = []
+        for shard in set(self._files) - set(shards):
+            self._forget_shard(shard)
+        for shard in shards:
+            path = os.path.join(self.path, shard)
+            stamp = _get_stamp(path)
+            if shard in self._files:
+                if self._files[shard][0] == stamp:
+                    continue
+                self._forget_shard(shard)
+            try:
+                data = self.backend.read_key_bytes(path)
+                try:
+                    content = json.loads(data.decode('utf-8'))
+                finally:
+                    wipe(data)
+            except (OperationTimeoutError, OperationCancelledError):
+                raise
+            except (OSError, ValueError):
+                self._files[shard] = [stamp, None]
+                self._unreadable.add(shard)
+                continue
+            if content.get('version') != self.version:
+                # Unknown versions are simply rebuilt.
+                self._files[shard] = [stamp, None]
+                continue
+            self._files[shard] = [stamp, content['gpg_ids']]
+            for name, row in self._read_shard(shard, content).items():
+                self._rows[name] = row
+                self._shards[name] = shard
+
+    def _read_shard(self, shard, content):
+        """Get the rows out of the content of a file.
+
+        :param str shard: The name of the file.
+
+        :param dict content: The decoded content of the file.
+
+        :rtype: dict
+        :returns: The row of every key in the file, by name.
+
+        """
+        raise NotImplementedError
+
+    def _write_shard(self, shard, rows):
+        """Get the content of a file.
+
+        :param str shard: The name of the file.
+
+        :param dict rows: The row of every key in the file, by name.
+
+        :rtype: dict
+        :returns: The content to write, without the version and the
+            gpg ids.
+
+        """
+        raise NotImplementedError
+
+    def _mark(self, name):
+        """Remember that the row of a key has to be written.
+        """
+        self._dirty.add(name)
+
+    def _save(self):
+        """Write the files with changed rows, unless in a batch.
+        """
+        if len(self._dirty) == 0 or self._batch_depth > 0:
+            return
+        gpg_ids_cache = {}
+        touched = {}
+        for name in self._dirty:
+            old_shard = self._shards.pop(name, None)
+            if old_shard is not None:
+                touched.setdefault(old_shard, None)
+            if name in self._rows:
+                shard, gpg_ids = self._get_shard(name, gpg_ids_cache)
+                self._shards[name] = shard
+                touched[shard] = gpg_ids
+        self._dirty = set()
+
+        members = dict((shard, {}) for shard in touched)
+        for name, shard in self._shards.items():
+            if shard in members:
+                members[shard][name] = self._rows[name]
+        get_state_dir(self.store_dir)
+        os.makedirs(self.path, exist_ok=True)
+        for shard, gpg_ids in sorted(touched.items()):
+            if shard in self._unreadable:
+                continue
+            path = os.path.join(self.path, shard)
+            rows = members[shard]
+            if len(rows) == 0:
+                if os.path.exists(path):
+                    os.remove(path)
+                self._files.pop(shard, None)
+                continue
+            if gpg_ids is None:
+                gpg_ids = self._files[shard][1]
+            content = self._write_shard(shard, rows)
+            content['version'] = self.version
+            content['gpg_ids'] = gpg_ids
+            data = bytearray(json.dumps(content, separators=(',', ':'))
+                             .encode('utf-8'))
+            try:
+                data_enc = self.backend.encrypt(data, gpg_ids)
+            finally:
+                wipe(data)
+            _write_file(path, data_enc)
+            self._files[shard] = [_get_stamp(path), gpg_ids]
+
+    @contextmanager
+    def batch(self):
+        """Write the files only once for all changes in a `with` block.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                self._save()
+
+    def reencrypt(self, prefix=''):
+        """Move the rows of keys to the files for their gpg ids, e.g.
+        after a `.gpg-id` file changed.
+
+        :param str prefix: (optional) The name of the directory whose
+            gpg ids changed.  ``''`` for the whole store.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            for name in self._rows:
+                if _is_below(name, prefix):
+                    self._mark(name)
+            self._save()
+
+
+class MetadataIndex(_ShardedRows):
+    """The fields of all keys, each encrypted for the gpg ids of its
+    key.
+
+    The index is opt-in: unless it was created with :meth:`create`
+    all changes are ignored.  It is stored column by column in the
+    files of `.passpy/index`, see :class:`_ShardedRows`, together with
+    the modification time and size of every key, so that keys changed
+    behind passpy's back can be found with a simple :func:`os.stat`.
+
+    """
+    version = _INDEX_VERSION
+
+    def __init__(self, store_dir, backend):
+        """Creates a new MetadataIndex object.
+
+        :param str store_dir: The path to the password store.
+
+        :param backend: The crypto backend to encrypt the index with.
+        :type backend: :class:`passpy.gpg.CryptoBackend`
+
+        """
+        # Every row holds the stamp and fields of a key.  A stamp of
+        # None marks keys that need to be parsed again.
+        super().__init__(store_dir, backend, _INDEX_DIR)
+
+    def _read_shard(self, shard, content):
+        rows = {}
+        for row, name in enumerate(content['names']):
+            fields = {}
+            for field, column in content['fields'].items():
+                if column[row] is not None:
+                    fields[field] = column[row]
+            rows[name] = [content['stamps'][row], fields]
+        return rows
+
+    def _write_shard(self, shard, rows):
+        names = sorted(rows)
+        columns = {}
+        for row, name in enumerate(names):
+            for field, values in rows[name][1].items():
+                if field not in columns:
+                    columns[field] = [None] * len(names)
+                columns[field][row] = values
+        return {
+            'names': names,
+            'stamps': [rows[name][0] for name in names],
+            'fields': columns,
+        }
+
+    def create(self):
+        """Create an empty index, if none exists yet.
+
+        Every key counts as changed, see :meth:`stale`.
+
+        """
+        with self._lock:
+            if self.exists():
+                return
+            get_state_dir(self.store_dir)
+            os.makedirs(self.path)
+
+    def delete(self):
+        """Remove the index.
+        """
+        with self._lock:
+            if self.exists():
+                shutil.rmtree(self.path)
+            self._rows = None
+            self._shards = {}
+            self._files = {}
+            self._unreadable = set()
+            self._dirty = set()
+
+    def update(self, name, fields):
+        """Set the fields of a key.
+
+        :param str name: The name of the key.
+
+        :param dict fields: The fields as returned by
+            :func:`passpy.util.parse_fields`.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            self._rows[name] = [_get_stamp(self._key_path(name)), fields]
+            self._mark(name)
+            self._save()
+
+    def invalidate(self, name):
+        """Mark a key as changed, so it is parsed again.
+
+        :param str name: The name of the key.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            if name in self._rows:
+                self._rows[name][0] = None
+                self._mark(name)
+                self._save()
+
+    def remove(self, prefix):
+        """Remove a key or all keys of a directory.
+
+        :param str prefix: The name of the key or directory.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            for name in [name for name in self._rows
+                         if _is_below(name, prefix)]:
+                del self._rows[name]
+                self._mark(name)
+            self._save()
+
+    def move(self, old_prefix, new_prefix, copy=False):
+        """Move or copy the rows of a key or directory.
+
+        The rows keep their stamps, use :meth:`restamp` once the keys
+        are in place.
+
+        :param str old_prefix: The old name of the key or directory.
+
+        :param str new_prefix: The new name.
+
+        :param bool copy: (optional) If ``True`` the old rows are kept.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            for name in [name for name in self._rows
+                         if _is_below(name, old_prefix)]:
+                new_name = new_prefix + name[len(old_prefix):]
+                stamp, fields = self._rows[name]
+                self._rows[new_name] = [stamp, dict(fields)]
+                self._mark(new_name)
+                if not copy:
+                    del self._rows[name]
+                    self._mark(name)
+            self._save()
+
+    def restamp(self, prefix):
+        """Remember the current stamps of keys whose content did not
+        change, e.g. after reencrypting them.
+
+        Keys marked with :meth:`invalidate` stay marked.
+
+        :param str prefix: The name of the key or directory.
+
+        """
+        with self._lock:
+            if not self.exists():
+                return
+            self._load()
+            for name, row in self._rows.items():
+                if row[0] is not None and _is_below(name, prefix):
+                    stamp = _get_stamp(self._key_path(name))
+                    if stamp != row[0]:
+                        row[0] = stamp
+                        self._mark(name)
+            self._save()
+
+    def stale(self):
+        """Find the keys that changed since they were indexed.
+
+        Keys that no longer exist are removed from the index.
+
+        :rtype: list
+        :returns: The names of all keys that need to be parsed and
+            passed to :meth:`update`.
+
+        """
+        with self._lock:
+            self._load()
+            stale = []
+            seen = set()
+            for root, dirs, files in os.walk(self.store_dir):
+                # Hidden directories like .git are not part of the store.
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for filename in files:
+                    if (filename.startswith('.')
+                            or not filename.endswith('.gpg')):
+                        continue
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, self.store_dir)[:-4]
+                    seen.add(name)
+                    row = self._rows.get(name)
+                    if row is None or row[0] != _get_stamp(path):
+                        stale.append(name)
+            for name in [name for name in self._rows if name not in seen]:
+                del self._rows[name]
+                self._mark(name)
+            self._save()
+            return sorted(stale)
+
+    def query(self, field=None, contains=None, equals=None):
+        """Find keys by the values of their fields.
+
+        :param str field: (optional) The field to look at, e.g.
+            'url'.  All fields are looked at if not given.
+
+        :param str contains: (optional) A string that a value has to
+            contain.
+
+        :param str equals: (optional) A string that a value has to
+            be equal to.
+
+        :rtype: list
+        :returns: The sorted names of all keys with at least one
+            matching value.  Without `contains` and `equals` all keys
+            that have `field` are returned.
+
+        """
+        if field is not None:
+            field = field.lower()
+        with self._lock:
+            self._load()
+            rows = list(self._rows.items())
+
+        matches = []
+        for name, (_, fields) in rows:
+            if field is None:
+                values = [value for column in fields.values()
+                          for value in column]
+            elif field in fields:
+                values = fields[field]
+            else:
+                continue
+            if any((contains is None or contains in value)
+                   and (equals is None or equals == value)
+                   for value in values):
+                matches.append(name)
+        return sorted(matches)
@@ -0,0 +1,150 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+###############
+manifest module
+###############
+
+Remembers what every key was last written with, so that writing the
+same data for the same gpg ids again can be skipped.
+"""
+
+import os
+
+from passpy.audit import hash_password
+from passpy.index import (
+    _ShardedRows,
+    _get_stamp
+)
+
+
+_MANIFEST_DIR = 'manifest'
+_MANIFEST_VERSION = 2
+
+
+class WriteManifest(_ShardedRows):
+    """Keyed hashes of the data and the gpg ids of written keys.
+
+    The rows are kept in the files of `.passpy/manifest`, each
+    encrypted for the gpg ids of its keys together with the random
+    key of its hashes, see :class:`passpy.index._ShardedRows`.  Like
+    :class:`passpy.index.MetadataIndex` it also keeps the modification
+    time and size of every key, so keys changed behind passpy's back
+    are never taken as unchanged.  Keys whose rows can't be read are
+    never taken as unchanged either.
+
+    """
+    version = _MANIFEST_VERSION
+
+    def __init__(self, store_dir, backend):
+        """Creates a new WriteManifest object.
+
+        :param str store_dir: The path to the password store.
+
+        :param backend: The crypto backend to encrypt the manifest with.
+        :type backend: :class:`passpy.gpg.CryptoBackend`
+
+        """
+        # Every row holds the stamp of a key, the hash of its data and
+        # its gpg ids.
+        super().__init__(store_dir, backend, _MANIFEST_DIR)
+        # The key of the hashes of every file.
+        self._hash_keys = {}
+
+    def _read_shard(self, shard, content):
+        self._hash_keys[shard] = bytes.fromhex(content['hash_key'])
+        return content['keys']
+
+    def _write_shard(self, shard, rows):
+        # Rows of keys that no longer exist are dropped.
+        keys = {}
+        for name, row in rows.items():
+            if _get_stamp(self._key_path(name)) is None:
+                del self._rows[name]
+                del self._shards[name]
+            else:
+                keys[name] = row
+        return {
+            'hash_key': self._get_hash_key(shard).hex(),
+            'keys': keys,
+        }
+
+    def _get_hash_key(self, shard):
+        """Get the key of the hashes of a file, creating it if needed.
+
+        :param str shard: The name of the file.
+
+        :rtype: bytes
+
+        """
+        if shard not in self._hash_keys:
+            self._hash_keys[shard] = os.urandom(32)
+        return self._hash_keys[shard]
+
+    def _hash(self, name, key_data):
+        """Hash the data of a key with the key of its file.
+
+        :rtype: str
+
+        """
+        shard, _ = self._get_shard(name)
+        return hash_password(key_data, self._get_hash_key(shard)).hex()
+
+    def unchanged(self, name, key_data, gpg_ids):
+        """Check whether a key already holds some data.
+
+        :param str name: The name of the key.
+
+        :param key_data: The decrypted data.
+        :type key_data: bytes, bytearray or memoryview
+
+        :param list gpg_ids: The gpg ids the key would be encrypted
+            for.
+
+        :rtype: bool
+        :returns: ``True`` if the key was last written by passpy with
+            `key_data` for `gpg_ids` and did not change since.
+
+        """
+        with self._lock:
+            self._load()
+            row = self._rows.get(name)
+            if row is None:
+                return False
+            stamp, digest, row_gpg_ids = row
+            return (stamp == _get_stamp(self._key_path(name))
+                    and row_gpg_ids == sorted(gpg_ids)
+                    and digest == self._hash(name, key_data))
+
+    def record(self, name, key_data, gpg_ids):
+        """Remember the data a key was just written with.
+
+        :param str name: The name of the key.
+
+        :param key_data: The decrypted data.
+        :type key_data: bytes, bytearray or memoryview
+
+        :param list gpg_ids: The gpg ids the key was encrypted for.
+
+        """
+        with self._lock:
+            self._load()
+            self._rows[name] = [_get_stamp(self._key_path(name)),
+                                self._hash(name, key_data),
+                                sorted(gpg_ids)]
+            self._mark(name)
+            self._save()
@@ -0,0 +1,618 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+#################
+multistore module
+#################
+
+A single view of several password stores, each mounted under its own
+prefix.
+"""
+
+import fnmatch
+import glob
+import os
+import queue
+import re
+import threading
+
+from passpy.audit import (
+    DEFAULT_MIN_ENTROPY,
+    build_report
+)
+from passpy.util import PasswordPolicy
+from passpy.watch import KeyMoved
+
+
+# Marks the end of the results of a single store in :func:`_fan_out`.
+_DONE = object()
+
+
+def _fan_out(mounts, func):
+    """Call `func` for every mounted store concurrently.
+
+    :param list mounts: The ``(prefix, store)`` tuples to call `func`
+        for.
+
+    :param func: Called with the prefix and store, returning an
+        iterable.
+    :type func: function
+
+    :raises Exception: the first exception raised by `func`.
+
+    :rtype: generator
+    :returns: The items of all iterables returned by `func`, in the
+        order they are produced.
+
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def produce(prefix, store):
+        try:
+            for item in func(prefix, store):
+                if stop.is_set():
+                    break
+                results.put((item, None))
+        except Exception as e:
+            results.put((None, e))
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=produce, args=mount, daemon=True)
+               for mount in mounts]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running > 0:
+            result = results.get()
+            if result is _DONE:
+                running -= 1
+                continue
+            item, error = result
+            if error is not None:
+                raise error
+            yield item
+    finally:
+        # Let the remaining stores finish early if the caller stops
+        # iterating.
+        stop.set()
+
+
+def _join(prefix, path):
+    """Prefix a name in a mounted store.
+    """
+    if path == '':
+        return prefix
+    return prefix + '/' + path
+
+
+class MultiStore():
+    """Several :class:`passpy.store.Store` objects mounted under
+    prefixes.
+
+    A key `team/db` in a store mounted under `team` is the key `db` in
+    that store.  Single keys are routed to their store, listing and
+    searching runs across all stores concurrently.
+
+    """
+    def __init__(self, stores):
+        """Creates a new MultiStore object.
+
+        :param dict stores: Maps every prefix to the
+            :class:`passpy.store.Store` to mount under it.
+
+        :raises ValueError: if a prefix is empty or lies within
+            another prefix.
+
+        """
+        self.stores = {}
+        for prefix, store in stores.items():
+            prefix = os.path.normpath(prefix).strip('/')
+            if prefix in ('', '.') or prefix.startswith('.'):
+                raise ValueError('Invalid prefix {0}.'.format(prefix))
+            for other in self.stores:
+                if (prefix == other or prefix.startswith(other + '/')
+                        or other.startswith(prefix + '/')):
+                    raise ValueError('{0} and {1} overlap.'
+                                     .format(prefix, other))
+            self.stores[prefix] = store
+
+    def __iter__(self):
+        return self.iter_dir('')
+
+    def _mounts(self):
+        return sorted(self.stores.items())
+
+    def _route(self, path):
+        """Find the store a key or directory belongs to.
+
+        :param str path: The name of the key or directory.
+
+        :raises FileNotFoundError: if `path` is not below any prefix.
+
+        :rtype: (str, :class:`passpy.store.Store`, str)
+        :returns: The prefix, the store and `path` within that store.
+
+        """
+        if path is not None and path != '':
+            path = os.path.normpath(path).strip('/')
+            for prefix, store in self.stores.items():
+                if path == prefix:
+                    return prefix, store, ''
+                if path.startswith(prefix + '/'):
+                    return prefix, store, path[len(prefix) + 1:]
+        raise FileNotFoundError('{0} is not in the password store.'
+                                .format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def flush(self):
+        """See :meth:`passpy.store.Store.flush`.
+        """
+        for store in self.stores.values():
+            store.flush()
+
+    def close(self):
+        """See :meth:`passpy.store.Store.close`.
+        """
+        for store in self.stores.values():
+            store.close()
+
+    def clear_cache(self):
+        """See :meth:`passpy.store.Store.clear_cache`.
+        """
+        for store in self.stores.values():
+            store.clear_cache()
+
+    def is_init(self):
+        return all(store.is_init() for store in self.stores.values())
+
+    def init_store(self, gpg_ids, path=None, dry_run=False):
+        """Initialise a mounted store, a subdirectory of it or all
+        stores.
+
+        See :meth:`passpy.store.Store.init_store`.
+
+        :param list gpg_ids: The list of gpg ids.
+
+        :param str path: (optional) The directory to set the gpg ids
+            for.  All stores if not given.
+
+        :param bool dry_run: (optional) If ``True`` nothing is changed,
+            instead the plan of what would be done is returned.  The
+            plans of all stores are added up.
+
+        """
+        if path is None:
+            plans = [store.init_store(gpg_ids, dry_run=dry_run)
+                     for store in self.stores.values()]
+            if dry_run:
+                total = dict((item, sum(plan[item] for plan in plans))
+                             for item in plans[0])
+                # The stores share the gpg scheduler, but may have
+                # saved different latencies.
+                total['latency'] = max(plan['latency'] for plan in plans)
+                total['latency_measured'] = all(plan['latency_measured']
+                                                for plan in plans)
+                return total
+            return
+        _, store, path = self._route(path)
+        return store.init_store(gpg_ids, path or None, dry_run)
+
+    def get_key(self, path):
+        """See :meth:`passpy.store.Store.get_key`.
+        """
+        _, store, path = self._route(path)
+        return store.get_key(path)
+
+    def get_key_bytes(self, path):
+        """See :meth:`passpy.store.Store.get_key_bytes`.
+        """
+        _, store, path = self._route(path)
+        return store.get_key_bytes(path)
+
+    def get_entry(self, path):
+        """See :meth:`passpy.store.Store.get_entry`.
+        """
+        prefix, store, key = self._route(path)
+        entry = store.get_entry(key)
+        if entry is not None:
+            entry.name = _join(prefix, entry.name)
+        return entry
+
+    def get_keys(self, paths):
+        """Read many keys at once, from all stores concurrently.
+
+        See :meth:`passpy.store.Store.get_keys`.
+
+        """
+        batches = {}
+        for path in paths:
+            prefix, _, key = self._route(path)
+            batches.setdefault(prefix, {})[path] = key
+
+        def read(prefix, store):
+            if prefix not in batches:
+                return []
+            values = store.get_keys(list(batches[prefix].values()))
+            return [(path, values[key])
+                    for path, key in batches[prefix].items()]
+        return dict(_fan_out(self._mounts(), read))
+
+    def set_entry(self, entry, path=None, force=True):
+        """See :meth:`passpy.store.Store.set_entry`.
+        """
+        if path is None:
+            path = entry.name
+        if path is None:
+            raise ValueError('The entry has no name.')
+        _, store, path = self._route(path)
+        return store.set_entry(entry, path, force)
+
+    def set_key(self, path, key_data, force=False):
+        """See :meth:`passpy.store.Store.set_key`.
+        """
+        _, store, path = self._route(path)
+        return store.set_key(path, key_data, force)
+
+    def set_key_bytes(self, path, key_data, force=False):
+        """See :meth:`passpy.store.Store.set_key_bytes`.
+        """
+        _, store, path = self._route(path)
+        return store.set_key_bytes(path, key_data, force)
+
+    def set_keys(self, keys, force=False):
+        """Add or update many keys, one batch per store.
+
+        See :meth:`passpy.store.Store.set_keys`.
+
+        """
+        batches = {}
+        for path, key_data in keys.items():
+            prefix, store, key = self._route(path)
+            batches.setdefault(prefix, {})[key] = key_data
+
+        def write(prefix, store):
+            if prefix not in batches:
+                return []
+            return [_join(prefix, key)
+                    for key in store.set_keys(batches[prefix], force)]
+        return sorted(_fan_out(self._mounts(), write))
+
+    def open_key(self, path, mode='rb', force=False):
+        """See :meth:`passpy.store.Store.open_key`.
+        """
+        _, store, path = self._route(path)
+        return store.open_key(path, mode, force)
+
+    def gen_key(self, path, length, symbols=True, force=False,
+                inplace=False, policy=None):
+        """See :meth:`passpy.store.Store.gen_key`.
+        """
+        _, store, path = self._route(path)
+        return store.gen_key(path, length, symbols, force, inplace, policy)
+
+    def gen_keys(self, paths, length, symbols=True, force=False,
+                 inplace=False, policies=None):
+        """Generate passwords for many keys, one batch per store.
+
+        See :meth:`passpy.store.Store.gen_keys`.  The patterns in
+        `policies` are matched against the full, normalised names.
+
+        """
+        default_policy = PasswordPolicy(length, symbols)
+        batches = {}
+        for path in paths:
+            prefix, store, key = self._route(path)
+            policy = default_policy
+            for pattern, key_policy in (policies or {}).items():
+                if fnmatch.fnmatchcase(os.path.normpath(path), pattern):
+                    policy = key_policy
+                    break
+            batch = batches.setdefault(prefix, ([], [], {}))
+            batch[0].append(path)
+            batch[1].append(key)
+            batch[2][glob.escape(key)] = policy
+
+        passwords = {}
+
+        def generate(prefix, store):
+            if prefix not in batches:
+                return []
+            full_paths, keys, key_policies = batches[prefix]
+            generated = store.gen_keys(keys, length, symbols, force,
+                                       inplace, key_policies)
+            return [(path, generated[key])
+                    for path, key in zip(full_paths, keys)]
+
+        for path, password in _fan_out(self._mounts(), generate):
+            passwords[path] = password
+        return dict((path, passwords[path]) for path in paths)
+
+    def remove_path(self, path, recursive=False, force=False,
+                    dry_run=False):
+        """See :meth:`passpy.store.Store.remove_path`.
+        """
+        _, store, path = self._route(path)
+        if path == '':
+            raise ValueError('Can\'t remove a whole mounted store.')
+        return store.remove_path(path, recursive, force, dry_run)
+
+    def _copy_move_path(self, old_path, new_path, force, move, dry_run):
+        """Copy or move within a single mounted store.
+
+        :raises ValueError: if `old_path` and `new_path` are in
+            different stores.
+
+        """
+        old_prefix, store, old_path = self._route(old_path)
+        new_prefix, _, new_path_rel = self._route(new_path.rstrip('/'))
+        if old_prefix != new_prefix:
+            raise ValueError('Can\'t copy or move between different '
+                             'stores.')
+        if new_path.endswith('/'):
+            new_path_rel += '/'
+        if move:
+            return store.move_path(old_path, new_path_rel, force, dry_run)
+        return store.copy_path(old_path, new_path_rel, force, dry_run)
+
+    def copy_path(self, old_path, new_path, force=False, dry_run=False):
+        """See :meth:`passpy.store.Store.copy_path`.
+        """
+        return self._copy_move_path(old_path, new_path, force, False,
+                                    dry_run)
+
+    def move_path(self, old_path, new_path, force=False, dry_run=False):
+        """See :meth:`passpy.store.Store.move_path`.
+        """
+        return self._copy_move_path(old_path, new_path, force, True,
+                                    dry_run)
+
+    def iter_dir(self, path, after=None):
+        """Iterate over the keys in a directory.
+
+        :param str path: The directory.  ``''`` or ``'.'`` for all
+            stores, which are listed concurrently.
+
+        :param str after: (optional) Continue after this key, see
+            :meth:`passpy.store.Store.iter_dir`.  All stores are then
+            listed one after the other, ordered by their prefix.
+
+        :rtype: generator
+        :returns: The names of all keys, including their prefix.  Keys
+            of different stores are yielded in no particular order,
+            unless `after` is given.
+
+        """
+        path = os.path.normpath(path)
+        if path == '.' and after is None:
+            return _fan_out(self._mounts(), lambda prefix, store: (
+                _join(prefix, key) for key in store.iter_dir('')))
+        if path == '.':
+            return self._iter_mounts_after(after)
+        prefix, store, path = self._route(path)
+        if after is not None:
+            _, _, after = self._route(after)
+        return (_join(prefix, key)
+                for key in store.iter_dir(path or '.', after))
+
+    def _iter_mounts_after(self, after):
+        """Iterate over the keys of all stores in prefix order,
+        continuing after a key.
+        """
+        after_prefix, _, after = self._route(after)
+        for prefix, store in self._mounts():
+            if prefix < after_prefix:
+                continue
+            for key in store.iter_dir(
+                    '.', after if prefix == after_prefix else None):
+                yield _join(prefix, key)
+
+    def iter_find(self, names):
+        """Find keys by name in all stores concurrently.
+
+        :param names: The name or names to find keys for.
+        :type names: str or list
+
+        :rtype: generator
+        :returns: The names of all keys that contain any one entry in
+            `names`, as they are found.
+
+        """
+        if names is None:
+            return iter([])
+        if not isinstance(names, list):
+            names = [names]
+        return (key for key in self
+                if any(key.find(name) != -1 for name in names))
+
+    def find(self, names):
+        """See :meth:`passpy.store.Store.find`.
+        """
+        return list(self.iter_find(names))
+
+    def iter_search(self, term, path='', name_glob=None, name_regex=None,
+                    max_size=None, stats=None):
+        """Search through all stores concurrently.
+
+        :param str term: The term to search for.  The term will be
+            compiled as a regular expression.
+
+        The other arguments are those of
+        :meth:`passpy.store.Store.search`.  The name filters are
+        matched against the full names, including the prefix.
+
+        :rtype: generator
+        :returns: ``(key, matches)`` tuples as they are found, see
+            :meth:`passpy.store.Store.iter_search`.
+
+        """
+        regex = re.compile(term)
+        mounts = self._mounts()
+        store_path = '.'
+        path = os.path.normpath(path or '.')
+        if path != '.':
+            prefix, store, store_path = self._route(path)
+            mounts = [(prefix, store)]
+        lock = threading.Lock()
+
+        def search_store(prefix, store):
+            store_stats = {}
+            keys = store._filter_keys(store.iter_dir(store_path or '.'),
+                                      name_glob, name_regex, max_size,
+                                      store_stats, prefix + '/')
+            for key, matches in store._search_keys(regex, keys,
+                                                   store_stats):
+                yield _join(prefix, key), matches
+            if stats is not None:
+                with lock:
+                    for name, count in store_stats.items():
+                        stats[name] = stats.get(name, 0) + count
+        return _fan_out(mounts, search_store)
+
+    def search(self, term, path='', name_glob=None, name_regex=None,
+               max_size=None, stats=None):
+        """See :meth:`passpy.store.Store.search`.
+        """
+        if term is None:
+            return {}
+        return dict(self.iter_search(term, path, name_glob, name_regex,
+                                     max_size, stats))
+
+    def build_index(self):
+        """See :meth:`passpy.store.Store.build_index`.
+        """
+        def build(prefix, store):
+            store.build_index()
+            return []
+        list(_fan_out(self._mounts(), build))
+
+    def drop_index(self):
+        """See :meth:`passpy.store.Store.drop_index`.
+        """
+        for store in self.stores.values():
+            store.drop_index()
+
+    def query(self, field=None, contains=None, equals=None):
+        """Query the metadata index of all stores concurrently.
+
+        See :meth:`passpy.store.Store.query`.
+
+        """
+        return sorted(_fan_out(self._mounts(), lambda prefix, store: (
+            _join(prefix, key)
+            for key in store.query(field, contains, equals))))
+
+    def audit(self, min_entropy=DEFAULT_MIN_ENTROPY, max_age=None):
+        """Audit all stores concurrently.
+
+        Reused passwords are also found across stores.  See
+        :meth:`passpy.store.Store.audit`.
+
+        """
+        hash_key = os.urandom(32)
+
+        def audit_store(prefix, store):
+            return [(_join(prefix, name),) + tuple(entry)
+                    for name, *entry in store._audit_entries(hash_key)]
+        return build_report(_fan_out(self._mounts(), audit_store),
+                            min_entropy, max_age)
+
+    def sync(self, remote='origin', branch=None):
+        """Sync all stores concurrently.
+
+        See :meth:`passpy.store.Store.sync`.
+
+        :rtype: list
+        :returns: The changes of all stores, with prefixed names.
+
+        """
+        def sync_store(prefix, store):
+            for event in store.sync(remote, branch):
+                if isinstance(event, KeyMoved):
+                    yield KeyMoved(_join(prefix, event.old_path),
+                                   _join(prefix, event.path))
+                else:
+                    yield type(event)(_join(prefix, event.path))
+        return list(_fan_out(self._mounts(), sync_store))
+
+    def maintain(self, squash_before=None, force=False):
+        """Maintain the git repositories of all mounted stores, one
+        after the other.
+
+        See :meth:`passpy.store.Store.maintain`.
+
+        :rtype: dict
+        :returns: The report of every store by prefix.
+
+        """
+        return dict((prefix, store.maintain(squash_before, force))
+                    for prefix, store in self._mounts())
+
+    def warm(self, count=100):
+        """Decrypt the most read keys of all stores concurrently.
+
+        See :meth:`passpy.store.Store.warm`.
+
+        :rtype: list
+        :returns: The prefixed names of the decrypted keys, up to
+            `count` per store.
+
+        """
+        return sorted(_fan_out(self._mounts(), lambda prefix, store: (
+            _join(prefix, name) for name in store.warm(count))))
+
+    def history(self, path, limit=None, diff=False):
+        """See :meth:`passpy.store.Store.history`.
+        """
+        prefix, store, path = self._route(path)
+        history = store.history(path, limit, diff)
+        for revision in history:
+            revision['path'] = _join(prefix, revision['path'])
+        return history
+
+    def bundle(self, path, subfolder=''):
+        """Pack the encrypted keys of a directory of one store into a
+        bundle.
+
+        See :meth:`passpy.store.Store.bundle`.  The keys of several
+        stores can't be packed into one bundle.
+
+        :raises ValueError: if `subfolder` is not below a prefix.
+
+        """
+        if subfolder is None or os.path.normpath(subfolder) in ('.', '/'):
+            raise ValueError('Only the keys of a single store can be '
+                             'bundled, choose a subfolder below one of '
+                             '{0}.'.format(', '.join(self.stores)))
+        _, store, subfolder = self._route(subfolder)
+        store.bundle(path, subfolder)
+
+    def git(self, method, *args, **kwargs):
+        """Run a git command in every mounted store.
+
+        See :meth:`passpy.store.Store.git`.
+
+        """
+        for _, store in self._mounts():
+            store.git(method, *args, **kwargs)
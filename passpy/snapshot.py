@@ -0,0 +1,232 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+###############
+snapshot module
+###############
+
+Read-only access to the keys of a password store as they were in an
+earlier commit, read straight from the git objects.
+"""
+
+import bisect
+import os
+import re
+import threading
+
+from passpy.entry import Entry
+from passpy.git import (
+    get_git_repository,
+    git_list_tree,
+    git_read_blob,
+    git_resolve_commit
+)
+from passpy.util import (
+    _sort_key,
+    wipe
+)
+
+
+class SnapshotStore():
+    """The keys of a password store at a commit.
+
+    Offers the reading part of the API of
+    :class:`passpy.store.Store`, like
+    :class:`passpy.bundle.BundleStore`.  Nothing is checked out and
+    no temporary files are written: the names of all keys are listed
+    once, and the encrypted keys are read through a single
+    `git cat-file --batch` process kept for the lifetime of the
+    snapshot.
+
+    Decrypted keys are cached by the hash of their blob, so a key that
+    did not change between commits is only decrypted once across all
+    snapshots sharing a cache.
+
+    """
+    def __init__(self, repo, rev, backend, cache=None):
+        """Creates a new SnapshotStore object.
+
+        Use :meth:`passpy.store.Store.snapshot` instead of creating
+        snapshots directly.
+
+        :param repo: The git repository of the password store.
+        :type repo: :class:`git.Repo`
+
+        :param str rev: The revision to read, see
+            :func:`passpy.git.git_resolve_commit`.
+
+        :param backend: The crypto backend to decrypt keys with.
+        :type backend: :class:`passpy.gpg.CryptoBackend`
+
+        :param cache: (optional) The cache for decrypted keys.
+            Nothing is cached if not given.
+        :type cache: :class:`passpy.access.ValueCache`
+
+        :raises ValueError: if `rev` is not a commit.
+
+        """
+        self.backend = backend
+        self._cache = cache
+        # A repository of our own, so that the cat-file process is not
+        # shared with anything else.
+        self._repo = get_git_repository(repo.git_dir)
+        self._lock = threading.Lock()
+        try:
+            self.commit = git_resolve_commit(self._repo, rev)
+            blobs = git_list_tree(self._repo, self.commit)
+        except Exception:
+            self.close()
+            raise
+        # Maps the name of every key to the hash of its blob.
+        self._blobs = {}
+        for path, sha in blobs.items():
+            # Ignore hidden files and directories as pass does the same.
+            if path.endswith('.gpg') and not any(
+                    part.startswith('.') for part in path.split('/')):
+                self._blobs[path[:-4]] = sha
+        # Depth first in alphabetical order, like
+        # :meth:`passpy.store.Store.iter_dir`.
+        self._names = sorted(self._blobs, key=self._get_sort_key)
+        self._sort_keys = [self._get_sort_key(name) for name in self._names]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_dir('')
+
+    def __len__(self):
+        return len(self._names)
+
+    def close(self):
+        """Stop the git process.
+        """
+        self._repo.close()
+
+    @staticmethod
+    def _get_sort_key(name):
+        return [_sort_key(part) for part in (name + '.gpg').split('/')]
+
+    def _get_sha(self, path):
+        """Get the hash of the blob of a key.
+
+        :raises FileNotFoundError: if there is no key `path`.
+
+        :rtype: str
+
+        """
+        if path is not None and path != '':
+            sha = self._blobs.get(os.path.normpath(path))
+            if sha is not None:
+                return sha
+        raise FileNotFoundError('{0} is not in the password store.'
+                                .format(path))
+
+    def get_key(self, path):
+        """See :meth:`passpy.store.Store.get_key`.
+        """
+        key_data = self.get_key_bytes(path)
+        try:
+            return key_data.decode(self.backend.encoding)
+        finally:
+            wipe(key_data)
+
+    def get_key_bytes(self, path):
+        """See :meth:`passpy.store.Store.get_key_bytes`.
+        """
+        sha = self._get_sha(path)
+        if self._cache is not None:
+            key_data = self._cache.get(sha, sha)
+            if key_data is not None:
+                return key_data
+        with self._lock:
+            data = git_read_blob(self._repo, sha)
+        key_data = self.backend.decrypt(data)
+        if not isinstance(key_data, bytearray):
+            key_data = bytearray(key_data)
+        if self._cache is not None:
+            self._cache.put(sha, sha, key_data)
+        return key_data
+
+    def get_entry(self, path):
+        """See :meth:`passpy.store.Store.get_entry`.
+        """
+        return Entry(self.get_key(path), path)
+
+    def iter_dir(self, path, after=None):
+        """Iterate over the names of all keys in a directory.
+
+        :param str path: The directory, ``''`` for all keys.
+
+        :param str after: (optional) Continue after this key, e.g. the
+            last key of an earlier iteration, even if the snapshot
+            does not have it.
+
+        :raises FileNotFoundError: if there are no keys in `path`.
+
+        :rtype: generator
+        :returns: The names of the keys, depth first in alphabetical
+            order.
+
+        """
+        path = os.path.normpath(path)
+        begin = 0
+        if after is not None:
+            begin = bisect.bisect_right(
+                self._sort_keys, self._get_sort_key(os.path.normpath(after)))
+        if path == '.':
+            return iter(self._names[begin:])
+        prefix = path + '/'
+        names = [name for name in self._names if name.startswith(prefix)]
+        if len(names) == 0:
+            raise FileNotFoundError('{0} is not a directory in the '
+                                    'password store.'.format(path))
+        return (name for name in self._names[begin:]
+                if name.startswith(prefix))
+
+    def find(self, names):
+        """See :meth:`passpy.store.Store.find`.
+        """
+        if names is None:
+            return []
+        if not isinstance(names, list):
+            names = [names]
+        return [key for key in self
+                if any(key.find(name) != -1 for name in names)]
+
+    def iter_search(self, term):
+        """See :meth:`passpy.store.Store.iter_search`.
+        """
+        regex = re.compile(term)
+        for key in self:
+            matches = []
+            for line in self.get_key(key).split('\n'):
+                match = regex.search(line)
+                if match is not None:
+                    matches.append((line, match))
+            if len(matches) > 0:
+                yield key, matches
+
+    def search(self, term):
+        """See :meth:`passpy.store.Store.search`.
+        """
+        if term is None:
+            return {}
+        return dict(self.iter_search(term))
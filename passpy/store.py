@@ -14,38 +14,139 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>._
 
+import bisect
+import errno
+import fnmatch
+import json
 import os
 import re
 import shutil
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from passpy.git import (
     get_git_repository,
     git_add_path,
     git_remove_path,
     git_init,
-    git_config
+    git_config,
+    git_head,
+    git_fetch,
+    git_merge,
+    git_changed_paths,
+    git_last_changes,
+    git_file_history,
+    git_read_blob,
+    git_count_objects,
+    git_needs_repack,
+    git_repack,
+    git_squash_history
 )
 
 from passpy.gpg import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    get_backend,
+    get_job_context,
+    job_context,
     reencrypt_path,
-    read_key,
-    write_key
+    _get_gpg_id_dir,
+    _get_gpg_recipients
+)
+
+from passpy.access import (
+    AccessRecorder,
+    Prefetcher,
+    ValueCache,
+    _get_cache_stamp
+)
+
+from passpy.audit import (
+    DEFAULT_MIN_ENTROPY,
+    build_report,
+    hash_password,
+    password_entropy
+)
+
+from passpy.bundle import write_bundle
+
+from passpy.cancel import (
+    check_operation,
+    get_operation_context,
+    use_operation_context
+)
+
+from passpy.committer import (
+    DURABILITY_IMMEDIATE,
+    DURABILITY_MODES,
+    GitCommitter
+)
+
+from passpy.entry import Entry
+
+from passpy.exceptions import RecursiveCopyMoveError
+
+from passpy.history import (
+    HistoryCache,
+    diff_fields
+)
+
+from passpy.index import MetadataIndex
+
+from passpy.manifest import WriteManifest
+
+from passpy.snapshot import SnapshotStore
+
+from passpy.watch import (
+    Watcher,
+    KeyAdded,
+    KeyChanged,
+    KeyRemoved,
+    KeyMoved,
+    GPGIdChanged
 )
 
 from passpy.util import (
+    _sort_key,
+    STATE_DIR,
+    cancellable,
     trap,
     initialised,
-    gen_password,
-    copy_move
+    gen_passwords,
+    copy_move,
+    get_state_dir,
+    PasswordPolicy,
+    parse_fields,
+    wipe
 )
 
 
+# The number of directory listings kept in memory.
+_MAX_LISTINGS = 16
+
+# The seconds a single gpg operation is assumed to take when planning,
+# until one was measured.
+_GPG_LATENCY_DEFAULT = 0.05
+
+# The file in the state directory keeping the measured gpg latency
+# across runs.
+_LATENCY_FILE = 'latency'
+_LATENCY_VERSION = 1
+
+
 class Store():
     """Python implementation of ZX2C4's password store.
     """
     def __init__(self, gpg_bin='gpg2', git_bin='git',
                  store_dir=os.getenv('PASSWORD_STORE_DIR', '~/.password-store'),
-                 use_agent=True, interactive=False, verbose=False):
+                 use_agent=True, interactive=False, verbose=False,
+                 backend=None, rekey=False, workers=None,
+                 durability=DURABILITY_IMMEDIATE, commit_interval=0.5,
+                 commit_changes=100, skip_unchanged=False, timeout=None,
+                 track_access=False, cache_size=0, cache_ttl=None):
         """Creates a new Store object.
 
         :param str gpg_bin: (optional) The path to the gpg
@@ -70,6 +171,69 @@ class Store():
         :param bool verbose: (optional) If ``True`` additional
             information will be printed to the standard out.
 
+        :param backend: (optional) The crypto backend to use.  Either
+            the name of a backend in :data:`passpy.gpg.BACKENDS` or a
+            :class:`passpy.gpg.CryptoBackend` instance.  Defaults to
+            :class:`passpy.gpg.GPGBackend`.
+        :type backend: str or :class:`passpy.gpg.CryptoBackend`
+
+        :param bool rekey: (optional) If ``True`` keys that need to be
+            reencrypted for new GPG ids only get their session key
+            encrypted for the new ids, leaving the encrypted data
+            untouched.  Keys already encrypted for the right ids are
+            skipped.  Falls back to reencrypting the whole key where
+            that is not possible.
+
+        :param int workers: (optional) The maximum number of keys
+            encrypted or decrypted in parallel by bulk operations.
+            Uses the default of
+            :class:`concurrent.futures.ThreadPoolExecutor` if not set.
+
+        :param str durability: (optional) When changes are committed
+            to git.  :data:`passpy.committer.DURABILITY_IMMEDIATE`
+            commits before every write returns,
+            :data:`passpy.committer.DURABILITY_BATCHED` commits in the
+            background and :data:`passpy.committer.DURABILITY_MANUAL`
+            only on :meth:`flush`.
+
+        :param float commit_interval: (optional) The seconds a change
+            waits at most before it is committed in the batched mode.
+
+        :param int commit_changes: (optional) The number of pending
+            changes that are committed right away in the batched mode.
+
+        :param bool skip_unchanged: (optional) If ``True`` writing a
+            key that already holds the same data for the same gpg ids
+            is skipped, without encrypting, writing or committing
+            anything.  What was written is remembered in an encrypted
+            manifest, see :class:`passpy.manifest.WriteManifest`.
+
+        :param float timeout: (optional) The default number of seconds
+            an operation may take.  Once it has passed, any gpg or git
+            process still running is killed and
+            :exc:`passpy.exceptions.OperationTimeoutError` is raised.
+            Methods that run gpg or git also take a `timeout` argument
+            to override it, and a `cancel` argument taking a
+            :class:`passpy.cancel.CancellationToken`.  No timeout is
+            used if not given.
+
+        :param bool track_access: (optional) If ``True`` every key read
+            with :meth:`get_key` and its siblings is counted, see
+            :class:`passpy.access.AccessRecorder`.  Reads by bulk
+            operations like :meth:`search` are not counted.
+
+        :param int cache_size: (optional) The number of decrypted keys
+            kept in memory, see :class:`passpy.access.ValueCache`.
+            Together with `track_access` the keys usually read together
+            with a key are decrypted in the background as soon as it
+            is read.  Snapshots keep as many keys of their own, see
+            :meth:`snapshot`.  Nothing is cached by default.
+
+        :param float cache_ttl: (optional) The seconds a decrypted key
+            is kept in memory at most.
+
+        :raises ValueError: if `durability` is not a known mode.
+
         """
         self.gpg_bin = gpg_bin
         self.git_bin = git_bin
@@ -78,16 +242,183 @@ class Store():
                          '--no-encrypt-to']
         if use_agent:
             self.gpg_opts += ['--batch', '--use-agent']
+        self.backend = get_backend(backend, self.gpg_bin, self.gpg_opts)
+        self.rekey = rekey
+        self.workers = workers
 
         self.store_dir = os.path.normpath(os.path.expanduser(store_dir))
         self.repo = get_git_repository(self.store_dir)
+        self._index = MetadataIndex(self.store_dir, self.backend)
+        self._manifest = WriteManifest(self.store_dir, self.backend)
+        self.skip_unchanged = skip_unchanged
+        self.timeout = timeout
+        if durability not in DURABILITY_MODES:
+            raise ValueError('Invalid durability mode {0}.'
+                             .format(durability))
+        self._committer = None
+        if durability != DURABILITY_IMMEDIATE:
+            self._committer = GitCommitter(self.repo, durability,
+                                           commit_interval, commit_changes,
+                                           verbose)
 
         self.interactive = interactive
         self.verbose = verbose
 
+        self.track_access = track_access
+        self._access = AccessRecorder(self.store_dir)
+        self._cache = None
+        # Keys decrypted by snapshots, by the hash of their blob.
+        self._blob_cache = None
+        if cache_size > 0:
+            self._cache = ValueCache(cache_size, cache_ttl)
+            self._blob_cache = ValueCache(cache_size, cache_ttl)
+        self._prefetcher = None
+
+        # Sorted listings of recently listed directories.
+        self._listings = OrderedDict()
+        self._listings_lock = threading.Lock()
+
+        self._listeners = []
+
     def __iter__(self):
         return self.iter_dir('')
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _git_add_path(self, path, msg, commit=True):
+        """Add a file or directory to git, now or with the next commit
+        depending on the durability mode.
+
+        See :func:`passpy.git.git_add_path`.
+
+        """
+        if self._committer is None:
+            git_add_path(self.repo, path, msg, commit, self.verbose)
+        else:
+            self._committer.add(path, msg, commit)
+
+    def _git_remove_path(self, path, msg, recursive=False, commit=True):
+        """Remove a file or directory from git, now or with the next
+        commit depending on the durability mode.
+
+        See :func:`passpy.git.git_remove_path`.
+
+        """
+        if self._committer is None:
+            git_remove_path(self.repo, path, msg, recursive, commit,
+                            self.verbose)
+        else:
+            self._committer.add(path, msg, commit)
+
+    def flush(self):
+        """Commit all changes not yet committed.
+
+        Does nothing with :data:`passpy.committer.DURABILITY_IMMEDIATE`.
+
+        :raises Exception: the error of a failed background commit.
+
+        """
+        if self._committer is not None:
+            self._committer.flush()
+
+    def close(self):
+        """Commit all changes not yet committed and stop committing in
+        the background.
+
+        Also stops prefetching, saves the access counts and wipes all
+        cached keys.
+
+        """
+        if self._committer is not None:
+            self._committer.close()
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+        self._access.close()
+        self._save_gpg_latency()
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Wipe all decrypted keys kept in memory.
+        """
+        if self._cache is not None:
+            self._cache.clear()
+        if self._blob_cache is not None:
+            self._blob_cache.clear()
+
+    def _map(self, func, items, priority=PRIORITY_BULK):
+        """Call `func` for every item in parallel.
+
+        :param func: The function to call.
+        :type func: function
+
+        :param items: The items to call `func` with.
+        :type items: iterable
+
+        :param int priority: (optional) The priority of the gpg jobs,
+            see :func:`passpy.gpg.job_context`.  Use
+            :data:`passpy.gpg.PRIORITY_INTERACTIVE` if someone waits for
+            the results.
+
+        All gpg jobs started by `func` belong to the same flow.  They
+        share the deadline and cancellation token of the calling
+        thread, which are checked before every item.
+
+        :rtype: list
+        :returns: The results of `func` in the order of `items`.
+
+        """
+        flow = object()
+        context = get_operation_context()
+
+        def run(item):
+            with job_context(priority, flow), \
+                    use_operation_context(context):
+                check_operation()
+                return func(item)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(run, items))
+
+    def add_listener(self, callback):
+        """Register a function to be called on changes from a sync.
+
+        :param callback: Called with the list of
+            :class:`passpy.watch.Event` for every
+            :meth:`passpy.store.Store.sync` that changed something, so
+            that caches can drop exactly the entries that changed.
+        :type callback: function
+
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Unregister a function added with
+        :meth:`passpy.store.Store.add_listener`.
+
+        :param callback: The function to remove.
+        :type callback: function
+
+        """
+        self._listeners.remove(callback)
+
+    def _notify(self, events):
+        """Tell the backend and all listeners about changed entries.
+
+        :param list events: The :class:`passpy.watch.Event` to report.
+
+        """
+        if len(events) == 0:
+            return
+        if any(isinstance(event, GPGIdChanged) for event in events):
+            self.backend.clear_cache()
+        for callback in list(self._listeners):
+            callback(events)
+
     def _get_store_name(self, path):
         """Returns the path relative to the store.
 
@@ -111,8 +442,9 @@ class Store():
             return True
         return False
 
+    @cancellable
     @trap('path')
-    def init_store(self, gpg_ids, path=None):
+    def init_store(self, gpg_ids, path=None, dry_run=False):
         """Initialise the password store or a subdirectory with the gpg ids.
 
         :param list gpg_ids: The list of gpg ids to encrypt the
@@ -124,6 +456,10 @@ class Store():
             set for the given directory.  The path is relative to
             :attr:`passpy.store.Store.store_dir`.
 
+        :param bool dry_run: (optional) If ``True`` nothing is changed,
+            instead the plan of what would be done is returned.  See
+            :meth:`passpy.store.Store._get_plan`.
+
         :raises ValueError: if the there is a problem with `path`.
 
         :raises FileExistsError: if
@@ -159,29 +495,44 @@ class Store():
                 raise FileNotFoundError(('{0} does not exist and so'
                                          'cannot be removed.')
                                         .format(gpg_id_path))
+            if dry_run:
+                return self._plan_init(
+                    path, _get_gpg_recipients(os.path.dirname(path)))
             os.remove(gpg_id_path)
-            git_remove_path(self.repo, [gpg_id_path],
-                            'Deinitialize {0}.'.format(gpg_id_path),
-                            recursive=True, verbose=self.verbose)
+            self._git_remove_path([gpg_id_path],
+                                  'Deinitialize {0}.'.format(gpg_id_path),
+                                  recursive=True)
             # The password store should not contain any empty directories,
             # so we try to remove as many directories as we can.  Any
             # nonempty ones will throw an error and will not be
             # removed.
             shutil.rmtree(path, ignore_errors=True)
+        elif dry_run:
+            return self._plan_init(path, gpg_ids)
         else:
-            os.makedirs(path)
+            os.makedirs(path, exist_ok=True)
             # pass needs the gpg id file to be newline terminated.
             with open(gpg_id_path, 'w') as gpg_id_file:
                 gpg_id_file.write('\n'.join(gpg_ids))
                 gpg_id_file.write('\n')
-            git_add_path(self.repo, gpg_id_path, 'Set GPG id to {0}.'
-                         .format(', '.join(gpg_ids)), verbose=self.verbose)
+            self._git_add_path(gpg_id_path, 'Set GPG id to {0}.'
+                               .format(', '.join(gpg_ids)))
 
+        # The keys of the old gpg ids must not be used any longer.
+        self.backend.clear_cache()
         reencrypt_path(path, gpg_bin=self.gpg_bin,
-                       gpg_opts=self.gpg_opts)
-        git_add_path(self.repo, path,
-                     'Reencrypt password store using new GPG id {0}.'
-                     .format(', '.join(gpg_ids)), verbose=self.verbose)
+                       gpg_opts=self.gpg_opts, backend=self.backend,
+                       rekey=self.rekey)
+        prefix = os.path.relpath(path, self.store_dir)
+        if prefix == '.':
+            prefix = ''
+        with self._index.batch():
+            self._index.reencrypt(prefix)
+            self._index.restamp(prefix)
+        self._manifest.reencrypt(prefix)
+        self._git_add_path(path,
+                           'Reencrypt password store using new GPG id {0}.'
+                           .format(', '.join(gpg_ids)))
 
     @initialised
     def init_git(self):
@@ -194,6 +545,8 @@ class Store():
         if self.repo is not None:
             return
         self.repo = git_init(self.store_dir)
+        if self._committer is not None:
+            self._committer.repo = self.repo
         git_add_path(self.repo, self.store_dir,
                      'Add current contents of password store.',
                      verbose=self.verbose)
@@ -204,18 +557,186 @@ class Store():
                      'Configure git repository for gpg file diff.',
                      verbose=self.verbose)
         git_config(self.repo, '--local', 'diff.gpg.binary', 'true')
-        git_config(self.repo, '--local', 'diff.gpg.textconf',
-                   '"' + self.gpg_bin + ' -d ' + ' '.join(self.gpg_opts) + '"')
+        git_config(self.repo, '--local', 'diff.gpg.textconv',
+                   self.gpg_bin + ' -d ' + ' '.join(self.gpg_opts))
+
+    @cancellable
+    @initialised
+    def sync(self, remote='origin', branch=None):
+        """Fetch and merge changes from a remote repository.
+
+        Only the changed files are looked at: the keys below any
+        directory whose `.gpg-id` changed are reencrypted if needed
+        and all listeners get the list of changes.
+
+        :param str remote: (optional) The name or URL of the remote.
+
+        :param str branch: (optional) The remote branch to merge.
+            Defaults to the name of the current branch.
+
+        :raises ValueError: if the password store is not a git
+            repository.
+
+        :raises git.exc.GitCommandError: if fetching or merging fails,
+            e.g. because of conflicts.
+
+        :rtype: list
+        :returns: The :class:`passpy.watch.Event` for all changes
+            that were merged.
+
+        """
+        if self.repo is None:
+            raise ValueError('The password store is not a git repository.')
+        self.flush()
+        if branch is None:
+            branch = self.repo.active_branch.name
+        old_head = git_head(self.repo)
+        git_fetch(self.repo, remote, verbose=self.verbose)
+        git_merge(self.repo, '{0}/{1}'.format(remote, branch),
+                  verbose=self.verbose)
+        new_head = git_head(self.repo)
+        if new_head is None or new_head == old_head:
+            return []
+
+        events = []
+        gpg_id_dirs = set()
+        for status, old_path, new_path in git_changed_paths(
+                self.repo, old_head, new_head):
+            for path in (old_path, new_path):
+                if path is not None and os.path.basename(path) == '.gpg-id':
+                    gpg_id_dirs.add(os.path.dirname(path))
+            old_key = old_path is not None and old_path.endswith('.gpg')
+            new_key = new_path is not None and new_path.endswith('.gpg')
+            if status == 'M':
+                if new_key:
+                    events.append(KeyChanged(new_path[:-4]))
+            elif old_key and new_key:
+                events.append(KeyMoved(old_path[:-4], new_path[:-4]))
+            else:
+                if old_key:
+                    events.append(KeyRemoved(old_path[:-4]))
+                if new_key:
+                    events.append(KeyAdded(new_path[:-4]))
+        events.extend(GPGIdChanged(directory)
+                      for directory in sorted(gpg_id_dirs))
+
+        with self._index.batch():
+            for event in events:
+                if isinstance(event, KeyRemoved):
+                    self._index.remove(event.path)
+                elif isinstance(event, KeyMoved):
+                    self._index.move(event.old_path, event.path)
+                    self._index.invalidate(event.path)
+                elif not isinstance(event, GPGIdChanged):
+                    self._index.invalidate(event.path)
+
+        for directory in sorted(gpg_id_dirs):
+            path = os.path.join(self.store_dir, directory)
+            # Reencrypting a directory also takes care of all
+            # directories below it.
+            if any(parent == '' or directory.startswith(parent + '/')
+                   for parent in gpg_id_dirs if parent != directory):
+                continue
+            if not os.path.isdir(path):
+                continue
+            reencrypt_path(path, gpg_bin=self.gpg_bin,
+                           gpg_opts=self.gpg_opts, backend=self.backend,
+                           rekey=self.rekey)
+            with self._index.batch():
+                self._index.reencrypt(directory)
+                self._index.restamp(directory)
+            self._manifest.reencrypt(directory)
+            self._git_add_path(path, 'Reencrypt {0} after sync.'
+                               .format(directory or 'password store'))
+
+        self._notify(events)
+        return events
 
     @initialised
     def git(self, method, *args, **kwargs):
         if method == 'init':
             self.init_git()
         else:
+            self.flush()
             res = self.repo.git._call_process(method, *args, **kwargs)
             if self.verbose:
                 print(res)
 
+    def _measure_git_latency(self, runs=3):
+        """Measure the git overhead of writing a key.
+
+        Refreshes the index and checks for staged changes like every
+        commit does.  Refreshing may write `.git/index` with updated
+        file stats, but no key is changed and nothing is committed.
+
+        :param int runs: (optional) The number of measurements.
+
+        :rtype: float
+        :returns: The fastest run in seconds.
+
+        """
+        timings = []
+        for _ in range(runs):
+            start = time.monotonic()
+            self.repo.git.update_index('-q', '--refresh')
+            self.repo.is_dirty(index=True, working_tree=False,
+                               untracked_files=False)
+            timings.append(time.monotonic() - start)
+        return min(timings)
+
+    @cancellable
+    def maintain(self, squash_before=None, force=False):
+        """Keep the git repository of the store fast.
+
+        Repacks the repository once there are too many loose objects or
+        packs, removes unreachable objects and writes the commit graph.
+
+        :param int squash_before: (optional) A unix timestamp.  All
+            commits made before it are squashed into a single commit,
+            see :func:`passpy.git.git_squash_history`.  This rewrites
+            history, so the store has to be force pushed afterwards.
+
+        :param bool force: (optional) If ``True`` the repository is
+            repacked even if it is below the thresholds.
+
+        :raises ValueError: if the store is not a git repository.
+
+        :rtype: dict
+        :returns: The object counts of
+            :func:`passpy.git.git_count_objects` before and after under
+            'before' and 'after', the git overhead of a write in seconds
+            before and after under 'latency_before' and
+            'latency_after', whether the repository was repacked under
+            'repacked' and the number of squashed commits under
+            'squashed'.
+
+        """
+        if self.repo is None:
+            raise ValueError('{0} is not a git repository.'
+                             .format(self.store_dir))
+        self.flush()
+        before = git_count_objects(self.repo)
+        latency_before = self._measure_git_latency()
+
+        squashed = 0
+        if squash_before is not None:
+            squashed = git_squash_history(self.repo, squash_before)
+
+        repacked = force or squashed > 0 or git_needs_repack(before)
+        if repacked:
+            git_repack(self.repo, prune='now' if squashed > 0
+                       else '2.weeks.ago', verbose=self.verbose)
+
+        return {
+            'before': before,
+            'after': git_count_objects(self.repo),
+            'latency_before': latency_before,
+            'latency_after': self._measure_git_latency(),
+            'repacked': repacked,
+            'squashed': squashed,
+        }
+
+    @cancellable
     @initialised
     @trap(1)
     def get_key(self, path):
@@ -230,17 +751,195 @@ class Store():
 
         :raises FileNotFoundError: if `path` is not a file.
 
+        """
+        key_data = self.get_key_bytes(path)
+        if key_data is None:
+            return None
+        try:
+            return key_data.decode(self.backend.encoding)
+        finally:
+            wipe(key_data)
+
+    @cancellable
+    @initialised
+    @trap(1)
+    def get_key_bytes(self, path):
+        """Reads the data of the key at path into a mutable buffer.
+
+        Unlike :meth:`get_key` the data is never decoded, so the
+        caller can wipe the only copy passpy holds with
+        :func:`passpy.util.wipe` when it is done.
+
+        :param str path: The path to the key (without '.gpg' ending)
+            relative to :attr:`passpy.store.Store.store_dir`.
+
+        :rtype: bytearray
+        :returns: The key data or ``None``, if `path` is empty.
+
+        :raises FileNotFoundError: if `path` is not a file.
+
         """
         if path is None or path == '':
             return None
         path = os.path.normpath(path)
 
         key_path = os.path.join(self.store_dir, path + '.gpg')
-        if os.path.isfile(key_path):
-            return read_key(key_path, self.gpg_bin, self.gpg_opts)
-        raise FileNotFoundError('{0} is not in the password store.'
-                                .format(path))
+        if not os.path.isfile(key_path):
+            raise FileNotFoundError('{0} is not in the password store.'
+                                    .format(path))
+        # Only reads someone waits for are counted and cached, so a
+        # search does not push out the keys that are actually used.
+        interactive = get_job_context()[0] == PRIORITY_INTERACTIVE
+        if interactive and self.track_access:
+            self._access.record(path)
+            self._prefetch(path)
+        return self._read_key_bytes(path, interactive)
+
+    def _read_key_bytes(self, path, fill=True):
+        """Decrypt a key, using the cache if enabled.
+
+        :param str path: The normalised name of the key.
+
+        :param bool fill: (optional) If ``False`` the key is not added
+            to the cache.
+
+        :rtype: bytearray
 
+        """
+        key_path = os.path.join(self.store_dir, path + '.gpg')
+        if self._cache is None:
+            return self.backend.read_key_bytes(key_path)
+        # Taken before decrypting, so a key changing meanwhile is never
+        # cached under its new stamp.
+        stamp = _get_cache_stamp(key_path)
+        key_data = self._cache.get(path, stamp)
+        if key_data is not None:
+            return key_data
+        key_data = self.backend.read_key_bytes(key_path)
+        if fill:
+            self._cache.put(path, stamp, key_data)
+        return key_data
+
+    def _prefetch(self, path):
+        """Decrypt the keys usually read together with a key in the
+        background.
+
+        :param str path: The normalised name of the key just read.
+
+        """
+        if self._cache is None:
+            return
+        names = []
+        for name in self._access.related(path):
+            key_path = os.path.join(self.store_dir, name + '.gpg')
+            stamp = _get_cache_stamp(key_path)
+            if stamp is not None and not self._cache.has(name, stamp):
+                names.append(name)
+        if len(names) == 0:
+            return
+        if self._prefetcher is None:
+            self._prefetcher = Prefetcher(self._warm_key)
+        self._prefetcher.submit(names)
+
+    def _warm_key(self, name):
+        wipe(self._read_key_bytes(name))
+
+    @cancellable
+    @initialised
+    def warm(self, count=100):
+        """Decrypt the most read keys ahead of time, e.g. when a service
+        starts.
+
+        The keys are ranked by the counts kept with `track_access`.
+        With a cache they are kept in memory, otherwise decrypting them
+        still lets the gpg agent cache the passphrases needed.
+
+        :param int count: (optional) The maximum number of keys to
+            decrypt.
+
+        :rtype: list
+        :returns: The names of the decrypted keys, the most read first.
+
+        """
+        names = [name for name in self._access.top(count)
+                 if os.path.isfile(os.path.join(self.store_dir,
+                                                name + '.gpg'))]
+        self._map(self._warm_key, names)
+        return names
+
+    @cancellable
+    @initialised
+    @trap(1)
+    def get_entry(self, path):
+        """Reads a key as an :class:`passpy.entry.Entry`.
+
+        :param str path: The path to the key (without '.gpg' ending)
+            relative to :attr:`passpy.store.Store.store_dir`.
+
+        :rtype: :class:`passpy.entry.Entry`
+        :returns: The entry or ``None``, if the key does not exist.
+
+        :raises FileNotFoundError: if `path` is not a file.
+
+        """
+        key_data = self.get_key(path)
+        if key_data is None:
+            return None
+        return Entry(key_data, path)
+
+    @cancellable
+    @initialised
+    def get_keys(self, paths):
+        """Read many keys at once, decrypting them in parallel.
+
+        Every key is only decrypted once, even if it is given several
+        times, e.g. as ``db`` and ``./db``.
+
+        :param list paths: The paths to the keys (without '.gpg'
+            ending) relative to :attr:`passpy.store.Store.store_dir`.
+
+        :rtype: dict
+        :returns: The key data of every path in `paths`.
+
+        :raises FileNotFoundError: if a path is not a file.
+
+        """
+        names = dict((path, os.path.normpath(path)) for path in paths)
+        unique = sorted(set(names.values()))
+        # Someone is waiting for these, e.g. passpy exec.
+        values = dict(zip(unique, self._map(self.get_key, unique,
+                                            PRIORITY_INTERACTIVE)))
+        return dict((path, values[name]) for path, name in names.items())
+
+    @cancellable
+    @initialised
+    def set_entry(self, entry, path=None, force=True):
+        """Write an :class:`passpy.entry.Entry` to the store.
+
+        :param entry: The entry to write.
+        :type entry: :class:`passpy.entry.Entry`
+
+        :param str path: (optional) The key to write.  Uses the name of
+            `entry` if not given.
+
+        :param bool force: (optional) If ``True`` path will be
+            overwritten if it exists.  Unlike for :meth:`set_key` this
+            is the default, as entries are usually read first.
+
+        :raises ValueError: if neither `path` nor the name of `entry`
+            are set.
+
+        :raises FileExistsError: if a key already exists for path and
+            `force` is ``False``.
+
+        """
+        if path is None:
+            path = entry.name
+        if path is None:
+            raise ValueError('The entry has no name.')
+        return self.set_key(path, entry.text, force)
+
+    @cancellable
     @initialised
     @trap(1)
     def set_key(self, path, key_data, force=False):
@@ -248,7 +947,8 @@ class Store():
 
         :param str path: The key to write.
 
-        :param str key_data: The data of the key.
+        :param str key_data: The data of the key.  A newline is added
+            if it does not end with one, like pass does.
 
         :param bool foce: (optional) If ``True`` path will be
             overwritten if it exists.
@@ -256,9 +956,48 @@ class Store():
         :raises FileExistsError: if a key already exists for path and
             overwrite is ``False``.
 
+        :rtype: bool
+        :returns: ``False`` if nothing was written, see
+            :meth:`set_key_bytes`.
+
+        """
+        if not key_data.endswith('\n'):
+            key_data += '\n'
+        key_data = bytearray(key_data.encode(self.backend.encoding))
+        try:
+            return self.set_key_bytes(path, key_data, force)
+        finally:
+            wipe(key_data)
+
+    @cancellable
+    @initialised
+    @trap(1)
+    def set_key_bytes(self, path, key_data, force=False):
+        """Add a key to the store or update an existing one from a buffer.
+
+        `key_data` is handed to the crypto backend without being
+        copied, decoded or changed, so binary data is stored as it is
+        and the caller can wipe it afterwards.
+
+        :param str path: The key to write.
+
+        :param key_data: The data of the key.
+        :type key_data: bytes, bytearray or memoryview
+
+        :param bool force: (optional) If ``True`` path will be
+            overwritten if it exists.
+
+        :raises FileExistsError: if a key already exists for path and
+            overwrite is ``False``.
+
+        :rtype: bool
+        :returns: ``False`` if nothing was written, because `path` is
+            empty or the key is unchanged and
+            :attr:`passpy.store.Store.skip_unchanged` is set.
+
         """
         if path is None or path == '':
-            return
+            return False
         path = os.path.normpath(path)
 
         key_path = os.path.join(self.store_dir, path + '.gpg')
@@ -266,17 +1005,180 @@ class Store():
         if os.path.exists(key_path) and not force:
             raise FileExistsError('An entry already exists for {0}.'
                                   .format(path))
+        if self._is_unchanged(path, key_data):
+            return False
 
         os.makedirs(os.path.join(self.store_dir, key_dir), exist_ok=True)
-        write_key(key_path, key_data, self.gpg_bin, self.gpg_opts)
+        self._write_key(path, key_data)
 
-        git_add_path(self.repo, key_path,
-                     'Add given password for {0} to store.'.format(path),
-                     verbose=self.verbose)
+        self._git_add_path(key_path,
+                           'Add given password for {0} to store.'
+                           .format(path))
+        return True
+
+    def _is_unchanged(self, path, key_data):
+        """Check whether writing a key can be skipped.
+
+        :param str path: The normalised name of the key.
+
+        :param key_data: The data of the key.
+        :type key_data: bytes, bytearray or memoryview
+
+        :rtype: bool
+
+        """
+        if not self.skip_unchanged:
+            return False
+        key_dir = os.path.dirname(os.path.join(self.store_dir, path))
+        return self._manifest.unchanged(path, key_data,
+                                        _get_gpg_recipients(key_dir))
+
+    def _write_key(self, path, key_data):
+        """Encrypt a key and update the index and manifest.
+
+        :param str path: The normalised name of the key.
+
+        :param key_data: The data of the key.
+        :type key_data: bytes, bytearray or memoryview
+
+        """
+        key_path = os.path.join(self.store_dir, path + '.gpg')
+        self.backend.write_key_bytes(key_path, key_data)
+        if self._index.exists():
+            self._index.update(path, parse_fields(
+                bytes(key_data).decode(self.backend.encoding)))
+        if self.skip_unchanged:
+            self._manifest.record(path, key_data, _get_gpg_recipients(
+                os.path.dirname(key_path)))
+
+    @cancellable
+    @initialised
+    def set_keys(self, keys, force=False):
+        """Add or update several keys at once.
+
+        The keys are encrypted in parallel and all changes are
+        committed at once.  No prompts are shown, regardless of
+        :attr:`passpy.store.Store.interactive`.
+
+        :param dict keys: Maps the paths of the keys to their data as
+            strings.  Like for :meth:`set_key` a newline is added to
+            data not ending with one.
+
+        :param bool force: (optional) If ``True`` existing keys will be
+            overwritten.
+
+        :raises FileExistsError: if a key already exists for one of
+            the paths and `force` is ``False``.
+
+        :rtype: list
+        :returns: The sorted paths of the keys that were written.  Keys
+            that did not change are left out if
+            :attr:`passpy.store.Store.skip_unchanged` is set.
+
+        """
+        items = [(os.path.normpath(path), key_data)
+                 for path, key_data in keys.items()
+                 if path is not None and path != '']
+        for path, _ in items:
+            if (os.path.exists(os.path.join(self.store_dir, path + '.gpg'))
+                    and not force):
+                raise FileExistsError('An entry already exists for {0}.'
+                                      .format(path))
+
+        written = []
+        with self._index.batch(), self._manifest.batch():
+            for path, key_data in items:
+                if not key_data.endswith('\n'):
+                    key_data += '\n'
+                key_data = bytearray(key_data.encode(self.backend.encoding))
+                if self._is_unchanged(path, key_data):
+                    wipe(key_data)
+                    continue
+                os.makedirs(os.path.dirname(
+                    os.path.join(self.store_dir, path)), exist_ok=True)
+                written.append((path, key_data))
+            done = []
+
+            def write(path, key_data):
+                self._write_key(path, key_data)
+                done.append(path)
+            try:
+                self._map(lambda args: write(*args), written)
+            finally:
+                for _, key_data in written:
+                    wipe(key_data)
+                # Keys written before an error or cancellation are
+                # still committed, even once the deadline passed.
+                paths = sorted(done)
+                if len(paths) > 0:
+                    with use_operation_context((None, None)):
+                        self._git_add_path(
+                            [os.path.join(self.store_dir, path + '.gpg')
+                             for path in paths],
+                            'Add {0} keys to store.'.format(len(paths)))
+        return paths
+
+    @cancellable
+    @initialised
+    @trap(1)
+    def open_key(self, path, mode='rb', force=False):
+        """Open a key as a binary file object.
+
+        Useful for large or binary keys, as the crypto backend may
+        stream the data instead of holding all of it in memory.  A key
+        opened for writing is written and committed when the file
+        object is closed.  Calling its `abort` method instead, or
+        leaving the ``with`` block it is used in with an exception,
+        leaves the key as it was.
+
+        :param str path: The path to the key (without '.gpg' ending)
+            relative to :attr:`passpy.store.Store.store_dir`.
+
+        :param str mode: (optional) ``'rb'`` for reading or ``'wb'``
+            for writing the key.
+
+        :param bool force: (optional) If ``True`` an existing key will
+            be overwritten when opened for writing.
+
+        :raises ValueError: if `path` is empty or `mode` is invalid.
+
+        :raises FileNotFoundError: if the key does not exist and is
+            opened for reading.
+
+        :raises FileExistsError: if the key exists and is opened for
+            writing without `force`.
+
+        :rtype: file object
+        :returns: A readable or writable binary file object.
+
+        """
+        if path is None or path == '':
+            raise ValueError('No key given.')
+        path = os.path.normpath(path)
+        key_path = os.path.join(self.store_dir, path + '.gpg')
+
+        if mode == 'rb':
+            if not os.path.isfile(key_path):
+                raise FileNotFoundError('{0} is not in the password store.'
+                                        .format(path))
+            return self.backend.open_key(key_path, 'rb')
+        elif mode == 'wb':
+            if os.path.exists(key_path) and not force:
+                raise FileExistsError('An entry already exists for {0}.'
+                                      .format(path))
+            os.makedirs(os.path.dirname(key_path), exist_ok=True)
+
+            def commit():
+                self._git_add_path(key_path,
+                                   'Add given password for {0} to store.'
+                                   .format(path))
+            return self.backend.open_key(key_path, 'wb', on_close=commit)
+        raise ValueError('Invalid mode {0}.'.format(mode))
 
     @initialised
     @trap(1)
-    def remove_path(self, path, recursive=False, force=False):
+    def remove_path(self, path, recursive=False, force=False,
+                    dry_run=False):
         """Removes the given key or directory from the store.
 
         :param str path: The key or directory to remove.  Use '' to
@@ -289,9 +1191,26 @@ class Store():
             be prompted for deleting a file or directory, even if
             :attr:`passpy.store.Store.interactive` is set.
 
+        :param bool dry_run: (optional) If ``True`` nothing is removed,
+            instead the plan of what would be done is returned.  See
+            :meth:`passpy.store.Store._get_plan`.
+
         """
         key_path = os.path.join(self.store_dir, path)
         key_path = os.path.normpath(key_path)
+        if dry_run:
+            if os.path.isdir(key_path):
+                if not recursive and len(os.listdir(key_path)) > 0:
+                    # Like the os.rmdir below.
+                    raise OSError(errno.ENOTEMPTY,
+                                  os.strerror(errno.ENOTEMPTY), key_path)
+                keys = self._walk_keys(key_path)
+            elif os.path.isfile(key_path + '.gpg'):
+                keys = [key_path + '.gpg']
+            else:
+                raise FileNotFoundError('{0} is not in the password store.'
+                                        .format(path))
+            return self._get_plan([], remove=keys, stage=len(keys))
         if os.path.isdir(key_path):
             if self.interactive and not force:
                 answer = input('Really delete {0}? [y/N] '.format(path))
@@ -314,16 +1233,18 @@ class Store():
 
         if self.verbose:
             print('removed {0}'.format(path))
+        self._index.remove(self._get_store_name(key_path))
 
         if not os.path.exists(key_path):
-            git_remove_path(self.repo, key_path,
-                            'Remove {0} from store.'.format(path),
-                            recursive=recursive, verbose=self.verbose)
+            self._git_remove_path(key_path,
+                                  'Remove {0} from store.'.format(path),
+                                  recursive=recursive)
 
+    @cancellable
     @initialised
     @trap(1)
     def gen_key(self, path, length, symbols=True, force=False,
-                inplace=False):
+                inplace=False, policy=None):
         """Generate a new password for a key.
 
         :param str path: The path of the key.
@@ -340,6 +1261,10 @@ class Store():
             line of an existing key at `path` will be overwritten with
             the new password.
 
+        :param policy: (optional) The policy to generate the password
+            with.  Overrides `length` and `symbols`.
+        :type policy: :class:`passpy.util.PasswordPolicy`
+
         """
         if path is None or path == '':
             return None
@@ -358,30 +1283,136 @@ class Store():
 
         os.makedirs(os.path.join(self.store_dir, key_dir), exist_ok=True)
 
-        password = gen_password(length, symbols=symbols)
+        if policy is None:
+            policy = PasswordPolicy(length, symbols)
+        password = gen_passwords([policy])[0]
+        self._write_password(key_path, password, inplace)
         action = 'Add'
+        if inplace:
+            action = 'Replace'
+
+        self._git_add_path(key_path,
+                           '{0} generated password for {1}.'
+                           .format(action, path))
+        return password
+
+    def _write_password(self, key_path, password, inplace=False):
+        """Write a generated password to a key file.
+
+        :param str key_path: The absolute path of the key file.
+
+        :param str password: The password to write.
+
+        :param bool inplace: (optional) If ``True`` only the first
+            line of the existing key will be replaced with `password`.
+
+        """
         if not inplace:
-            write_key(key_path, password, self.gpg_bin, self.gpg_opts)
-            action = 'Add'
+            key_data = password
         else:
-            action = 'Replace'
-            key_data = read_key(key_path, gpg_bin=self.gpg_bin,
-                                gpg_opts=self.gpg_opts)
+            key_data = self.backend.read_key(key_path)
             lines = key_data.split('\n')
             lines[0] = password
-            write_key(key_path, '\n'.join(lines), gpg_bin=self.gpg_bin,
-                      gpg_opts=self.gpg_opts)
+            key_data = '\n'.join(lines)
+        self.backend.write_key(key_path, key_data)
+        self._index.update(self._get_store_name(key_path),
+                           parse_fields(key_data))
 
-        git_add_path(self.repo, key_path,
-                     '{0} generated password for {1}.'.format(action, path),
-                     verbose=self.verbose)
-        return password
+    @cancellable
+    @initialised
+    @trap(1)
+    def gen_keys(self, paths, length, symbols=True, force=False,
+                 inplace=False, policies=None):
+        """Generate new passwords for several keys at once.
+
+        The keys are encrypted in parallel and all changes are
+        committed at once.  No prompts are shown, regardless of
+        :attr:`passpy.store.Store.interactive`.  Every key only gets a
+        single password, even if it is given several times, e.g. as
+        ``db`` and ``./db``.
+
+        :param list paths: The paths of the keys.
+
+        :param int length: The length of the new passwords.
+
+        :param bool symbols: (optional) If ``True`` non alphanumeric
+            characters will also be used in the new passwords.
+
+        :param bool force: (optional) If ``True`` existing keys will be
+            overwritten.
+
+        :param bool inplace: (optional) If ``True`` only the first
+            line of existing keys will be overwritten with the new
+            password.  Keys that don't exist yet will be added.
+
+        :param dict policies: (optional) Maps shell-style wildcard
+            patterns to :class:`passpy.util.PasswordPolicy` objects.
+            Each key uses the policy of the first pattern its path
+            matches.  Keys not matching any pattern use `length` and
+            `symbols`.
+
+        :raises FileExistsError: if a key already exists for one of
+            `paths` and neither `force` nor `inplace` is ``True``.
+
+        :rtype: dict
+        :returns: The new password for every path in `paths`.
+
+        """
+        if policies is None:
+            policies = {}
+        default_policy = PasswordPolicy(length, symbols)
+
+        names = dict((path, os.path.normpath(path)) for path in paths
+                     if path is not None and path != '')
+        paths = sorted(set(names.values()))
+        key_paths = [os.path.join(self.store_dir, path + '.gpg')
+                     for path in paths]
+        for path, key_path in zip(paths, key_paths):
+            if os.path.exists(key_path) and not (force or inplace):
+                raise FileExistsError('An entry already exists for {0}.'
+                                      .format(path))
+
+        key_policies = []
+        for path in paths:
+            for pattern, policy in policies.items():
+                if fnmatch.fnmatchcase(path, pattern):
+                    key_policies.append(policy)
+                    break
+            else:
+                key_policies.append(default_policy)
+        passwords = gen_passwords(key_policies)
+
+        # Keys that don't exist yet are simply added, even if inplace
+        # is set.
+        replace = [inplace and os.path.exists(key_path)
+                   for key_path in key_paths]
+        for key_path in key_paths:
+            os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        done = []
+
+        def write(key_path, password, inplace):
+            self._write_password(key_path, password, inplace)
+            done.append(key_path)
+        try:
+            with self._index.batch():
+                self._map(lambda args: write(*args),
+                          zip(key_paths, passwords, replace))
+        finally:
+            # Keys written before an error or cancellation are still
+            # committed, even once the deadline passed.
+            if len(done) > 0:
+                with use_operation_context((None, None)):
+                    self._git_add_path(sorted(done),
+                                       'Generate passwords for {0} keys.'
+                                       .format(len(done)))
+        passwords = dict(zip(paths, passwords))
+        return dict((path, passwords[name]) for path, name in names.items())
 
     @initialised
     @trap(1)
     @trap(2)
     def _copy_move_path(self, old_path, new_path, force=False,
-                        move=False):
+                        move=False, dry_run=False):
         """Copies or moves a key or directory within the password store.
 
         :param str old_path: The current path of the key or directory.
@@ -397,6 +1428,9 @@ class Store():
             moved.  If ``False`` the key or directory will be copied
             instead.
 
+        :param bool dry_run: (optional) If ``True`` nothing is changed,
+            instead the plan of what would be done is returned.
+
         """
         old_path = os.path.normpath(old_path)
         new_path = os.path.normpath(new_path)
@@ -409,6 +1443,10 @@ class Store():
                     or new_path_full.endswith('/')):
                 new_path_full += '.gpg'
 
+        if dry_run:
+            return self._plan_copy_move(old_path_full, new_path_full, force,
+                                        move)
+
         new_path_full = copy_move(old_path_full, new_path_full, force,
                                   move, self.interactive,
                                   self.verbose)
@@ -417,22 +1455,226 @@ class Store():
 
         if os.path.exists(new_path_full):
             reencrypt_path(new_path_full, gpg_bin=self.gpg_bin,
-                           gpg_opts=self.gpg_opts)
+                           gpg_opts=self.gpg_opts, backend=self.backend,
+                           rekey=self.rekey)
+        new_name = self._get_store_name(new_path_full)
+        with self._index.batch():
+            self._index.move(self._get_store_name(old_path_full), new_name,
+                             copy=not move)
+            self._index.restamp(new_name)
 
         action = 'Copy'
         if move:
             action = 'Rename'
             shutil.rmtree(old_path_full, ignore_errors=True)
             if not os.path.exists(old_path_full):
-                git_remove_path(self.repo, old_path_full, '',
-                                recursive=True, commit=False)
+                self._git_remove_path(old_path_full, '', recursive=True,
+                                      commit=False)
 
-        git_add_path(self.repo, new_path_full, '{0} {1} to {2}.'
-                     .format(action, old_path, new_path),
-                     verbose=self.verbose)
+        self._git_add_path(new_path_full, '{0} {1} to {2}.'
+                           .format(action, old_path, new_path))
+
+    def _walk_keys(self, path):
+        """List all keys in a directory and its subdirectories.
+
+        :param str path: The absolute path of the directory.
+
+        :rtype: list
+        :returns: The absolute paths of the key files.
+
+        """
+        key_paths = []
+        for root, dirs, keys in os.walk(path):
+            key_paths += [os.path.join(root, key) for key in keys
+                          if key.endswith('.gpg')]
+        return key_paths
+
+    def _get_plan(self, reencrypt, copy=(), remove=(), stage=0):
+        """Describe what an operation would cost.
+
+        The estimated duration is based on the moving average of the
+        duration of the gpg jobs that already ran, see
+        :meth:`passpy.gpg.GPGScheduler.metrics`, or else the one saved
+        by :meth:`close` in an earlier run.  Nothing is decrypted to
+        measure it.  If nothing was measured yet, every gpg call is
+        assumed to take :data:`passpy.store._GPG_LATENCY_DEFAULT`
+        seconds.
+
+        :param list reencrypt: The absolute paths of the keys that would
+            be reencrypted.
+
+        :param list copy: (optional) The absolute paths of the keys
+            that would be copied.
+
+        :param list remove: (optional) The absolute paths of the keys
+            that would be removed.
+
+        :param int stage: (optional) The number of files that would be
+            staged in git.
+
+        :rtype: dict
+        :returns: The number of keys to reencrypt, copy, remove and
+            stage under 'reencrypt', 'copy', 'remove' and 'stage', the
+            total size of all these keys under 'bytes', the
+            estimated duration in seconds under 'seconds', the seconds
+            per gpg call it is based on under 'latency' and whether
+            these were measured under 'latency_measured'.
+
+        """
+        latency = self.backend.scheduler.metrics()['latency']
+        if latency is None:
+            latency = self._read_gpg_latency()
+        latency_measured = latency is not None
+        if not latency_measured:
+            latency = _GPG_LATENCY_DEFAULT
+        seconds = 0.0
+        if len(reencrypt) > 0:
+            # Rekeying only needs gpg to decrypt the session key.
+            jobs = 1 if self.rekey else 2
+            seconds = len(reencrypt) * jobs * latency
+        key_paths = set(reencrypt) | set(copy) | set(remove)
+        return {
+            'reencrypt': len(reencrypt),
+            'copy': len(copy),
+            'remove': len(remove),
+            'stage': stage,
+            'bytes': sum(os.path.getsize(key_path)
+                         for key_path in key_paths),
+            'seconds': seconds,
+            'latency': latency,
+            'latency_measured': latency_measured,
+        }
+
+    def _read_gpg_latency(self):
+        """Read the gpg latency saved by :meth:`_save_gpg_latency`.
+
+        :rtype: float
+        :returns: The seconds per gpg job, ``None`` if none was saved.
+
+        """
+        path = os.path.join(self.store_dir, STATE_DIR, _LATENCY_FILE)
+        try:
+            with open(path, 'r') as latency_file:
+                latency = json.load(latency_file)
+        except (OSError, ValueError):
+            return None
+        if latency.get('version') != _LATENCY_VERSION:
+            return None
+        return latency['gpg']
+
+    def _save_gpg_latency(self):
+        """Save the moving average of the duration of gpg jobs, so
+        later runs can plan with it.
+
+        Does nothing if no gpg job ran.
+
+        """
+        latency = self.backend.scheduler.metrics()['latency']
+        if latency is None or not self.is_init():
+            return
+        path = os.path.join(get_state_dir(self.store_dir), _LATENCY_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as latency_file:
+            json.dump({'version': _LATENCY_VERSION, 'gpg': latency},
+                      latency_file)
+        os.replace(tmp_path, path)
+
+    def _plan_init(self, path, gpg_ids):
+        """Plan setting the gpg ids of a directory.
+
+        :param str path: The absolute path of the directory.
 
+        :param list gpg_ids: The gpg ids the keys would be encrypted
+            for afterwards.
 
-    def copy_path(self, old_path, new_path, force=False):
+        :rtype: dict
+        :returns: See :meth:`passpy.store.Store._get_plan`.
+
+        """
+        reencrypt = []
+        for key_path in self._walk_keys(path):
+            # Keys below another .gpg-id file keep their gpg ids.
+            gpg_id_dir = _get_gpg_id_dir(os.path.dirname(key_path))
+            if gpg_id_dir is not None and gpg_id_dir.startswith(path
+                                                                + os.sep):
+                continue
+            if not self.backend.is_encrypted_for(key_path, gpg_ids):
+                reencrypt.append(key_path)
+        return self._get_plan(reencrypt, stage=len(reencrypt) + 1)
+
+    def _plan_copy_move(self, old_path_full, new_path_full, force, move):
+        """Plan copying or moving a key or directory.
+
+        Fails in the same cases :func:`passpy.util.copy_move` would.
+        As a plan can't ask whether to overwrite a key, it also fails
+        for interactive stores unless `force` is set.
+
+        :param str old_path_full: The absolute path of the key file or
+            directory.
+
+        :param str new_path_full: The absolute path to copy or move to.
+
+        :param bool force: ``True`` if existing keys would be
+            overwritten.
+
+        :param bool move: ``True`` if the keys would be moved.
+
+        :raises FileNotFoundError: if `old_path_full` does not exist.
+
+        :raises FileExistsError: if a key would be overwritten and
+            `force` is not set.
+
+        :raises passpy.exceptions.RecursiveCopyMoveError: if a
+            directory would be copied or moved into itself.
+
+        :rtype: dict
+        :returns: See :meth:`passpy.store.Store._get_plan`.
+
+        """
+        if os.path.isfile(old_path_full):
+            if os.path.isdir(new_path_full):
+                new_path_full = os.path.join(new_path_full,
+                                             os.path.basename(old_path_full))
+            key_pairs = [(old_path_full, new_path_full)]
+        elif os.path.isdir(old_path_full):
+            if os.path.commonpath([old_path_full,
+                                   new_path_full]) == old_path_full:
+                raise RecursiveCopyMoveError('Can\'t copy or move a '
+                                             'directory into itself.')
+            if os.path.exists(new_path_full):
+                new_path_full = os.path.join(new_path_full,
+                                             os.path.basename(old_path_full))
+            key_pairs = [(key_path, os.path.join(
+                new_path_full, os.path.relpath(key_path, old_path_full)))
+                         for key_path in self._walk_keys(old_path_full)]
+        else:
+            raise FileNotFoundError('{0} does not exist.'
+                                    .format(old_path_full))
+        if not force:
+            for _, new_key_path in key_pairs:
+                if os.path.exists(new_key_path):
+                    raise FileExistsError('{0} already exists.'
+                                          .format(new_key_path))
+
+        reencrypt = []
+        for key_path, new_key_path in key_pairs:
+            # .gpg-id files within a directory are copied along.
+            gpg_id_dir = _get_gpg_id_dir(os.path.dirname(key_path))
+            if (os.path.isdir(old_path_full) and gpg_id_dir is not None
+                    and (gpg_id_dir == old_path_full
+                         or gpg_id_dir.startswith(old_path_full + os.sep))):
+                continue
+            gpg_ids = _get_gpg_recipients(os.path.dirname(new_key_path))
+            if not self.backend.is_encrypted_for(key_path, gpg_ids):
+                reencrypt.append(key_path)
+
+        copy = [key_path for key_path, _ in key_pairs]
+        remove = copy if move else []
+        return self._get_plan(reencrypt, copy, remove,
+                              stage=len(copy) + len(remove))
+
+    @cancellable
+    def copy_path(self, old_path, new_path, force=False, dry_run=False):
         """Copies a key or directory within the password store.
 
         :param str old_path: The current path of the key or directory.
@@ -444,10 +1686,16 @@ class Store():
         :param bool force: If ``True`` any existing key or directory at
             `new_path` will be overwritten.
 
+        :param bool dry_run: (optional) If ``True`` nothing is changed,
+            instead the plan of what would be done is returned.  See
+            :meth:`passpy.store.Store._get_plan`.
+
         """
-        self._copy_move_path(old_path, new_path, force, False)
+        return self._copy_move_path(old_path, new_path, force, False,
+                                    dry_run)
 
-    def move_path(self, old_path, new_path, force=False):
+    @cancellable
+    def move_path(self, old_path, new_path, force=False, dry_run=False):
         """Moves a key or directory within the password store.
 
         :param str old_path: The current path of the key or directory.
@@ -459,20 +1707,67 @@ class Store():
         :param bool force: If ``True`` any existing key or directory at
             `new_path` will be overwritten.
 
+        :param bool dry_run: (optional) If ``True`` nothing is changed,
+            instead the plan of what would be done is returned.  See
+            :meth:`passpy.store.Store._get_plan`.
+
         """
-        self._copy_move_path(old_path, new_path, force, True)
+        return self._copy_move_path(old_path, new_path, force, True,
+                                    dry_run)
 
-    @initialised
-    @trap(1)
-    def list_dir(self, path):
-        """Returns all directory and key entries for the given path.
+    def _scan_dir(self, path_dir):
+        """Get the sorted entries of a directory.
 
-        :param str path: The directory to list relative to
-            :attr:`passpy.store.Store.store_dir`
+        Listings are cached together with the modification time of the
+        directory, which changes whenever an entry is added, removed
+        or renamed, so unchanged directories are neither listed nor
+        sorted again.
+
+        :param str path_dir: The absolute path of the directory.
 
         :rtype: (list, list)
-        :returns: Two lists, the first for directories, the second for
-            keys.  ``None`` if `path` is not a directory.
+        :returns: The sort keys of all visible entries and ``(name,
+            is_dir)`` tuples for them, both in the same order.  Only
+            directories and `.gpg` files are included.
+
+        """
+        stamp = os.stat(path_dir).st_mtime_ns
+        with self._listings_lock:
+            listing = self._listings.get(path_dir)
+            if listing is not None and listing[0] == stamp:
+                self._listings.move_to_end(path_dir)
+                return listing[1], listing[2]
+
+        entries = []
+        with os.scandir(path_dir) as it:
+            for entry in it:
+                # Ignore hidden files and directories as pass does the
+                # same.
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    entries.append((_sort_key(entry.name), entry.name, True))
+                # pass also shows files that do not end on .gpg in
+                # it's overview, but will throw an error if trying to
+                # access these files.  As this would make it harder to
+                # automatically iterate over the keys in the store, we
+                # just show files, that (probably) are in the store.
+                elif entry.is_file() and entry.name.endswith('.gpg'):
+                    entries.append((_sort_key(entry.name), entry.name,
+                                    False))
+        entries.sort()
+        sort_keys = [entry[0] for entry in entries]
+        entries = [entry[1:] for entry in entries]
+
+        with self._listings_lock:
+            self._listings[path_dir] = (stamp, sort_keys, entries)
+            self._listings.move_to_end(path_dir)
+            while len(self._listings) > _MAX_LISTINGS:
+                self._listings.popitem(last=False)
+        return sort_keys, entries
+
+    def _get_dir(self, path):
+        """Get the absolute path of a directory in the store.
 
         :raises FileNotFoundError: if `path` is not a directory in the
             password store.
@@ -483,49 +1778,293 @@ class Store():
         if path is None or not os.path.isdir(path_dir):
             raise FileNotFoundError('{0} is not a directory in the '
                                     'password store.'.format(path))
+        return path_dir
+
+    @initialised
+    @trap(1)
+    def list_dir(self, path, after=None, limit=None):
+        """Returns all directory and key entries for the given path.
+
+        Large directories can be listed page by page with `after` and
+        `limit`.  Pages only need to find their start in the sorted
+        listing, which is kept as long as the directory does not
+        change.
+
+        :param str path: The directory to list relative to
+            :attr:`passpy.store.Store.store_dir`
+
+        :param str after: (optional) The cursor returned with the
+            previous page.  Entries added or removed in the meantime
+            don't shift later pages.
+
+        :param int limit: (optional) The maximum number of entries,
+            directories and keys together, to return.
+
+        :rtype: (list, list) or (list, list, str)
+        :returns: Two lists, the first for directories, the second for
+            keys, both sorted alphabetically.  If `after` or `limit` is
+            given, the cursor for the next page follows, ``None`` on
+            the last page.
+
+        :raises FileNotFoundError: if `path` is not a directory in the
+            password store.
+
+        """
+        path_dir = self._get_dir(path)
+        sort_keys, entries = self._scan_dir(path_dir)
+
+        begin = 0
+        if after is not None:
+            begin = bisect.bisect_right(sort_keys, _sort_key(after))
+        end = len(entries)
+        if limit is not None:
+            end = min(end, begin + max(0, limit))
 
         dirs = []
         keys = []
-
-        # We want to return the entries alphabetically sorted.
-        for entry in sorted(os.listdir(path_dir), key=str.lower):
-            if entry.startswith('.'):
-                continue
-            entry_path = os.path.join(path_dir, entry)
-            if os.path.isdir(entry_path):
+        for name, is_dir in entries[begin:end]:
+            entry_path = os.path.join(path_dir, name)
+            if is_dir:
                 dirs.append(self._get_store_name(entry_path))
-            elif os.path.isfile(entry_path) and entry.endswith('.gpg'):
+            else:
                 # Keys are named without their ending.
                 keys.append(self._get_store_name(entry_path))
 
-        return dirs, keys
+        if after is None and limit is None:
+            return dirs, keys
+        cursor = None
+        if end < len(entries):
+            cursor = entries[end - 1][0] if end > begin else after or ''
+        return dirs, keys, cursor
+
+    @initialised
+    @trap(1)
+    def iter_dir(self, path, after=None):
+        """Iterate over the names of all keys below a directory.
+
+        :param str path: The directory relative to
+            :attr:`passpy.store.Store.store_dir`.
+
+        :param str after: (optional) Continue after this key, e.g. the
+            last key of an earlier iteration, even if it was removed
+            since.
+
+        :rtype: generator
+        :returns: The names of the keys, depth first in alphabetical
+            order.
 
+        :raises FileNotFoundError: if `path` is not a directory in the
+            password store.
+
+        """
+        path_dir = self._get_dir(path)
+        parts = []
+        if after is not None:
+            after = os.path.relpath(os.path.join(self.store_dir, after),
+                                    path_dir)
+            parts = after.split(os.sep)
+        yield from self._iter_dir(path_dir, parts)
+
+    def _iter_dir(self, path_dir, after):
+        """Iterate over the keys below a directory.
+
+        :param str path_dir: The absolute path of the directory.
+
+        :param list after: The components of the key to continue
+            after, relative to `path_dir`.  Empty to start at the
+            beginning.
+
+        """
+        sort_keys, entries = self._scan_dir(path_dir)
+        begin = 0
+        if len(after) > 0 and after[0] != '..':
+            if len(after) == 1:
+                # Keys are named without their ending.
+                begin = bisect.bisect_right(sort_keys,
+                                            _sort_key(after[0] + '.gpg'))
+            else:
+                begin = bisect.bisect_right(sort_keys, _sort_key(after[0]))
+                dir_path = os.path.join(path_dir, after[0])
+                if os.path.isdir(dir_path):
+                    yield from self._iter_dir(dir_path, after[1:])
+        for name, is_dir in entries[begin:]:
+            entry_path = os.path.join(path_dir, name)
+            if is_dir:
+                yield from self._iter_dir(entry_path, [])
+            else:
+                yield os.path.relpath(entry_path, self.store_dir)[:-4]
+
+    @cancellable
     @initialised
     @trap(1)
-    def iter_dir(self, path):
+    def history(self, path, limit=None, diff=False):
+        """List the earlier versions of a key.
+
+        Renames are followed, see :func:`passpy.git.git_file_history`
+        for when they are not.  The versions are decrypted in parallel
+        and kept in a :class:`passpy.history.HistoryCache`, so every
+        version is only ever decrypted once.
+
+        :param str path: The path to the key (without '.gpg' ending)
+            relative to :attr:`passpy.store.Store.store_dir`.  It does
+            not need to exist anymore.
+
+        :param int limit: (optional) The maximum number of versions.
+
+        :param bool diff: (optional) If ``True`` only report which
+            parts of the key changed, see
+            :func:`passpy.history.diff_fields`, instead of the content.
+
+        :raises ValueError: if the store has no git repository.
+
+        :raises FileNotFoundError: if git does not know `path`.
+
+        :rtype: list
+        :returns: A dictionary for every commit that changed the key,
+            the newest first, see :func:`passpy.git.git_file_history`.
+            ``path`` holds the name of the key after the commit.
+            ``key`` holds the content, ``None`` once the key was
+            removed or if the version could not be decrypted, or
+            ``changes`` the changes if `diff` is ``True``, ``None`` if
+            one of the versions could not be decrypted.
+
+        """
+        if self.repo is None:
+            raise ValueError('The password store has no git repository.')
         path = os.path.normpath(path)
-        path_dir = os.path.join(self.store_dir, path)
-        if path is None or not os.path.isdir(path_dir):
-            raise FileNotFoundError('{0} is not a directory in the '
-                                    'password store.'.format(path))
+        # The change of the oldest version is relative to the one
+        # before it.
+        git_limit = limit + 1 if limit is not None and diff else limit
+        revisions = git_file_history(self.repo, path + '.gpg', git_limit)
+        if len(revisions) == 0:
+            raise FileNotFoundError('{0} has no history.'.format(path))
+
+        shas = list(set(revision['blob'] for revision in revisions
+                        if revision['blob'] is not None))
+        # The cat-file process of a repository can only serve one
+        # thread, so only decrypting is done in parallel.
+        repo = get_git_repository(self.repo.git_dir)
+        try:
+            blobs = dict((sha, git_read_blob(repo, sha)) for sha in shas)
+        finally:
+            repo.close()
+        cache = HistoryCache(self.store_dir, self.backend)
+        texts = cache.get(blobs)
+        missing = [sha for sha in shas if sha not in texts]
+        if len(missing) > 0:
+            def decrypt(sha):
+                try:
+                    key_data = self.backend.decrypt(blobs[sha])
+                except TimeoutError:
+                    raise
+                except OSError:
+                    # E.g. encrypted for a key that is gone by now.
+                    return None
+                try:
+                    return key_data.decode(self.backend.encoding)
+                finally:
+                    wipe(key_data)
+            new_texts = dict((sha, text) for sha, text
+                             in zip(missing, self._map(decrypt, missing))
+                             if text is not None)
+            cache.update(new_texts, blobs)
+            texts.update(new_texts)
+
+        history = []
+        for i, revision in enumerate(revisions):
+            revision = dict(revision)
+            revision['path'] = revision['path'][:-4]
+            text = texts.get(revision['blob'])
+            if diff:
+                if i + 1 == len(revisions) and len(revisions) == git_limit:
+                    break
+                older_blob = None
+                if i + 1 < len(revisions):
+                    older_blob = revisions[i + 1]['blob']
+                if any(blob is not None and blob not in texts
+                       for blob in (older_blob, revision['blob'])):
+                    revision['changes'] = None
+                else:
+                    revision['changes'] = diff_fields(texts.get(older_blob),
+                                                      text)
+            else:
+                revision['key'] = text
+            history.append(revision)
+        return history
 
-        # List keys in lexicographical order.
-        entries = sorted(os.listdir(path_dir), key=str.lower)
-        for entry in entries:
-            # Ignore hidden files and directories as pass does the same.
-            if entry.startswith('.'):
-                continue
-            entry_path = os.path.join(path_dir, entry)
-            entry_path_rel = os.path.relpath(entry_path, self.store_dir)
-            if os.path.isdir(entry_path):
-                yield from self.iter_dir(entry_path_rel)
-            # pass also shows files that do not end on .gpg in
-            # it's overview, but will throw an error if trying to
-            # access these files.  As this would make it harder to
-            # automatically iterate over the keys in the store, we
-            # just show files, that (probably) are in the store.
-            elif entry.endswith('.gpg'):
-                yield entry_path_rel[:-4]
+    @initialised
+    def snapshot(self, rev):
+        """Read keys as they were in an earlier commit.
+
+        :param str rev: Any revision git understands, e.g. ``HEAD~3``
+            or ``master@{2 days ago}``.
+
+        :raises ValueError: if the store has no git repository or
+            `rev` is not a commit.
+
+        :rtype: :class:`passpy.snapshot.SnapshotStore`
+        :returns: A read-only view of the keys at `rev`.  If
+            `cache_size` was given, keys it decrypts are kept in memory
+            by the hash of their blob, like :meth:`get_key` does,
+            shared by all snapshots of the store.  Close the snapshot
+            to stop its git process.
+
+        """
+        if self.repo is None:
+            raise ValueError('The password store has no git repository.')
+        return SnapshotStore(self.repo, rev, self.backend, self._blob_cache)
+
+    @initialised
+    def bundle(self, path, subfolder=''):
+        """Pack the encrypted keys of a directory into a bundle.
+
+        The bundle can be read with :class:`passpy.bundle.BundleStore`
+        on hosts that don't need the whole store.
+
+        :param str path: The path of the bundle to write.
+
+        :param str subfolder: (optional) The directory to pack.  The
+            names in the bundle are relative to it.
+
+        :raises FileNotFoundError: if `subfolder` is not a directory
+            in the password store.
+
+        """
+        subfolder = os.path.normpath(subfolder)
+        prefix_length = 0
+        if subfolder != '.':
+            prefix_length = len(subfolder) + 1
+        write_bundle(path, ((key[prefix_length:],
+                             os.path.join(self.store_dir, key + '.gpg'))
+                            for key in self.iter_dir(subfolder)))
+
+    @initialised
+    def watch(self, callback=None, interval=1.0, use_inotify=None):
+        """Watch the password store for changes.
+
+        All changes are detected, including the ones made by pass, git
+        or other programs, so caches can be invalidated for exactly
+        the keys that changed.  See :class:`passpy.watch.Watcher`.
+
+        :param callback: (optional) If given, it is called with every
+            :class:`passpy.watch.Event` from a background thread.
+        :type callback: function
+
+        :param float interval: (optional) The number of seconds
+            between two scans if inotify is not available.
+
+        :param bool use_inotify: (optional) ``True`` to require
+            inotify, ``False`` to always poll and ``None`` to use
+            inotify if available.
+
+        :rtype: :class:`passpy.watch.Watcher`
+        :returns: The watcher.  Close it when done.
+
+        """
+        watcher = Watcher(self.store_dir, interval, use_inotify)
+        if callback is not None:
+            watcher.start(callback)
+        return watcher
 
     @initialised
     def find(self, names):
@@ -556,13 +2095,40 @@ class Store():
                     break
         return keys
 
+    @cancellable
     @initialised
-    def search(self, term):
+    def search(self, term, path='', name_glob=None, name_regex=None,
+               max_size=None, stats=None):
         """Search through all keys.
 
+        The search can be limited to a subtree, to keys whose names
+        match a pattern and to keys up to a size.  These filters only
+        look at the names and sizes of the key files, so keys they
+        exclude are never decrypted.
+
         :param str term: The term to search for.  The term will be
             compiled as a regular expression.
 
+        :param str path: (optional) Only search the keys below this
+            directory.
+
+        :param str name_glob: (optional) Only search keys whose full
+            name matches this shell-style pattern, e.g. ``prod/db/*``.
+
+        :param str name_regex: (optional) Only search keys whose full
+            name this regular expression is found in.
+
+        :param int max_size: (optional) Only search keys whose
+            encrypted file has at most this many bytes.
+
+        :param dict stats: (optional) Updated with the number of keys
+            the filters ``skipped``, the number of keys ``decrypted``
+            and the number of keys that ``failed`` to decrypt, which
+            are left out of the results.
+
+        :raises FileNotFoundError: if `path` is not a directory in the
+            password store.
+
         :rtype: dict
         :returns: The dictionary has an entry for each key, that
             matched the given term.  The entry for that key then
@@ -572,17 +2138,232 @@ class Store():
         """
         if term is None:
             return {}
+        return dict(self.iter_search(term, path, name_glob, name_regex,
+                                     max_size, stats))
+
+    @initialised
+    @trap(2)
+    def iter_search(self, term, path='', name_glob=None, name_regex=None,
+                    max_size=None, stats=None):
+        """Search through all keys, yielding results as they are found.
 
+        :param str term: The term to search for.  The term will be
+            compiled as a regular expression.
+
+        The other arguments are those of :meth:`search`.
+
+        :rtype: generator
+        :returns: A generator of ``(key, matches)`` tuples for every
+            key that matched, where `matches` is a list of tuples with
+            the line the term was found on and the match object.
+
+        """
         regex = re.compile(term)
-        results = {}
-        for key in self:
-            data = self.get_key(key)
+        keys = self._filter_keys(self.iter_dir(path or '.'), name_glob,
+                                 name_regex, max_size, stats)
+        return self._search_keys(regex, keys, stats)
+
+    def _filter_keys(self, keys, name_glob=None, name_regex=None,
+                     max_size=None, stats=None, prefix=''):
+        """Filter keys by their names and sizes, without decrypting
+        them.
+
+        :param keys: The names of the keys.
+        :type keys: iterable
+
+        :param str prefix: (optional) Put in front of every name
+            before matching it, e.g. the prefix a store is mounted
+            under.
+
+        The other arguments are those of :meth:`search`.
+
+        :rtype: generator
+        :returns: The names of the keys passing all filters.
+
+        """
+        if name_regex is not None:
+            name_regex = re.compile(name_regex)
+        for key in keys:
+            name = prefix + key
+            if ((name_glob is None or fnmatch.fnmatchcase(name, name_glob))
+                    and (name_regex is None
+                         or name_regex.search(name) is not None)
+                    and (max_size is None or os.path.getsize(os.path.join(
+                        self.store_dir, key + '.gpg')) <= max_size)):
+                yield key
+            elif stats is not None:
+                stats['skipped'] = stats.get('skipped', 0) + 1
+
+    def _search_keys(self, regex, keys, stats=None):
+        """Decrypt keys one by one and search them.
+
+        :param regex: The compiled term to search for.
+        :type regex: :class:`re.Pattern`
+
+        :param keys: The names of the keys to search.
+        :type keys: iterable
+
+        :param dict stats: (optional) Updated with the number of keys
+            ``decrypted`` and the number of keys that ``failed``.
+
+        :rtype: generator
+        :returns: See :meth:`iter_search`.
+
+        """
+        if stats is not None:
+            stats.setdefault('skipped', 0)
+            stats.setdefault('decrypted', 0)
+            stats.setdefault('failed', 0)
+        flow = object()
+        for key in keys:
+            try:
+                with job_context(PRIORITY_BULK, flow):
+                    data = self.get_key(key)
+            except TimeoutError:
+                raise
+            except OSError:
+                # Like pass, keys encrypted for someone else are
+                # skipped.
+                if stats is not None:
+                    stats['failed'] += 1
+                continue
+            if stats is not None:
+                stats['decrypted'] += 1
+            matches = []
             for line in data.split('\n'):
                 match = regex.search(line)
                 if match is not None:
-                    if key in results:
-                        results[key].append((line, match))
-                    else:
-                        results[key] = [(line, match)]
+                    matches.append((line, match))
+            if len(matches) > 0:
+                yield key, matches
+
+    @cancellable
+    @initialised
+    def build_index(self):
+        """Create the metadata index or bring it up to date.
+
+        The index holds the ``key: value`` fields of all keys, each
+        encrypted for the gpg ids of its key, and is kept up to date
+        by all writes through passpy once it exists.  Keys changed by
+        other programs are parsed again by :meth:`query`.
+
+        """
+        self._index.create()
+        self._refresh_index()
+
+    @initialised
+    def drop_index(self):
+        """Remove the metadata index.
+        """
+        self._index.delete()
+
+    def _refresh_index(self):
+        """Parse all keys that changed since they were last indexed.
+        """
+        names = self._index.stale()
+        if len(names) == 0:
+            return
+        fields = self._map(lambda name: parse_fields(self.get_key(name)),
+                           names)
+        with self._index.batch():
+            for name, key_fields in zip(names, fields):
+                self._index.update(name, key_fields)
+
+    @cancellable
+    @initialised
+    def query(self, field=None, contains=None, equals=None):
+        """Find keys by their ``key: value`` fields using the metadata
+        index.
+
+        Only keys that changed since they were indexed are decrypted.
+
+        :param str field: (optional) The field to look at, e.g.
+            'url'.  Field names are case insensitive.  All fields are
+            looked at if not given.
+
+        :param str contains: (optional) A string that a value has to
+            contain.
+
+        :param str equals: (optional) A string that a value has to
+            be equal to.
+
+        :raises FileNotFoundError: if no index was created with
+            :meth:`build_index`.
+
+        :rtype: list
+        :returns: The sorted names of all keys with a matching value.
+
+        """
+        if not self._index.exists():
+            raise FileNotFoundError('There is no metadata index, create '
+                                    'one with build_index first.')
+        self._refresh_index()
+        return self._index.query(field, contains, equals)
 
-        return results
+    @cancellable
+    @initialised
+    def audit(self, min_entropy=DEFAULT_MIN_ENTROPY, max_age=None):
+        """Find reused, weak and stale passwords.
+
+        Keys are decrypted in parallel and their passwords, the first
+        line, are only compared by keyed hashes.  The age of all keys
+        comes from a single `git log`, commits that only reencrypted
+        keys don't count.
+
+        :param float min_entropy: (optional) Passwords with less bits
+            of entropy are reported as weak.
+
+        :param int max_age: (optional) Passwords not changed for more
+            days are reported as stale.
+
+        :rtype: dict
+        :returns: See :func:`passpy.audit.build_report`.
+
+        """
+        return build_report(self._audit_entries(os.urandom(32)),
+                            min_entropy, max_age)
+
+    def _audit_entries(self, hash_key):
+        """Hash and rate the passwords of all keys.
+
+        :param bytes hash_key: The key to hash passwords with.
+
+        :rtype: list
+        :returns: The entries for :func:`passpy.audit.build_report`.
+
+        """
+        changes = {}
+        if self.repo is not None:
+            self.flush()
+            changes = git_last_changes(self.repo)
+
+        def audit_key(key):
+            try:
+                key_data = self.get_key_bytes(key)
+            except TimeoutError:
+                raise
+            except OSError:
+                # Like searches, skip keys encrypted for someone else
+                # or broken ones, but report them.
+                return key, None, None, None
+            try:
+                end = key_data.find(b'\n')
+                if end == -1:
+                    end = len(key_data)
+                with memoryview(key_data) as view:
+                    password = view[:end]
+                    digest = None
+                    if len(password) > 0:
+                        digest = hash_password(password, hash_key)
+                    entropy = password_entropy(password)
+                    password.release()
+            finally:
+                wipe(key_data)
+            key_file = key + '.gpg'
+            changed = changes.get(key_file)
+            if changed is None:
+                changed = os.path.getmtime(os.path.join(self.store_dir,
+                                                        key_file))
+            return key, digest, entropy, changed
+
+        return self._map(audit_key, list(self))
@@ -15,12 +15,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import random
+import re
 import shutil
 import string
 
 from functools import wraps
 
+from passpy.cancel import operation_context
 from passpy.exceptions import (
     StoreNotInitialisedError,
     RecursiveCopyMoveError
@@ -93,11 +94,291 @@ def initialised(func):
     return initialised_wrapper
 
 
+def cancellable(func):
+    """Let a method take a `timeout` and a `cancel` argument.
+
+    Used as a decorator in methods for :class:`passpy.store.Store`.
+    `timeout` defaults to :attr:`passpy.store.Store.timeout`.  See
+    :func:`passpy.cancel.operation_context`.
+
+    :param func: A method of :class:`passpy.store.Store`.
+    :type store: function
+
+    :rtype: function
+    :returns: The method, running within the operation context.
+
+    """
+    @wraps(func)
+    def cancellable_wrapper(*args, timeout=None, cancel=None, **kwargs):
+        store = args[0]
+        if timeout is None:
+            timeout = store.timeout
+        with operation_context(timeout, cancel):
+            return func(*args, **kwargs)
+    return cancellable_wrapper
+
+
+# The number of bytes :func:`wipe` overwrites at once.
+_WIPE_CHUNK_SIZE = 64 * 1024
+
+
+def wipe(data):
+    """Overwrite a buffer with zeros.
+
+    :param data: The buffer to wipe.  Immutable objects like
+        :class:`bytes` can't be wiped and are ignored.
+    :type data: bytearray or memoryview
+
+    """
+    if isinstance(data, memoryview):
+        if data.readonly:
+            return
+        data = data.cast('B')
+    elif not isinstance(data, bytearray):
+        return
+    # In chunks, so large buffers don't need a second one as large.
+    zeros = bytes(min(len(data), _WIPE_CHUNK_SIZE))
+    for start in range(0, len(data), _WIPE_CHUNK_SIZE):
+        end = min(start + _WIPE_CHUNK_SIZE, len(data))
+        data[start:end] = zeros[:end - start]
+
+
+def _sort_key(name):
+    """Sort entries alphabetically, ignoring case first.
+    """
+    return (name.lower(), name)
+
+
+#: The directory in the password store that holds passpy's local
+#: state.  It is hidden, so pass ignores it, and never committed.
+STATE_DIR = '.passpy'
+
+# A `key: value` line.  The separator needs to be followed by
+# whitespace or the end of the line, so that URLs like `otpauth://...`
+# are not mistaken for fields.
+_FIELD_RE = re.compile(r'^([^\s:]+):(?:\s+(.*?))?\s*$')
+
+
+def get_state_dir(store_dir):
+    """Get the directory for passpy's local state, creating it if needed.
+
+    :param str store_dir: The path to the password store.
+
+    :rtype: str
+    :returns: The absolute path of the state directory.
+
+    """
+    path = os.path.join(store_dir, STATE_DIR)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+        # Keep the state out of git.
+        with open(os.path.join(path, '.gitignore'), 'w') as ignore_file:
+            ignore_file.write('*\n')
+    return path
+
+
+def parse_field_line(line):
+    """Parse a single ``key: value`` line.
+
+    :param str line: A line of a decrypted key, other than the first.
+
+    :rtype: (str, str)
+    :returns: The name of the field as written and its value, ``''``
+        if it has none.  ``None`` if `line` does not look like a
+        field.
+
+    """
+    match = _FIELD_RE.match(line)
+    if match is None:
+        return None
+    return match.group(1), match.group(2) or ''
+
+
+def parse_fields(key_data):
+    """Parse the ``key: value`` lines of a key.
+
+    Following the convention of pass, the first line holds the
+    password and is never parsed.  Other lines that don't look like a
+    field are ignored.
+
+    :param str key_data: The decrypted key.
+
+    :rtype: dict
+    :returns: The values of all fields, in the order they appear,
+        using the lower case field name as key.
+
+    """
+    fields = {}
+    for line in key_data.split('\n')[1:]:
+        field = parse_field_line(line)
+        if field is not None:
+            fields.setdefault(field[0].lower(), []).append(field[1])
+    return fields
+
+
+#: The character classes available to :class:`PasswordPolicy`.
+CHARACTER_CLASSES = {
+    'lower': string.ascii_lowercase,
+    'upper': string.ascii_uppercase,
+    'digits': string.digits,
+    'symbols': string.punctuation,
+}
+
+
+class PasswordPolicy():
+    """Describes how passwords are generated.
+    """
+    def __init__(self, length, symbols=True, required=None, exclude=''):
+        """Creates a new PasswordPolicy object.
+
+        :param int length: The length of the passwords.
+
+        :param bool symbols: (optional) If ``True``
+            :const:`string.punctuation` will also be used to generate
+            passwords.
+
+        :param list required: (optional) The names of the character
+            classes in :data:`passpy.util.CHARACTER_CLASSES` of which
+            every password has to contain at least one character.
+
+        :param str exclude: (optional) Characters that must never be
+            used.
+
+        :raises ValueError: if the policy can't be fulfilled.
+
+        """
+        self.length = length
+        self.required = []
+
+        classes = ['lower', 'upper', 'digits']
+        if symbols:
+            classes.append('symbols')
+        if required is None:
+            required = []
+        for name in required:
+            if name not in CHARACTER_CLASSES:
+                raise ValueError('Unknown character class {0}.'
+                                 .format(name))
+            if name not in classes:
+                classes.append(name)
+
+        self.chars = ''.join(c for name in classes
+                             for c in CHARACTER_CLASSES[name]
+                             if c not in exclude)
+        for name in required:
+            chars = set(CHARACTER_CLASSES[name]) - set(exclude)
+            if len(chars) == 0:
+                raise ValueError('All characters of class {0} are '
+                                 'excluded.'.format(name))
+            self.required.append(chars)
+        if len(self.chars) == 0:
+            raise ValueError('No characters left to generate passwords '
+                             'from.')
+        if len(self.required) > length:
+            raise ValueError('Passwords of length {0} can\'t contain '
+                             'characters of {1} classes.'
+                             .format(length, len(self.required)))
+
+    def accepts(self, password):
+        """Check that a password contains all required character classes.
+
+        :param str password: The password to check.
+
+        :rtype: bool
+        :returns: ``True`` if `password` has at least one character of
+            every required class.
+
+        """
+        return all(not chars.isdisjoint(password)
+                   for chars in self.required)
+
+
+class _EntropyPool():
+    """Hands out random bytes from :func:`os.urandom` read in bulk.
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, count):
+        """Get `count` random bytes.
+
+        :param int count: The number of bytes to get.
+
+        :rtype: bytes
+        :returns: `count` random bytes.
+
+        """
+        if self.offset + count > len(self.buffer):
+            self.buffer = (self.buffer[self.offset:]
+                           + os.urandom(max(self.size, count)))
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + count]
+        self.offset += count
+        return data
+
+
+def _random_string(chars, length, pool):
+    """Draw a random string from `chars`.
+
+    Uses rejection sampling, so that every character in `chars` is
+    equally likely.
+
+    :param str chars: The characters to choose from.  At most 256
+        characters.
+
+    :param int length: The length of the string.
+
+    :param pool: The source of random bytes.
+    :type pool: :class:`passpy.util._EntropyPool`
+
+    :rtype: str
+    :returns: A random string of length `length`.
+
+    """
+    # Bytes at or above bound would make the first characters of
+    # chars more likely than the rest.
+    bound = 256 - 256 % len(chars)
+    result = []
+    while len(result) < length:
+        missing = length - len(result)
+        result += [chars[byte % len(chars)]
+                   for byte in pool.read(missing + missing // 4 + 1)
+                   if byte < bound]
+    return ''.join(result[:length])
+
+
+def gen_passwords(policies):
+    """Generate a password for each of the given policies.
+
+    Random bytes are read from :func:`os.urandom` in bulk instead of
+    once per character.
+
+    :param list policies: A list of :class:`passpy.util.PasswordPolicy`
+        objects.
+
+    :rtype: list
+    :returns: A list with a random string for every policy in
+        `policies`.
+
+    """
+    pool = _EntropyPool(max(4096, 2 * sum(policy.length
+                                          for policy in policies)))
+    passwords = []
+    for policy in policies:
+        while True:
+            password = _random_string(policy.chars, policy.length, pool)
+            if policy.accepts(password):
+                break
+        passwords.append(password)
+    return passwords
+
+
 def gen_password(length, symbols=True):
     """Generates a random string.
 
-    Uses :class:`random.SystemRandom` if available and
-    :class:`random.Random` otherwise.
+    Uses :func:`os.urandom` as the source of randomness.
 
     :param int length: The length of the random string.
 
@@ -109,16 +390,7 @@ def gen_password(length, symbols=True):
     :returns: A random string of length `length`.
 
     """
-    try:
-        rand = random.SystemRandom()
-    except NotImplementedError:
-        rand = random.Random()
-
-    chars = string.ascii_letters + string.digits
-    if symbols:
-        chars += string.punctuation
-
-    return ''.join(rand.choice(chars) for _ in range(length))
+    return gen_passwords([PasswordPolicy(length, symbols)])[0]
 
 
 def copy_move(src, dst, force=False, move=False, interactive=False,
@@ -0,0 +1,526 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+############
+watch module
+############
+
+Detects changes to the password store, no matter if they were made by
+passpy, pass, git or anyone else.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+
+# inotify constants from <sys/inotify.h>.
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+               | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+               | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# How long to wait for further inotify events after the first one, so
+# that e.g. both halves of a move end up in the same batch.
+_SETTLE_TIME = 0.05
+
+
+class Event():
+    """Base class for all changes reported by
+    :class:`passpy.watch.Watcher`.
+
+    :attr:`path` is the name of the key as used by
+    :class:`passpy.store.Store`.
+
+    """
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def __eq__(self, other):
+        return (type(self) is type(other)
+                and all(getattr(self, slot) == getattr(other, slot)
+                        for slot in self._slots()))
+
+    def __hash__(self):
+        return hash((type(self),) + tuple(getattr(self, slot)
+                                          for slot in self._slots()))
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            repr(getattr(self, slot)) for slot in self._slots()))
+
+    @classmethod
+    def _slots(cls):
+        return [slot for klass in cls.__mro__
+                for slot in getattr(klass, '__slots__', ())]
+
+
+class KeyAdded(Event):
+    """A key has been added.
+    """
+    __slots__ = ()
+
+
+class KeyChanged(Event):
+    """The content of a key has changed.
+    """
+    __slots__ = ()
+
+
+class KeyRemoved(Event):
+    """A key has been removed.
+    """
+    __slots__ = ()
+
+
+class KeyMoved(Event):
+    """A key has been moved from :attr:`old_path` to :attr:`path`.
+    """
+    __slots__ = ('old_path',)
+
+    def __init__(self, old_path, path):
+        super().__init__(path)
+        self.old_path = old_path
+
+
+class GPGIdChanged(Event):
+    """The `.gpg-id` file of the directory :attr:`path` has been
+    added, changed or removed.
+
+    :attr:`path` is ``''`` for the root of the password store.
+
+    """
+    __slots__ = ()
+
+
+def _get_event_name(path):
+    """Get the key or directory name for a file in the store.
+
+    :param str path: The path of a key or `.gpg-id` file relative to
+        the password store.
+
+    :rtype: str
+    :returns: The key name without the '.gpg' ending or the directory
+        of a `.gpg-id` file.
+
+    """
+    if os.path.basename(path) == '.gpg-id':
+        return os.path.dirname(path)
+    return path[:-4]
+
+
+def diff_trees(old_tree, new_tree):
+    """Compare two listings of the password store.
+
+    :param dict old_tree: Maps directories relative to the password
+        store to dictionaries, which map the names of the key and
+        `.gpg-id` files in each directory to their inode, modification
+        time and size.
+
+    :param dict new_tree: The listing to compare `old_tree` to.
+
+    :rtype: list
+    :returns: A list of :class:`passpy.watch.Event` objects.
+
+    """
+    old = {}
+    new = {}
+    for tree, files in ((old_tree, old), (new_tree, new)):
+        for directory, entries in tree.items():
+            for name, stat in entries.items():
+                files[os.path.join(directory, name)] = stat
+
+    events = []
+    removed = {path: stat for path, stat in old.items() if path not in new}
+    moved_from = {stat[0]: path for path, stat in removed.items()
+                  if path.endswith('.gpg')}
+    for path in sorted(new):
+        if path in old:
+            if old[path] == new[path]:
+                continue
+            if path.endswith('.gpg'):
+                events.append(KeyChanged(_get_event_name(path)))
+            else:
+                events.append(GPGIdChanged(_get_event_name(path)))
+        elif not path.endswith('.gpg'):
+            events.append(GPGIdChanged(_get_event_name(path)))
+        elif new[path][0] in moved_from:
+            old_path = moved_from.pop(new[path][0])
+            del removed[old_path]
+            events.append(KeyMoved(_get_event_name(old_path),
+                                   _get_event_name(path)))
+        else:
+            events.append(KeyAdded(_get_event_name(path)))
+    for path in sorted(removed):
+        if path.endswith('.gpg'):
+            events.append(KeyRemoved(_get_event_name(path)))
+        else:
+            events.append(GPGIdChanged(_get_event_name(path)))
+    return events
+
+
+class _Inotify():
+    """Thin wrapper around the Linux inotify API.
+    """
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+        # Maps watch descriptors to directories relative to the store.
+        self.watches = {}
+        self.failed = False
+
+    @classmethod
+    def create(cls):
+        """Create a new inotify instance.
+
+        :rtype: :class:`passpy.watch._Inotify`
+        :returns: The new instance or ``None`` if inotify is not
+            available on this system.
+
+        """
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                               use_errno=True)
+            return cls(libc)
+        except (AttributeError, OSError):
+            return None
+
+    def add_watch(self, path, directory):
+        """Watch a directory.
+
+        :param str path: The absolute path of the directory.
+
+        :param str directory: The directory relative to the store.
+
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         _WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+        elif os.path.isdir(path):
+            # Most likely the limit of watches has been reached.
+            self.failed = True
+
+    def read(self, timeout):
+        """Wait for events.
+
+        :param float timeout: The maximum number of seconds to wait.
+            ``None`` waits forever.
+
+        :rtype: set
+        :returns: The directories relative to the store which have
+            changed, or ``None`` if events have been lost.
+
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        directories = set()
+        if len(ready) == 0:
+            return directories
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self.watches.get(wd)
+                if mask & _IN_IGNORED:
+                    self.watches.pop(wd, None)
+                if directory is not None:
+                    directories.add(directory)
+        if overflow:
+            return None
+        return directories
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher():
+    """Watches a password store for changes.
+
+    Uses inotify on Linux and falls back to rescanning the store
+    periodically everywhere else.  With inotify only directories that
+    actually changed are rescanned.
+
+    A watcher can be used by calling :meth:`poll` in a loop, by
+    iterating over it or by having it call a function for every event
+    in a background thread with :meth:`start`.
+
+    """
+    def __init__(self, store_dir, interval=1.0, use_inotify=None):
+        """Creates a new Watcher object.
+
+        :param str store_dir: The absolute path of the password store.
+
+        :param float interval: (optional) The number of seconds
+            between two scans when polling.
+
+        :param bool use_inotify: (optional) ``True`` to require
+            inotify, ``False`` to always poll and ``None`` to use
+            inotify if available.
+
+        :raises OSError: if `use_inotify` is ``True``, but inotify is
+            not available.
+
+        """
+        self.store_dir = store_dir
+        self.interval = interval
+
+        self._inotify = None
+        if use_inotify is not False:
+            self._inotify = _Inotify.create()
+            if self._inotify is None and use_inotify:
+                raise OSError('inotify is not available.')
+
+        self._tree = self._scan('')
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield from self.poll()
+
+    @property
+    def uses_inotify(self):
+        """``True`` if changes are detected with inotify.
+        """
+        return self._inotify is not None and not self._inotify.failed
+
+    def _scan_dir(self, directory):
+        """List the key and `.gpg-id` files of a single directory.
+
+        :param str directory: The directory relative to the store.
+
+        :rtype: (dict, set)
+        :returns: The files of `directory` with their inode,
+            modification time and size, and its subdirectories.  Both
+            are ``None`` if `directory` does not exist.
+
+        """
+        path = os.path.join(self.store_dir, directory)
+        if self._inotify is not None:
+            self._inotify.add_watch(path, directory)
+        entries = {}
+        subdirs = set()
+        try:
+            with os.scandir(path) as dir_entries:
+                for entry in dir_entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # Hidden directories like .git are not part of
+                        # the store.
+                        if not entry.name.startswith('.'):
+                            subdirs.add(os.path.join(directory, entry.name))
+                    elif (entry.name == '.gpg-id'
+                          or (entry.name.endswith('.gpg')
+                              and not entry.name.startswith('.'))):
+                        stat = entry.stat()
+                        entries[entry.name] = (stat.st_ino, stat.st_mtime_ns,
+                                               stat.st_size)
+        except (FileNotFoundError, NotADirectoryError):
+            return None, None
+        return entries, subdirs
+
+    def _scan(self, directory):
+        """List a directory and all its subdirectories.
+
+        :param str directory: The directory relative to the store.
+
+        :rtype: dict
+        :returns: The listing of every directory, see
+            :func:`passpy.watch.diff_trees`.
+
+        """
+        tree = {}
+        pending = [directory]
+        while len(pending) > 0:
+            directory = pending.pop()
+            entries, subdirs = self._scan_dir(directory)
+            if entries is None:
+                continue
+            tree[directory] = entries
+            pending += subdirs
+        return tree
+
+    def _refresh(self, directories):
+        """Rescan the given directories.
+
+        New subdirectories are scanned completely, removed ones are
+        dropped with all their contents.
+
+        :param set directories: The directories relative to the store
+            to rescan.
+
+        :rtype: list
+        :returns: The list of changes.
+
+        """
+        old_tree = {}
+        new_tree = {}
+        pending = list(directories)
+        while len(pending) > 0:
+            directory = pending.pop()
+            if directory in new_tree:
+                continue
+            entries, subdirs = self._scan_dir(directory)
+            if entries is None:
+                prefix = os.path.join(directory, '')
+                for known in list(self._tree):
+                    if known == directory or known.startswith(prefix):
+                        old_tree[known] = self._tree.pop(known)
+                        new_tree[known] = {}
+                continue
+            old_tree[directory] = self._tree.get(directory, {})
+            new_tree[directory] = entries
+            self._tree[directory] = entries
+            known_subdirs = set(known for known in self._tree
+                                if known != directory
+                                and os.path.dirname(known) == directory)
+            # Both new and vanished subdirectories need a closer look.
+            pending += known_subdirs ^ subdirs
+        return diff_trees(old_tree, new_tree)
+
+    def _rescan(self):
+        """Rescan the whole store.
+
+        :rtype: list
+        :returns: The list of changes.
+
+        """
+        tree = self._scan('')
+        events = diff_trees(self._tree, tree)
+        self._tree = tree
+        return events
+
+    def poll(self, timeout=None):
+        """Wait for changes to the password store.
+
+        :param float timeout: (optional) The maximum number of seconds
+            to wait.  ``None`` waits until something changes, ``0``
+            only checks once.
+
+        :rtype: list
+        :returns: The list of :class:`passpy.watch.Event` objects
+            for all changes since the last call.  Empty if nothing
+            changed within `timeout`.
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+
+            if self.uses_inotify:
+                directories = self._inotify.read(remaining)
+                # Collect the rest of a burst of changes.
+                while directories:
+                    more = self._inotify.read(_SETTLE_TIME)
+                    if more is None:
+                        directories = None
+                    elif len(more) == 0:
+                        break
+                    else:
+                        directories |= more
+                if directories is None:
+                    events = self._rescan()
+                else:
+                    events = self._refresh(directories)
+            else:
+                if remaining is None:
+                    time.sleep(self.interval)
+                else:
+                    time.sleep(min(self.interval, remaining))
+                events = self._rescan()
+
+            if len(events) > 0:
+                return events
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+    def start(self, callback):
+        """Call a function for every change in a background thread.
+
+        :param callback: Called with a :class:`passpy.watch.Event` for
+            every change.
+        :type callback: function
+
+        """
+        def run():
+            while not self._stop.is_set():
+                for event in self.poll(timeout=self.interval):
+                    callback(event)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread started by :meth:`start`.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """Stop watching the password store.
+        """
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
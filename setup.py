@@ -20,12 +20,14 @@ setup(
     packages=['passpy'],
     install_requires=[
         'python-gnupg>=0.3.8',
-        'GitPython>=1.0.1',
+        'GitPython>=3.0',
         'pyperclip>=1.5',
         'click>=2.0',
     ],
     extras_require = {
         'color': ['colorama'],
+        'gpgme': ['gpg'],
+        'rekey': ['PGPy'],
     },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
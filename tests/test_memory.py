@@ -0,0 +1,89 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Memory usage of reading and writing large keys through real gpg.
+"""
+
+import os
+import shutil
+import subprocess
+import tracemalloc
+
+import pytest
+
+from passpy import Store
+from passpy.util import wipe
+
+
+# The size of the key, large enough to dwarf everything else.
+ENTRY_SIZE = 20 * 1024 * 1024
+
+# The highest peak allowed, in multiples of the size of the encrypted
+# key.  Reading needs the encrypted key and the buffer gpg decrypts
+# into, writing the output of gpg as python-gnupg collects it and joins
+# it.  Any further copy of the key would exceed it.
+MAX_PEAK_RATIO = 3
+
+GPG_BIN = shutil.which('gpg2') or shutil.which('gpg')
+
+pytestmark = [
+    pytest.mark.slow,
+    pytest.mark.skipif(GPG_BIN is None, reason='gpg is not installed'),
+]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A password store with a key without passphrase of its own.
+    """
+    gnupghome = tmp_path / 'gnupg'
+    gnupghome.mkdir(mode=0o700)
+    monkeypatch.setenv('GNUPGHOME', str(gnupghome))
+    subprocess.run([GPG_BIN, '--batch', '--passphrase', '',
+                    '--quick-generate-key', 'memory@passpy.test',
+                    'default', 'default', 'never'],
+                   check=True, capture_output=True)
+    store = Store(gpg_bin=GPG_BIN, store_dir=str(tmp_path / 'store'))
+    store.init_store('memory@passpy.test')
+    yield store
+    store.close()
+    subprocess.run(['gpgconf', '--kill', 'gpg-agent'],
+                   capture_output=True)
+
+
+def _peak(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_large_entry_memory(store):
+    key_data = bytearray(os.urandom(ENTRY_SIZE))
+    _, write_peak = _peak(lambda: store.set_key_bytes('large', key_data))
+    size_enc = os.path.getsize(os.path.join(store.store_dir, 'large.gpg'))
+
+    read_data, read_peak = _peak(lambda: store.get_key_bytes('large'))
+    try:
+        assert read_data == key_data
+    finally:
+        wipe(read_data)
+        wipe(key_data)
+
+    assert write_peak <= MAX_PEAK_RATIO * size_enc
+    assert read_peak <= MAX_PEAK_RATIO * size_enc
@@ -0,0 +1,92 @@
+# passpy --  ZX2C4's pass compatible library and cli
+# Copyright (C) 2016 Benedikt Rascher-Friesenhausen <benediktrascherfriesenhausen@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import pytest
+
+from passpy.cancel import (
+    CancellationToken,
+    operation_context
+)
+from passpy.exceptions import (
+    OperationCancelledError,
+    OperationTimeoutError
+)
+from passpy.gpg import (
+    PRIORITY_BULK,
+    GPGScheduler,
+    job_context
+)
+
+
+@pytest.fixture
+def busy_scheduler():
+    """A scheduler whose only job slot is held by a bulk job.
+    """
+    scheduler = GPGScheduler(max_jobs=1)
+    started = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        started.set()
+        done.wait()
+
+    def bulk():
+        with job_context(PRIORITY_BULK):
+            scheduler.run(hold)
+
+    thread = threading.Thread(target=bulk, daemon=True)
+    thread.start()
+    started.wait()
+    yield scheduler
+    done.set()
+    thread.join()
+
+
+def test_queued_job_times_out(busy_scheduler):
+    with operation_context(timeout=0.1):
+        with pytest.raises(OperationTimeoutError):
+            busy_scheduler.run(lambda: None)
+    assert busy_scheduler.metrics()['queued'] == {'interactive': 0,
+                                                  'bulk': 0}
+
+
+def test_queued_job_is_cancelled(busy_scheduler):
+    token = CancellationToken()
+    timer = threading.Timer(0.1, token.cancel)
+    timer.start()
+    try:
+        with operation_context(token=token):
+            with pytest.raises(OperationCancelledError):
+                busy_scheduler.run(lambda: None)
+    finally:
+        timer.cancel()
+
+
+def test_dead_ticket_does_not_block_others():
+    scheduler = GPGScheduler(max_jobs=1)
+    scheduler.acquire()
+    with operation_context(timeout=0.05):
+        with pytest.raises(OperationTimeoutError):
+            scheduler.acquire()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(scheduler.run(lambda: 'ran')))
+    thread.start()
+    scheduler.release()
+    thread.join(5)
+    assert results == ['ran']